@@ -0,0 +1,111 @@
+import errno
+import os
+
+import gevent
+
+
+def wait_for_process(pid):
+    """
+    Wait for the child process ``pid`` to exit and collect its rusage.
+
+    :param pid:
+        An ``int`` representing the ``PID`` of a child process.
+
+    :return:
+        A tuple ``(returncode, rusage)``. Both are ``None`` when the process
+        was reaped by someone else (e.g. the child watcher of gevent), in
+        which case the caller needs to get the return code itself.
+
+    """
+    sleep_duration = 0.01
+
+    while True:
+        try:
+            waited_pid, status, rusage = os.wait4(pid, os.WNOHANG)
+        except OSError as e:
+            if e.errno != errno.ECHILD:
+                raise
+            return None, None
+
+        if waited_pid:
+            if os.WIFSIGNALED(status):
+                return -os.WTERMSIG(status), rusage
+            return os.WEXITSTATUS(status), rusage
+
+        gevent.sleep(sleep_duration)
+        sleep_duration = min(sleep_duration * 2, 0.5)
+
+
+def get_rusage_usage(rusage):
+    """
+    Return the resource usage of a run from ``rusage``.
+
+    :param rusage:
+        A ``resource.struct_rusage`` instance.
+
+    :return:
+        A ``dict``.
+
+    """
+    return {
+        'user_time': rusage.ru_utime,
+        'system_time': rusage.ru_stime,
+        'max_rss_kb': rusage.ru_maxrss,
+        'block_input': rusage.ru_inblock,
+        'block_output': rusage.ru_oublock,
+        'voluntary_switches': rusage.ru_nvcsw,
+        'involuntary_switches': rusage.ru_nivcsw,
+    }
+
+
+class ResourceStats(object):
+    """
+    Resource usage of the runs executed by this worker, aggregated per job.
+    """
+    def __init__(self):
+        self._jobs = {}
+
+    def add(self, job_uri, usage):
+        """
+        Add the resource ``usage`` of a run of ``job_uri``.
+
+        :param job_uri:
+            The URI of the job.
+
+        :param usage:
+            A ``dict`` as returned by :func:`.get_rusage_usage` (including a
+            ``wall_time``).
+
+        """
+        job_stats = self._jobs.setdefault(job_uri, {
+            'runs': 0,
+            'wall_time': 0.0,
+            'cpu_time': 0.0,
+            'max_rss_kb': 0,
+        })
+        job_stats['runs'] += 1
+        job_stats['wall_time'] += usage.get('wall_time', 0)
+        job_stats['cpu_time'] += (
+            usage.get('user_time', 0) + usage.get('system_time', 0))
+        job_stats['max_rss_kb'] = max(
+            job_stats['max_rss_kb'], usage.get('max_rss_kb', 0))
+
+    def get_top(self, count=10):
+        """
+        Return the jobs which used the most CPU time.
+
+        :param count:
+            The maximum number of jobs to return.
+
+        :return:
+            A ``list`` of ``(job_uri, stats)`` tuples.
+
+        """
+        return sorted(
+            self._jobs.items(),
+            key=lambda item: item[1]['cpu_time'],
+            reverse=True
+        )[:count]
+
+
+resource_stats = ResourceStats()
@@ -0,0 +1,181 @@
+import errno
+import logging
+import os
+import signal
+
+from job_runner_worker.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class RunCgroup(object):
+    """
+    A cgroup (v2) for a single run.
+
+    The cgroups are created within ``cgroup_path``, which must be a cgroup
+    delegated to the user running the worker (e.g.
+    ``/sys/fs/cgroup/job-runner-worker``).
+
+    :param run_id:
+        The id of the run.
+
+    """
+    def __init__(self, run_id):
+        self.path = os.path.join(
+            settings.cgroup_path, 'run-{0}'.format(run_id))
+
+    @classmethod
+    def is_enabled(cls):
+        """
+        Return ``True`` when ``cgroup_path`` is set.
+        """
+        return bool(settings.cgroup_path)
+
+    def create(self):
+        """
+        Create the cgroup.
+        """
+        try:
+            os.mkdir(self.path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def add_current_process(self):
+        """
+        Move the calling process into the cgroup.
+
+        This is meant to be called from the ``preexec_fn`` of the run process,
+        so that all its descendants are in the cgroup from the start.
+
+        """
+        with open(os.path.join(self.path, 'cgroup.procs'), 'w') as procs:
+            procs.write(str(os.getpid()))
+
+    def set_limits(self, memory_max=0, cpu_max=0):
+        """
+        Set the memory and CPU limits of the cgroup.
+
+        :param memory_max:
+            The maximum memory usage in bytes (``0`` for no limit).
+
+        :param cpu_max:
+            The maximum number of CPUs to use (e.g. ``1.5``, ``0`` for no
+            limit).
+
+        """
+        if memory_max:
+            with open(os.path.join(self.path, 'memory.max'), 'w') as f:
+                f.write(str(memory_max))
+
+        if cpu_max:
+            period = 100000
+            with open(os.path.join(self.path, 'cpu.max'), 'w') as f:
+                f.write('{0} {1}'.format(int(cpu_max * period), period))
+
+    def get_oom_kills(self):
+        """
+        Return the number of processes killed because of the memory limit.
+        """
+        return self._read_key_values('memory.events').get('oom_kill', 0)
+
+    def get_pids(self):
+        """
+        Return the ``PID``s of the processes in the cgroup.
+        """
+        try:
+            with open(os.path.join(self.path, 'cgroup.procs')) as procs:
+                return [int(pid) for pid in procs.read().split()]
+        except IOError:
+            return []
+
+    def get_usage(self):
+        """
+        Return the resource usage of the processes in the cgroup.
+
+        :return:
+            A ``dict`` containing the ``user_time`` and ``system_time`` (in
+            seconds), and depending on the kernel the ``max_rss_kb`` and the
+            ``read_bytes`` and ``write_bytes``.
+
+        """
+        usage = {}
+
+        cpu_stat = self._read_key_values('cpu.stat')
+        if 'user_usec' in cpu_stat:
+            usage['user_time'] = cpu_stat['user_usec'] / 1000000.0
+            usage['system_time'] = cpu_stat['system_usec'] / 1000000.0
+
+        try:
+            with open(os.path.join(self.path, 'memory.peak')) as peak_file:
+                usage['max_rss_kb'] = int(peak_file.read()) / 1024
+        except (IOError, ValueError):
+            pass
+
+        try:
+            with open(os.path.join(self.path, 'io.stat')) as io_file:
+                io_lines = io_file.read().splitlines()
+        except IOError:
+            io_lines = []
+
+        io_keys = {'rbytes': 'read_bytes', 'wbytes': 'write_bytes'}
+
+        for line in io_lines:
+            # <major>:<minor> rbytes=<int> wbytes=<int> ...
+            for field in line.split()[1:]:
+                key, _, value = field.partition('=')
+                if key in io_keys:
+                    usage[io_keys[key]] = (
+                        usage.get(io_keys[key], 0) + int(value))
+
+        return usage
+
+    def _read_key_values(self, file_name):
+        """
+        Return the content of a flat-keyed cgroup file as ``dict``.
+        """
+        try:
+            with open(os.path.join(self.path, file_name)) as stat_file:
+                lines = stat_file.read().splitlines()
+        except IOError:
+            return {}
+
+        key_values = {}
+        for line in lines:
+            key, _, value = line.partition(' ')
+            try:
+                key_values[key] = int(value)
+            except ValueError:
+                continue
+        return key_values
+
+    def kill(self):
+        """
+        Kill all processes in the cgroup.
+
+        This uses ``cgroup.kill`` when available (Linux 5.14+), else the
+        processes in the cgroup are killed one by one.
+
+        """
+        kill_path = os.path.join(self.path, 'cgroup.kill')
+
+        if os.path.exists(kill_path):
+            with open(kill_path, 'w') as kill_file:
+                kill_file.write('1')
+            return
+
+        for pid in self.get_pids():
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+    def remove(self):
+        """
+        Remove the cgroup (it must not contain any processes anymore).
+        """
+        try:
+            os.rmdir(self.path)
+        except OSError:
+            logger.exception('Unable to remove cgroup {0}'.format(self.path))
@@ -1,6 +1,6 @@
 import logging
 
-from job_runner_worker.config import config
+from job_runner_worker.config import settings
 from job_runner_worker.models import Run
 
 
@@ -15,22 +15,36 @@ def reset_incomplete_runs():
     finished (or was marked as enqueued). These runs needs to be re-started
     and therefore reset to scheduled state.
 
+    Runs are reset while the list is being streamed from the API. Since a
+    reset run drops out of the filtered list (which shifts the pages that are
+    fetched next), the list is scanned again until no new incomplete runs are
+    found.
+
     """
     logger.info('Cleaning up incomplete runs')
-    incomplete_runs = []
+    reset_uris = set()
 
     for state in ['in_queue', 'started']:
-        incomplete_runs.extend(Run.get_list(
-            config.get('job_runner_worker', 'run_resource_uri'),
-            params={
-                'state': state,
-                'worker__api_key': config.get('job_runner_worker', 'api_key'),
-            }
-        ))
-
-    for run in incomplete_runs:
-        logger.warning('Run {0} was left incomplete'.format(run.resource_uri))
-        run.patch({
-            'enqueue_dts': None,
-            'start_dts': None,
-        })
+        while True:
+            num_reset = 0
+
+            for run in Run.iter_list(
+                    settings.run_resource_uri,
+                    params={
+                        'state': state,
+                        'worker__api_key': settings.api_key,
+                    }):
+                if run.resource_uri in reset_uris:
+                    continue
+
+                logger.warning(
+                    'Run {0} was left incomplete'.format(run.resource_uri))
+                run.patch({
+                    'enqueue_dts': None,
+                    'start_dts': None,
+                })
+                reset_uris.add(run.resource_uri)
+                num_reset += 1
+
+            if not num_reset:
+                break
@@ -0,0 +1,261 @@
+import logging
+import multiprocessing
+import os
+
+import gevent
+from gevent.event import Event
+
+from job_runner_worker.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_load_per_cpu():
+    """
+    Return the 1 minute load average divided by the number of CPUs.
+    """
+    return os.getloadavg()[0] / multiprocessing.cpu_count()
+
+
+def get_memory_available(proc_path='/proc'):
+    """
+    Return the fraction of memory which is available (``0.0`` - ``1.0``).
+
+    :param proc_path:
+        The mount point of the proc filesystem.
+
+    :return:
+        A ``float``, or ``None`` when it can not be determined.
+
+    """
+    meminfo = {}
+
+    try:
+        with open(os.path.join(proc_path, 'meminfo')) as meminfo_file:
+            lines = meminfo_file.read().splitlines()
+    except IOError:
+        return None
+
+    for line in lines:
+        # <key>: <value> kB
+        key, _, value = line.partition(':')
+        fields = value.split()
+        if fields and fields[0].isdigit():
+            meminfo[key] = int(fields[0])
+
+    if not meminfo.get('MemTotal') or 'MemAvailable' not in meminfo:
+        return None
+
+    return float(meminfo['MemAvailable']) / meminfo['MemTotal']
+
+
+def get_pressure(proc_path='/proc'):
+    """
+    Return the highest PSI (pressure stall information) of the host.
+
+    This is the highest ``some avg10`` value of the CPU, memory and IO
+    pressure, the percentage of time (over the last 10 seconds) in which at
+    least one task was stalled on that resource.
+
+    :param proc_path:
+        The mount point of the proc filesystem.
+
+    :return:
+        A ``float``, or ``None`` when PSI is not supported (Linux < 4.20 or
+        disabled).
+
+    """
+    pressure = None
+
+    for resource_name in ('cpu', 'memory', 'io'):
+        try:
+            with open(os.path.join(
+                    proc_path, 'pressure', resource_name)) as pressure_file:
+                lines = pressure_file.read().splitlines()
+        except IOError:
+            continue
+
+        for line in lines:
+            # some avg10=0.00 avg60=0.00 avg300=0.00 total=0
+            fields = line.split()
+            if not fields or fields[0] != 'some':
+                continue
+            for field in fields[1:]:
+                key, _, value = field.partition('=')
+                if key == 'avg10':
+                    pressure = max(pressure, float(value))
+
+    return pressure
+
+
+class ConcurrencyController(object):
+    """
+    Limit the number of runs which are executed concurrently.
+
+    Every ``execute_run`` greenlet acquires a slot when a run is waiting, and
+    releases it once the process of the run ended. By default the number of
+    slots is ``concurrent_jobs``. When
+    ``concurrent_jobs_max`` is set, the number of slots is adjusted every
+    ``concurrency_interval`` seconds between ``concurrent_jobs_min`` and
+    ``concurrent_jobs_max``:
+
+    * it is decreased by one when the host is under pressure (load per CPU,
+      available memory or PSI beyond their thresholds);
+    * it is increased by one when all slots are executing a run, runs are
+      waiting in the run queue and the host is not under pressure.
+
+    """
+    def __init__(self):
+        self.limit = None
+        self.active = 0
+        self.run_queue = None
+        self._slot_released = Event()
+        self._greenlet = None
+
+    def is_adaptive(self):
+        """
+        Return ``True`` when the number of slots is adjusted to the host.
+        """
+        return settings.concurrent_jobs_max > 0
+
+    def get_max_slots(self):
+        """
+        Return the maximum number of slots.
+        """
+        return max(settings.concurrent_jobs, settings.concurrent_jobs_max)
+
+    def get_limit(self):
+        """
+        Return the current number of slots.
+        """
+        if self.limit is None:
+            return settings.concurrent_jobs
+        return self.limit
+
+    def set_limit(self, limit):
+        """
+        Set the number of slots to ``limit``.
+        """
+        if limit != self.limit:
+            logger.info('Number of concurrent jobs changed from {0} to '
+                        '{1}'.format(self.limit, limit))
+        self.limit = limit
+        # wake up the waiting greenlets, there might be free slots now
+        self._slot_released.set()
+
+    def acquire(self, exit_event):
+        """
+        Wait for a free slot and take it.
+
+        :param exit_event:
+            An instance of ``gevent.event.Event``.
+
+        :return:
+            ``True`` when a slot was taken, ``False`` when ``exit_event`` was
+            set before.
+
+        """
+        while not exit_event.is_set():
+            if self.active < self.get_limit():
+                self.active += 1
+                return True
+
+            self._slot_released.clear()
+            gevent.wait([self._slot_released, exit_event], count=1)
+
+        return False
+
+    def release(self):
+        """
+        Release a slot taken with :meth:`.acquire`.
+        """
+        self.active -= 1
+        self._slot_released.set()
+
+    def adjust(self):
+        """
+        Adjust the number of slots to the pressure on the host.
+        """
+        limit = self.get_limit()
+        pressure_reason = self._get_pressure_reason()
+
+        if pressure_reason:
+            if limit > settings.concurrent_jobs_min:
+                logger.info('Host is under pressure ({0})'.format(
+                    pressure_reason))
+                self.set_limit(limit - 1)
+        elif (self.active >= limit and self._get_backlog() and
+                limit < settings.concurrent_jobs_max):
+            self.set_limit(limit + 1)
+
+    def _get_backlog(self):
+        """
+        Return the number of runs waiting for a slot.
+        """
+        if self.run_queue is None:
+            return 0
+        return self.run_queue.qsize()
+
+    def _get_pressure_reason(self):
+        """
+        Return why the host is under pressure, or ``None``.
+        """
+        load = get_load_per_cpu()
+        if load > settings.concurrency_max_load:
+            return 'load per CPU: {0:.2f}'.format(load)
+
+        memory_available = get_memory_available()
+        if memory_available is not None and (
+                memory_available < settings.concurrency_min_memory):
+            return 'memory available: {0:.2f}'.format(memory_available)
+
+        pressure = get_pressure()
+        if pressure is not None and (
+                pressure > settings.concurrency_max_pressure):
+            return 'pressure: {0:.2f}'.format(pressure)
+
+        return None
+
+    def start(self, run_queue=None):
+        """
+        Start adjusting the number of slots (when adaptive).
+
+        :param run_queue:
+            The ``Queue`` of runs waiting for a slot. The number of slots is
+            only increased when runs are waiting. Optional.
+
+        """
+        self.run_queue = run_queue
+        self.set_limit(settings.concurrent_jobs)
+
+        if self.is_adaptive() and self._greenlet is None:
+            self._greenlet = gevent.spawn(self._adjust_loop)
+
+    def stop(self):
+        """
+        Stop adjusting the number of slots.
+        """
+        if self._greenlet is not None:
+            self._greenlet.kill()
+            self._greenlet = None
+
+    def _adjust_loop(self):
+        """
+        Call :meth:`.adjust` every ``concurrency_interval`` seconds.
+        """
+        while True:
+            gevent.sleep(settings.concurrency_interval)
+            try:
+                self.adjust()
+            except Exception:
+                logger.exception('Unable to adjust the concurrency')
+
+    def get_stats(self):
+        """
+        Return a ``dict`` with the current ``limit`` and ``active`` slots.
+        """
+        return {'limit': self.get_limit(), 'active': self.active}
+
+
+concurrency_controller = ConcurrencyController()
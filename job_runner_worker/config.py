@@ -2,6 +2,14 @@ import ConfigParser
 import logging
 import os
 
+from job_runner_worker.auth import HmacAuth
+
+
+class ConfigError(Exception):
+    """
+    Exception raised when the configuration is invalid.
+    """
+
 
 def get_config_parser():
     """
@@ -22,15 +30,283 @@ def get_config_parser():
         'run_log_resource_uri': '/api/v1/run_log/',
         'kill_request_resource_uri': '/api/v1/kill_request/',
         'concurrent_jobs': '4',
+        'concurrent_jobs_min': '1',
+        'concurrent_jobs_max': '0',
+        'concurrency_interval': '10',
+        'concurrency_max_load': '1.0',
+        'concurrency_min_memory': '0.1',
+        'concurrency_max_pressure': '20',
+        'run_queue_discipline': 'fifo',
+        'run_priority_field': 'priority',
+        'run_queue_aging': '60',
+        'finalizers': '2',
+        'finalize_backlog': '100',
         'ws_server_port': '5555',
         'broadcaster_server_port': '5556',
         'reconnect_after_inactivity': str(60 * 10),
         'script_temp_path': '/tmp',
+        'script_storage': 'file',
+        'zygote_shebangs': '',
+        'zygote_modules': '',
+        'api_pool_maxsize': '10',
+        'api_idle_timeout': '60',
+        'patch_coalesce_window': '0.5',
+        'worker_cache_ttl': str(60 * 10),
+        'api_retry_base_delay': '2',
+        'api_retry_max_delay': '60',
+        'api_retry_budget': '100',
+        'api_retry_budget_ratio': '0.1',
+        'api_circuit_failure_threshold': '10',
+        'api_circuit_reset_timeout': '30',
+        'script_cache_max_bytes': str(10 * 1024 * 1024),
+        'model_cache_ttl': '5',
+        'api_compress_encoding': '',
+        'api_compress_min_bytes': str(4 * 1024),
+        'outbox_path': '',
+        'outbox_drain_timeout': '30',
+        'outbox_max_attempts': '10',
+        'outbox_park_time': '300',
+        'log_ship_interval': '60',
+        'log_ship_min_bytes': '1',
+        'log_archive_path': '',
+        'log_archive_max_bytes': str(1024 * 1024 * 1024),
+        'log_archive_max_age': str(60 * 60 * 24 * 7),
+        'cgroup_path': '',
+        'resource_usage_field': '',
+        'run_max_address_space': '0',
+        'run_max_cpu_time': '0',
+        'run_max_open_files': '0',
+        'run_nice': '0',
+        'run_timeout': '0',
+        'run_timeout_field': '',
+        'run_timeout_grace': '10',
+        'run_timed_out_field': '',
+        'cgroup_memory_max': '0',
+        'cgroup_cpu_max': '0',
     })
     config.read(os.environ['CONFIG_PATH'])
+
+    # make sure the defaults can be used, even when the config file is
+    # missing
+    if not config.has_section('job_runner_worker'):
+        config.add_section('job_runner_worker')
+
     return config
 
 
+class Settings(object):
+    """
+    Typed snapshot of the ``[job_runner_worker]`` config section.
+
+    All values are converted once when loading the config, so that the rest
+    of the package can read them as plain attributes.
+
+    :param config_parser:
+        Instance of :py:class:`ConfigParser.ConfigParser`.
+
+    """
+    fields = (
+        ('api_base_url', str),
+        ('api_key', str),
+        ('secret', str),
+        ('log_level', str),
+        ('max_log_bytes', int),
+        ('worker_resource_uri', str),
+        ('run_resource_uri', str),
+        ('run_log_resource_uri', str),
+        ('kill_request_resource_uri', str),
+        ('concurrent_jobs', int),
+        ('concurrent_jobs_min', int),
+        ('concurrent_jobs_max', int),
+        ('concurrency_interval', int),
+        ('concurrency_max_load', float),
+        ('concurrency_min_memory', float),
+        ('concurrency_max_pressure', float),
+        ('run_queue_discipline', str),
+        ('run_priority_field', str),
+        ('run_queue_aging', float),
+        ('finalizers', int),
+        ('finalize_backlog', int),
+        ('ws_server_hostname', str),
+        ('ws_server_port', int),
+        ('broadcaster_server_hostname', str),
+        ('broadcaster_server_port', int),
+        ('reconnect_after_inactivity', int),
+        ('script_temp_path', str),
+        ('script_storage', str),
+        ('zygote_shebangs', str),
+        ('zygote_modules', str),
+        ('api_pool_maxsize', int),
+        ('api_idle_timeout', int),
+        ('patch_coalesce_window', float),
+        ('worker_cache_ttl', int),
+        ('api_retry_base_delay', float),
+        ('api_retry_max_delay', float),
+        ('api_retry_budget', int),
+        ('api_retry_budget_ratio', float),
+        ('api_circuit_failure_threshold', int),
+        ('api_circuit_reset_timeout', int),
+        ('script_cache_max_bytes', int),
+        ('model_cache_ttl', float),
+        ('api_compress_encoding', str),
+        ('api_compress_min_bytes', int),
+        ('outbox_path', str),
+        ('outbox_drain_timeout', int),
+        ('outbox_max_attempts', int),
+        ('outbox_park_time', int),
+        ('log_ship_interval', int),
+        ('log_ship_min_bytes', int),
+        ('log_archive_path', str),
+        ('log_archive_max_bytes', int),
+        ('log_archive_max_age', int),
+        ('cgroup_path', str),
+        ('resource_usage_field', str),
+        ('run_max_address_space', int),
+        ('run_max_cpu_time', int),
+        ('run_max_open_files', int),
+        ('run_nice', int),
+        ('run_timeout', int),
+        ('run_timeout_field', str),
+        ('run_timeout_grace', int),
+        ('run_timed_out_field', str),
+        ('cgroup_memory_max', int),
+        ('cgroup_cpu_max', float),
+    )
+
+    required_fields = (
+        'api_base_url',
+        'api_key',
+        'secret',
+        'ws_server_hostname',
+        'broadcaster_server_hostname',
+    )
+
+    __slots__ = tuple([name for name, field_type in fields]) + ('auth', )
+
+    def __init__(self, config_parser):
+        self.load(config_parser)
+
+    def load(self, config_parser):
+        """
+        Load the settings from the given ``config_parser``.
+
+        All values are converted before any attribute is updated, so on
+        error the current settings are left untouched.
+
+        :param config_parser:
+            Instance of :py:class:`ConfigParser.ConfigParser`.
+
+        :raises:
+            :exc:`.ConfigError` when a value can not be converted.
+
+        """
+        values = []
+
+        for name, field_type in self.fields:
+            value = None
+
+            if config_parser.has_option('job_runner_worker', name):
+                value = config_parser.get('job_runner_worker', name)
+                try:
+                    value = field_type(value)
+                except ValueError:
+                    raise ConfigError('Invalid value for {0}: {1}'.format(
+                        name, value))
+
+            values.append((name, value))
+
+        for name, value in values:
+            setattr(self, name, value)
+
+        self.auth = HmacAuth(self.api_key, self.secret)
+
+    def validate(self):
+        """
+        Validate the settings.
+
+        :raises:
+            :exc:`.ConfigError` when a required setting is missing or a
+            setting is out of range.
+
+        """
+        for name in self.required_fields:
+            if not getattr(self, name):
+                raise ConfigError('Missing required setting: {0}'.format(name))
+
+        if self.concurrent_jobs < 1:
+            raise ConfigError('concurrent_jobs must be at least 1')
+
+        if self.concurrent_jobs_max and not (
+                1 <= self.concurrent_jobs_min <= self.concurrent_jobs <=
+                self.concurrent_jobs_max):
+            raise ConfigError(
+                'concurrent_jobs must be between concurrent_jobs_min (at '
+                'least 1) and concurrent_jobs_max')
+
+        if self.concurrency_interval < 1:
+            raise ConfigError('concurrency_interval must be at least 1')
+
+        if self.outbox_max_attempts < 1:
+            raise ConfigError('outbox_max_attempts must be at least 1')
+
+        if self.finalizers < 1:
+            raise ConfigError('finalizers must be at least 1')
+
+        if self.finalize_backlog < 1:
+            raise ConfigError('finalize_backlog must be at least 1')
+
+        if self.max_log_bytes < 1:
+            raise ConfigError('max_log_bytes must be at least 1')
+
+        for name in (
+                'run_max_address_space', 'run_max_cpu_time',
+                'run_max_open_files', 'run_nice', 'run_timeout',
+                'run_timeout_grace', 'cgroup_memory_max', 'cgroup_cpu_max'):
+            if getattr(self, name) < 0:
+                raise ConfigError('{0} can not be negative'.format(name))
+
+        if self.run_queue_discipline not in ('fifo', 'priority', 'deadline'):
+            raise ConfigError(
+                'run_queue_discipline must be fifo, priority or deadline')
+
+        if self.run_queue_aging < 0:
+            raise ConfigError('run_queue_aging can not be negative')
+
+        if self.script_storage not in ('file', 'memfd'):
+            raise ConfigError('script_storage must be file or memfd')
+
+        if self.api_compress_encoding not in ('', 'gzip', 'deflate'):
+            raise ConfigError(
+                'api_compress_encoding must be gzip, deflate or empty')
+
+
+def reload_settings():
+    """
+    Re-read the config file and update :data:`.settings` in place.
+
+    The callbacks registered with :func:`.register_reload_callback` are
+    called once the settings have been updated.
+
+    :raises:
+        :exc:`.ConfigError` when the new config is invalid. In that case the
+        current settings are kept.
+
+    """
+    config_parser = get_config_parser()
+    Settings(config_parser).validate()
+    settings.load(config_parser)
+
+    for callback in _reload_callbacks:
+        callback()
+
+
+def register_reload_callback(callback):
+    """
+    Register a ``callback`` to call after the settings have been reloaded.
+    """
+    _reload_callbacks.append(callback)
+
+
 def setup_log_handler(log_level):
     """
     Setup log handling.
@@ -52,4 +328,5 @@ def setup_log_handler(log_level):
     )
 
 
-config = get_config_parser()
+_reload_callbacks = []
+settings = Settings(get_config_parser())
@@ -2,22 +2,25 @@ import json
 import logging
 import random
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 
 import zmq.green as zmq
-from gevent.queue import Empty
 from pytz import utc
 
 import job_runner_worker
-from job_runner_worker.config import config
-from job_runner_worker.models import KillRequest, Run, Worker
+from job_runner_worker.concurrency import concurrency_controller
+from job_runner_worker.config import settings
+from job_runner_worker.models import (
+    KillRequest, RequestClientError, Run, worker_cache)
+from job_runner_worker.queues import call_or_exit
+from job_runner_worker.retry import get_api_health
 
 
 logger = logging.getLogger(__name__)
 
 
 def enqueue_actions(
-        zmq_context, run_queue, kill_queue, event_queue, exit_queue):
+        zmq_context, run_queue, kill_queue, event_queue, exit_event):
     """
     Handle incoming actions sent by the broadcaster.
 
@@ -33,51 +36,41 @@ def enqueue_actions(
     :param event_queue:
         An instance of ``Queue`` for pushing events to.
 
-    :param exit_queue:
-        An instance of ``Queue`` to consume from. If this queue is not empty,
-        the function needs to terminate.
+    :param exit_event:
+        An instance of ``Event``. When it is set, the function needs to
+        terminate.
 
     """
     logger.info('Starting enqueue loop')
     subscriber = _get_subscriber(zmq_context)
 
-    expected_address = 'master.broadcast.{0}'.format(
-        config.get('job_runner_worker', 'api_key'))
+    expected_address = 'master.broadcast.{0}'.format(settings.api_key)
 
-    last_activity_dts = datetime.utcnow()
-    reconnect_after_inactivity = config.getint(
-        'job_runner_worker', 'reconnect_after_inactivity')
+    reconnect_after_inactivity = settings.reconnect_after_inactivity
 
     while True:
-        try:
-            exit_queue.get(block=False)
+        receiver = call_or_exit(
+            subscriber.recv_multipart, exit_event, reconnect_after_inactivity)
+
+        if exit_event.is_set():
             logger.info('Termintating enqueue loop')
-            return
-        except Empty:
-            pass
+            break
 
-        try:
-            address, content = subscriber.recv_multipart(zmq.NOBLOCK)
-            last_activity_dts = datetime.utcnow()
-        except zmq.ZMQError:
+        if receiver is None:
             # this is needed in case the ZMQ publisher is load-balanced and the
             # loadbalancer dropped the connection to the backend, but not the
             # connection to our side. without this work-around, zmq will think
             # that all is well, and we won't receive anything anymore
-            delta = datetime.utcnow() - last_activity_dts
-            if delta > timedelta(seconds=reconnect_after_inactivity):
-                logger.warning(
-                    'There was not activity for {0}, reconnecting'
-                    ' to publisher'.format(delta)
-                )
-                subscriber.close()
-                time.sleep(random.randint(1, 10))
-                subscriber = _get_subscriber(zmq_context)
-                last_activity_dts = datetime.utcnow()
-                continue
-            else:
-                time.sleep(0.5)
-                continue
+            logger.warning(
+                'There was not activity for {0} seconds, reconnecting'
+                ' to publisher'.format(reconnect_after_inactivity)
+            )
+            subscriber.close()
+            time.sleep(random.randint(1, 10))
+            subscriber = _get_subscriber(zmq_context)
+            continue
+
+        address, content = receiver.get()
 
         # since zmq is subscribed to everything that starts with the given
         # prefix, we have to do a double check to make sure this is an exact
@@ -106,11 +99,11 @@ def _get_subscriber(zmq_context):
     """
     subscriber = zmq_context.socket(zmq.SUB)
     subscriber.connect('tcp://{0}:{1}'.format(
-        config.get('job_runner_worker', 'broadcaster_server_hostname'),
-        config.get('job_runner_worker', 'broadcaster_server_port'),
+        settings.broadcaster_server_hostname,
+        settings.broadcaster_server_port,
     ))
-    subscriber.setsockopt(zmq.SUBSCRIBE, 'master.broadcast.{0}'.format(
-        config.get('job_runner_worker', 'api_key')))
+    subscriber.setsockopt(
+        zmq.SUBSCRIBE, 'master.broadcast.{0}'.format(settings.api_key))
     return subscriber
 
 
@@ -118,28 +111,25 @@ def _handle_enqueue_action(message, run_queue, event_queue):
     """
     Handle the ``'enqueue'`` action.
     """
-    run = Run('{0}{1}/'.format(
-        config.get('job_runner_worker', 'run_resource_uri'),
-        message['run_id']
-    ))
+    run = Run('{0}{1}/'.format(settings.run_resource_uri, message['run_id']))
 
-    worker_list = Worker.get_list(
-        config.get('job_runner_worker', 'worker_resource_uri')
-    )
+    worker = worker_cache.get()
 
     if run.enqueue_dts:
         logger.warning(
             'Was expecting that run: {0} was not in queue yet'.format(
                 run.id))
-    elif len(worker_list) != 1:
-        logger.warning('API returned multiple workers, expected one')
-    else:
-        run.patch({
-            'enqueue_dts': datetime.now(utc).isoformat(' '),
-            # set the worker so we know which worker of the pool claimed the
-            # run
-            'worker': worker_list[0].resource_uri,
-        })
+    elif worker:
+        try:
+            run.patch({
+                'enqueue_dts': datetime.now(utc).isoformat(' '),
+                # set the worker so we know which worker of the pool claimed
+                # the run
+                'worker': worker.resource_uri,
+            })
+        except RequestClientError:
+            worker_cache.invalidate()
+            raise
         run_queue.put(run)
         event_queue.put(json.dumps(
             {'event': 'enqueued', 'run_id': run.id, 'kind': 'run'}))
@@ -150,7 +140,7 @@ def _handle_kill_action(message, kill_queue, event_queue):
     Handle the ``'kill'`` action.
     """
     kill_request = KillRequest('{0}{1}/'.format(
-        config.get('job_runner_worker', 'kill_request_resource_uri'),
+        settings.kill_request_resource_uri,
         message['kill_request_id']
     ))
 
@@ -174,16 +164,20 @@ def _handle_ping_action(message):
     """
     Handle the ``'ping'`` action.
     """
-    worker_list = Worker.get_list(
-        config.get('job_runner_worker', 'worker_resource_uri')
-    )
-
-    if len(worker_list) == 1:
-        worker_list[0].patch({
-            'ping_response_dts': datetime.now(utc).isoformat(' '),
-            'worker_version': job_runner_worker.__version__,
-            'concurrent_jobs': config.getint(
-                'job_runner_worker', 'concurrent_jobs')
-        })
-    else:
-        logger.warning('API returned multiple workers, expected one')
+    worker = worker_cache.get()
+
+    if worker:
+        try:
+            worker.patch({
+                'ping_response_dts': datetime.now(utc).isoformat(' '),
+                'worker_version': job_runner_worker.__version__,
+                # the effective number, which is adjusted to the host when
+                # concurrent_jobs_max is set
+                'concurrent_jobs': concurrency_controller.get_limit(),
+            })
+        except RequestClientError:
+            worker_cache.invalidate()
+            raise
+
+    logger.debug('Worker cache stats: {0}'.format(worker_cache.get_stats()))
+    logger.debug('API health: {0}'.format(get_api_health()))
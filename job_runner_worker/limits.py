@@ -0,0 +1,113 @@
+import os
+import resource
+import signal
+
+from job_runner_worker.config import settings
+
+
+def get_rlimits():
+    """
+    Return the resource limits to apply to a run.
+
+    :return:
+        A ``list`` of ``(resource, (soft_limit, hard_limit))`` tuples.
+
+    """
+    rlimits = []
+
+    if settings.run_max_address_space:
+        rlimits.append((
+            resource.RLIMIT_AS,
+            (settings.run_max_address_space, settings.run_max_address_space),
+        ))
+
+    if settings.run_max_cpu_time:
+        # the process receives SIGXCPU at the soft limit and is killed one
+        # second later if it is still running
+        rlimits.append((
+            resource.RLIMIT_CPU,
+            (settings.run_max_cpu_time, settings.run_max_cpu_time + 1),
+        ))
+
+    if settings.run_max_open_files:
+        rlimits.append((
+            resource.RLIMIT_NOFILE,
+            (settings.run_max_open_files, settings.run_max_open_files),
+        ))
+
+    return rlimits
+
+
+def apply_process_limits(rlimits, nice=0):
+    """
+    Apply ``rlimits`` and ``nice`` to the current process.
+
+    This is meant to be called from the ``preexec_fn`` of the run process.
+
+    :param rlimits:
+        A ``list`` as returned by :func:`.get_rlimits`.
+
+    :param nice:
+        The increment of the nice level.
+
+    """
+    for resource_type, limits in rlimits:
+        resource.setrlimit(resource_type, limits)
+
+    if nice:
+        os.nice(nice)
+
+
+def get_run_timeout(run):
+    """
+    Return the wall-clock timeout of ``run`` in seconds (``0`` for none).
+
+    The ``run_timeout_field`` of the job (when set and positive) overrides
+    the default ``run_timeout``.
+
+    """
+    if settings.run_timeout_field:
+        try:
+            timeout = int(run.job.get_attribute(settings.run_timeout_field, 0))
+        except (TypeError, ValueError):
+            timeout = 0
+        if timeout > 0:
+            return timeout
+
+    return settings.run_timeout
+
+
+def get_limit_failure(returncode, usage=None, cgroup=None):
+    """
+    Return the reason why a run was stopped by one of its limits.
+
+    :param returncode:
+        The return code of the run process.
+
+    :param usage:
+        A ``dict`` containing the resource usage of the run. Optional.
+
+    :param cgroup:
+        An instance of :class:`.RunCgroup`. Optional.
+
+    :return:
+        A ``str`` describing the limit which was hit, or ``None``.
+
+    """
+    if cgroup is not None and cgroup.get_oom_kills():
+        return 'Run was killed because it exceeded the memory limit of ' \
+            '{0} bytes (cgroup_memory_max)'.format(settings.cgroup_memory_max)
+
+    if settings.run_max_cpu_time and returncode in (
+            -signal.SIGXCPU, -signal.SIGKILL):
+        cpu_time = 0
+        if usage:
+            cpu_time = usage.get('user_time', 0) + usage.get('system_time', 0)
+
+        if returncode == -signal.SIGXCPU or (
+                cpu_time >= settings.run_max_cpu_time):
+            return 'Run was killed because it exceeded the CPU time limit ' \
+                'of {0} seconds (run_max_cpu_time)'.format(
+                    settings.run_max_cpu_time)
+
+    return None
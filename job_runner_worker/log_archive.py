@@ -0,0 +1,229 @@
+import gzip
+import logging
+import os
+import re
+import time
+
+from job_runner_worker.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+FILE_RE = re.compile(r'^run-(\d+)\.log\.gz$')
+
+# expired output is removed at most once per interval (in seconds), so the
+# archive isn't listed every time output is added
+EVICT_INTERVAL = 60 * 60
+
+
+class ArchiveWriter(object):
+    """
+    Writes the output of a run to the archive.
+
+    The output is compressed while writing, to a temporary file which
+    replaces the archived output (if any) when closed.
+
+    :param archive:
+        An instance of :class:`.LogArchive`.
+
+    :param run_id:
+        The id of the run.
+
+    """
+    def __init__(self, archive, run_id):
+        self.archive = archive
+        self.path = archive.get_path(run_id)
+        self._partial_path = self.path + '.partial'
+        self._file = open(self._partial_path, 'wb')
+        # level 6 is several times faster than the default of 9, while the
+        # result is hardly bigger
+        self._gzip_file = gzip.GzipFile(
+            fileobj=self._file, mode='wb', compresslevel=6)
+        self.failed = False
+
+    def write(self, data):
+        """
+        Write ``data`` to the archive.
+
+        Errors (e.g. a full disk) are logged, after which the output is no
+        longer archived, so they don't affect the run itself.
+
+        """
+        if self.failed:
+            return
+
+        try:
+            self._gzip_file.write(data)
+        except (IOError, OSError):
+            logger.exception('Unable to archive output to {0}'.format(
+                self.path))
+            self.failed = True
+
+    def close(self):
+        """
+        Close the archived output and evict old output (when needed).
+
+        :return:
+            ``True`` when the complete output was archived.
+
+        """
+        try:
+            self._gzip_file.close()
+            self._file.close()
+        except (IOError, OSError):
+            logger.exception('Unable to archive output to {0}'.format(
+                self.path))
+            self.failed = True
+
+        if self.failed:
+            self.archive._remove(self._partial_path)
+            return False
+
+        try:
+            os.rename(self._partial_path, self.path)
+        except OSError:
+            logger.exception('Unable to archive output to {0}'.format(
+                self.path))
+            self.failed = True
+            return False
+
+        try:
+            self.archive.add(self.path)
+        except OSError:
+            logger.exception('Unable to evict archived output')
+
+        return True
+
+
+class LogArchive(object):
+    """
+    Local archive of the complete output of runs.
+
+    The output sent to the API is truncated to ``max_log_bytes``. When
+    ``log_archive_path`` is set, the complete output of every run is also
+    stored in this directory, gzip compressed, as ``run-<id>.log.gz``.
+
+    Archived output older than ``log_archive_max_age`` seconds is removed,
+    and when the archive is larger than ``log_archive_max_bytes``, the least
+    recently used output is removed (reading output marks it as used).
+
+    The size of the archive is tracked while output is added, so it is only
+    listed when it grew too large, or ``EVICT_INTERVAL`` seconds after the
+    last eviction.
+
+    """
+    def __init__(self):
+        self.total_bytes = None
+        self._evicted_at = None
+
+    def is_enabled(self):
+        """
+        Return ``True`` when ``log_archive_path`` is set.
+        """
+        return bool(settings.log_archive_path)
+
+    def get_path(self, run_id):
+        """
+        Return the path of the archived output of ``run_id``.
+        """
+        return os.path.join(
+            settings.log_archive_path, 'run-{0}.log.gz'.format(run_id))
+
+    def open(self, run_id):
+        """
+        Return an :class:`.ArchiveWriter` for the output of ``run_id``.
+        """
+        return ArchiveWriter(self, run_id)
+
+    def read(self, run_id):
+        """
+        Return the archived output of ``run_id``.
+
+        :return:
+            A ``str``, or ``None`` when the output is not (or no longer) in
+            the archive.
+
+        """
+        path = self.get_path(run_id)
+
+        try:
+            gzip_file = gzip.open(path, 'rb')
+        except IOError:
+            return None
+
+        try:
+            content = gzip_file.read()
+        finally:
+            gzip_file.close()
+
+        os.utime(path, None)
+        return content
+
+    def add(self, path):
+        """
+        Add the size of the output archived at ``path`` to the archive, and
+        evict output when needed.
+        """
+        size = os.path.getsize(path)
+
+        if (self.total_bytes is None or
+                self.total_bytes + size > settings.log_archive_max_bytes or
+                time.time() - self._evicted_at > EVICT_INTERVAL):
+            self.evict()
+        else:
+            self.total_bytes += size
+
+    def evict(self):
+        """
+        Remove expired output, and the least recently used output while the
+        archive is larger than ``log_archive_max_bytes``.
+
+        Temporary files left by a worker which crashed are removed once they
+        expired.
+
+        """
+        files = []
+        now = time.time()
+
+        for name in os.listdir(settings.log_archive_path):
+            path = os.path.join(settings.log_archive_path, name)
+            partial = name.endswith('.partial')
+
+            if not partial and not FILE_RE.match(name):
+                continue
+
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            # the file of a running job is updated while it is running
+            expired = now - stat.st_mtime > settings.log_archive_max_age
+            if partial and not expired:
+                continue
+
+            if expired:
+                self._remove(path)
+            else:
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total_bytes = sum([size for mtime, size, path in files])
+
+        for mtime, size, path in sorted(files):
+            if total_bytes <= settings.log_archive_max_bytes:
+                break
+            self._remove(path)
+            total_bytes -= size
+
+        self.total_bytes = total_bytes
+        self._evicted_at = now
+
+    def _remove(self, path):
+        logger.debug('Removing archived output {0}'.format(path))
+        try:
+            os.remove(path)
+        except OSError:
+            logger.exception('Unable to remove {0}'.format(path))
+
+
+log_archive = LogArchive()
@@ -0,0 +1,116 @@
+import logging
+
+import gevent
+from gevent.event import Event
+
+from job_runner_worker.config import settings
+from job_runner_worker.models import RunLog
+
+
+logger = logging.getLogger(__name__)
+
+
+class LogShipper(object):
+    """
+    Ship the output of a run to the API while the run is executing.
+
+    Every ``log_ship_interval`` seconds, the (truncated) output captured so
+    far is stored in the log resource of the run, provided that at least
+    ``log_ship_min_bytes`` of new output was captured. The log resource is
+    created on the first shipment. Shipping is best-effort: the final log is
+    still sent when the run has ended.
+
+    :param run:
+        An instance of :class:`.Run`.
+
+    :param run_reload:
+        The greenlet reloading ``run``, started when the run was started.
+
+    :param output:
+        An instance of :class:`.OutputCapture`.
+
+    """
+    def __init__(self, run, run_reload, output):
+        self.run = run
+        self.run_reload = run_reload
+        self.output = output
+        self.run_log = None
+        self.shipments = 0
+        self.interrupted = False
+        self._shipping = False
+        self._shipped_bytes = 0
+        self._stop_event = Event()
+        self._greenlet = None
+
+    def start(self):
+        """
+        Start shipping (unless ``log_ship_interval`` is ``0``).
+        """
+        if settings.log_ship_interval > 0:
+            self._greenlet = gevent.spawn(self._ship_loop)
+
+    def stop(self):
+        """
+        Stop shipping.
+
+        A shipment which is in progress is killed rather than waited for, so
+        a slow API doesn't delay the end of the run (the final log replaces
+        the shipped content anyway). When this happens, :attr:`interrupted`
+        is set, since the log resource might have been created meanwhile.
+
+        """
+        if self._greenlet is None:
+            return
+
+        self._stop_event.set()
+        if self._shipping:
+            self.interrupted = True
+        self._greenlet.kill()
+        self._greenlet = None
+
+    def _ship_loop(self):
+        """
+        Ship the output every ``log_ship_interval`` seconds.
+        """
+        while not self._stop_event.wait(settings.log_ship_interval):
+            new_bytes = self.output.total_bytes - self._shipped_bytes
+            if new_bytes < max(settings.log_ship_min_bytes, 1):
+                continue
+
+            self._shipping = True
+            try:
+                self.ship()
+            except Exception:
+                logger.exception('Unable to ship log of {0}'.format(
+                    self.run.resource_uri))
+            finally:
+                self._shipping = False
+
+    def ship(self):
+        """
+        Store the output captured so far in the log resource of the run.
+        """
+        total_bytes = self.output.total_bytes
+        content = self.output.getvalue()
+
+        if self.run_log is None:
+            self.run_reload.join()
+            self.run_log = self.run.run_log
+
+        if self.run_log is None:
+            run_log_path = RunLog(settings.run_log_resource_uri).post({
+                'run': '{0}{1}/'.format(
+                    settings.run_resource_uri, self.run.id),
+                'content': content,
+            })
+
+            if run_log_path:
+                self.run_log = RunLog(run_log_path)
+            else:
+                self.run.reload()
+                self.run_log = self.run.run_log
+        else:
+            self.run_log.patch({'content': content})
+
+        self._shipped_bytes = total_bytes
+        self.shipments += 1
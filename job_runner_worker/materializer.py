@@ -0,0 +1,227 @@
+import ctypes
+import errno
+import logging
+import os
+
+from job_runner_worker.config import settings
+from job_runner_worker.script_cache import script_cache
+
+
+logger = logging.getLogger(__name__)
+
+FILE_PREFIX = 'job-runner-worker-'
+MFD_CLOEXEC = 1
+
+
+def _memfd_create(name):
+    """
+    Create an anonymous in-memory file and return its file descriptor.
+
+    :raises:
+        :exc:`OSError` when ``memfd_create`` is not supported.
+
+    """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        memfd_create = libc.memfd_create
+    except (AttributeError, OSError):
+        raise OSError(errno.ENOSYS, 'memfd_create is not available')
+
+    fd = memfd_create(name, MFD_CLOEXEC)
+    if fd < 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+    return fd
+
+
+class MaterializedScript(object):
+    """
+    A job script written to a file which can be passed to its interpreter.
+
+    :param content_hash:
+        The hash of the script content.
+
+    :param path:
+        The path of the file.
+
+    :param fd:
+        The file descriptor of the memfd (``None`` for regular files).
+
+    """
+    __slots__ = ('content_hash', 'path', 'fd', 'refs')
+
+    def __init__(self, content_hash, path, fd=None):
+        self.content_hash = content_hash
+        self.path = path
+        self.fd = fd
+        self.refs = 0
+
+
+class ScriptMaterializer(object):
+    """
+    Write job scripts to files, so they can be executed.
+
+    Depending on ``script_storage`` a script is written to an anonymous
+    memfd (``memfd``, executed through ``/proc/<pid>/fd/<fd>``) or to a file
+    in ``script_temp_path`` (``file``, which can be a tmpfs). When memfd is
+    not supported, files are used instead.
+
+    A script is materialized once per content hash and shared by all runs
+    using it. It is kept while its script is in the script cache, so
+    following runs of the same job can use it as well.
+
+    """
+    def __init__(self):
+        self._scripts = {}
+        self._memfd_supported = True
+
+    def acquire(self, cached_script):
+        """
+        Return the path of the materialized ``cached_script``.
+
+        Every call must be followed by a call to :meth:`.release`.
+
+        :param cached_script:
+            An instance of :class:`.CachedScript`.
+
+        :return:
+            The path of the file.
+
+        """
+        script = self._scripts.get(cached_script.content_hash)
+
+        if script is None:
+            content = cached_script.content.replace('\r', '').encode('utf-8')
+            script = self._write(cached_script.content_hash, content)
+            self._scripts[script.content_hash] = script
+
+        script.refs += 1
+        return script.path
+
+    def release(self, path):
+        """
+        Release the materialized script at ``path``.
+
+        Scripts which are not used anymore and which are no longer in the
+        script cache are removed.
+
+        :param path:
+            The path as returned by :meth:`.acquire`.
+
+        """
+        for script in self._scripts.values():
+            if script.path == path:
+                script.refs -= 1
+                break
+
+        cached_hashes = script_cache.get_content_hashes()
+
+        for script in self._scripts.values():
+            if script.refs <= 0 and script.content_hash not in cached_hashes:
+                self._remove(script)
+
+    def clear(self):
+        """
+        Remove all materialized scripts.
+        """
+        for script in self._scripts.values():
+            self._remove(script)
+
+    def collect_garbage(self):
+        """
+        Remove the script files left by worker processes which are gone.
+
+        The files are named after the ``PID`` of the worker which created
+        them, so files of other workers sharing ``script_temp_path`` are
+        left alone.
+
+        """
+        try:
+            names = os.listdir(settings.script_temp_path)
+        except OSError:
+            logger.exception('Unable to list {0}'.format(
+                settings.script_temp_path))
+            return
+
+        for name in names:
+            if not name.startswith(FILE_PREFIX):
+                continue
+
+            pid = name[len(FILE_PREFIX):].split('-', 1)[0]
+            if not pid.isdigit() or _is_running(int(pid)):
+                continue
+
+            path = os.path.join(settings.script_temp_path, name)
+            logger.info('Removing left-over script {0}'.format(path))
+            try:
+                os.remove(path)
+            except OSError:
+                logger.exception('Unable to remove {0}'.format(path))
+
+    def _write(self, content_hash, content):
+        """
+        Write ``content`` to a memfd or file and return the script.
+        """
+        if settings.script_storage == 'memfd' and self._memfd_supported:
+            try:
+                fd = _memfd_create(FILE_PREFIX + content_hash)
+            except OSError:
+                logger.exception('Unable to use memfd, using files instead')
+                self._memfd_supported = False
+            else:
+                _write_all(fd, content)
+                return MaterializedScript(
+                    content_hash,
+                    '/proc/{0}/fd/{1}'.format(os.getpid(), fd),
+                    fd,
+                )
+
+        path = os.path.join(settings.script_temp_path, '{0}{1}-{2}'.format(
+            FILE_PREFIX, os.getpid(), content_hash))
+        # write to a temporary name first, so a half-written script is never
+        # executed
+        temp_path = path + '.tmp'
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600)
+        try:
+            _write_all(fd, content)
+        finally:
+            os.close(fd)
+        os.rename(temp_path, path)
+        return MaterializedScript(content_hash, path)
+
+    def _remove(self, script):
+        """
+        Remove ``script`` from the materialized scripts.
+        """
+        del self._scripts[script.content_hash]
+
+        try:
+            if script.fd is not None:
+                os.close(script.fd)
+            else:
+                os.remove(script.path)
+        except OSError:
+            logger.exception('Unable to remove script {0}'.format(
+                script.path))
+
+
+def _write_all(fd, content):
+    """
+    Write all of ``content`` to ``fd``.
+    """
+    while content:
+        content = content[os.write(fd, content):]
+
+
+def _is_running(pid):
+    """
+    Return ``True`` when a process with ``pid`` exists.
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+script_materializer = ScriptMaterializer()
@@ -1,16 +1,25 @@
 import json
 import logging
-import requests
+import random
 import time
 import urlparse
+import zlib
+
+import gevent
+from gevent.lock import Semaphore
 from requests.exceptions import RequestException
 
-from job_runner_worker.auth import HmacAuth
-from job_runner_worker.config import config
+from job_runner_worker import retry
+from job_runner_worker.config import settings
+from job_runner_worker.session import api_session
 
 
 logger = logging.getLogger(__name__)
 
+# 5xx status codes which indicate that the API is (temporarily) unavailable,
+# rather than that the request failed
+OUTAGE_STATUS_CODES = (502, 503, 504)
+
 
 class RequestClientError(Exception):
     """
@@ -22,37 +31,139 @@ class RequestClientError(Exception):
 class RequestServerError(Exception):
     """
     Exception raised when a RESTful request is returning a 5xx error.
+
+    :param message:
+        The error message.
+
+    :param status_code:
+        The status code of the response. Optional.
+
+    """
+    def __init__(self, message='', status_code=None):
+        super(RequestServerError, self).__init__(message)
+        self.status_code = status_code
+
+
+def call_with_retry(func, args=(), kwargs=None, max_server_errors=None):
+    """
+    Call ``func``, retrying on (temporary) errors.
+
+    The delay between the attempts is determined by
+    :data:`job_runner_worker.retry.retry_policy`. Every retry is withdrawn
+    from the per-process retry budget. When the API seems to be down (too
+    many consecutive failures, or the retry budget is exhausted), the shared
+    circuit breaker holds back all calls until the API is probed again.
+
+    :param func:
+        The callable to call.
+
+    :param args:
+        The positional arguments for ``func``.
+
+    :param kwargs:
+        The keyword arguments for ``func``. Optional.
+
+    :param max_server_errors:
+        The maximum number of 5xx responses (except for
+        :data:`.OUTAGE_STATUS_CODES`) after which the
+        :exc:`.RequestServerError` is raised instead of retrying. By default
+        the call is retried until it succeeds. Optional.
+
     """
+    attempt = 0
+    server_errors = 0
+
+    while True:
+        wait_time = retry.circuit_breaker.get_wait_time()
+        if wait_time:
+            logger.debug('API circuit is open, waiting {0}s to call '
+                         '{1}'.format(wait_time, func.__name__))
+            time.sleep(wait_time + random.uniform(
+                0, retry.retry_policy.base_delay))
+            continue
+
+        attempt += 1
+        try:
+            if attempt > 1:
+                logger.warning('Attempt {0} to call {1}'.format(
+                    attempt, func.__name__))
+            output = func(*args, **(kwargs or {}))
+        except (RequestException, RequestServerError) as e:
+            logger.exception(
+                'Exception raised while calling {0}'.format(
+                    func.__name__))
+            retry.circuit_breaker.record_failure()
+            if not retry.retry_budget.withdraw():
+                logger.warning('Retry budget exhausted')
+                retry.circuit_breaker.trip()
+
+            # the status codes of a (temporary) outage, e.g. returned by
+            # a load balancer, are retried like connection errors
+            if isinstance(e, RequestServerError) and (
+                    e.status_code not in OUTAGE_STATUS_CODES):
+                server_errors += 1
+                if max_server_errors and server_errors >= max_server_errors:
+                    raise
+            time.sleep(retry.retry_policy.get_delay(attempt))
+        except Exception:
+            # the API did respond, but with an unexpected response
+            retry.circuit_breaker.record_success()
+            raise
+        else:
+            retry.circuit_breaker.record_success()
+            retry.retry_budget.deposit()
+            return output
 
 
 def retry_on_requests_error(func):
     """
     Decorator the retry on (temporary) error while executing func.
+
+    See :func:`.call_with_retry`. The undecorated function is available as
+    the ``undecorated`` attribute, e.g. to call it with
+    ``max_server_errors``.
+
     """
     def inner_func(*args, **kwargs):
-        attempt = 0
-
-        while True:
-            attempt += 1
-            try:
-                if attempt > 1:
-                    logger.warning('Attempt {0} to call {1}'.format(
-                        attempt, func.__name__))
-                return func(*args, **kwargs)
-            except (RequestException, RequestServerError):
-                logger.exception(
-                    'Exception raised while calling {0}'.format(
-                        func.__name__))
-                if attempt <= 10:
-                    time.sleep(2)
-                elif attempt <= 50:
-                    time.sleep(5)
-                else:
-                    time.sleep(10)
+        return call_with_retry(func, args, kwargs)
 
+    inner_func.__name__ = func.__name__
+    inner_func.__doc__ = func.__doc__
+    inner_func.undecorated = func
     return inner_func
 
 
+def _encode_body(attributes):
+    """
+    Return the headers and JSON encoded body for ``attributes``.
+
+    When ``api_compress_encoding`` is set, bodies of at least
+    ``api_compress_min_bytes`` bytes are compressed. The signature of the
+    request is calculated over the compressed body, as that is what is sent.
+
+    :param attributes:
+        A ``dict`` containing the attributes to encode.
+
+    :return:
+        A tuple ``(headers, data)``.
+
+    """
+    headers = {'content-type': 'application/json'}
+    data = json.dumps(attributes)
+    encoding = settings.api_compress_encoding
+
+    if encoding and len(data) >= settings.api_compress_min_bytes:
+        if encoding == 'gzip':
+            compressor = zlib.compressobj(
+                zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        else:
+            compressor = zlib.compressobj()
+        data = compressor.compress(data) + compressor.flush()
+        headers['content-encoding'] = encoding
+
+    return headers, data
+
+
 class BaseRestModel(object):
     """
     Base model around RESTful resources.
@@ -73,6 +184,17 @@ class BaseRestModel(object):
             self._data = self._get_json_data()
         return self._data[name]
 
+    def get_attribute(self, name, default=None):
+        """
+        Return the attribute ``name``, or ``default`` when the resource
+        doesn't have it (or it is ``null``).
+        """
+        try:
+            value = getattr(self, name)
+        except KeyError:
+            return default
+        return default if value is None else value
+
     @retry_on_requests_error
     def _get_json_data(self):
         """
@@ -88,40 +210,148 @@ class BaseRestModel(object):
             :exc:`.RequestClientError` on errors caused client-side.
 
         """
-        response = requests.get(
-            urlparse.urljoin(
-                config.get('job_runner_worker', 'api_base_url'),
-                self._resource_path
-            ),
-            auth=HmacAuth(
-                config.get('job_runner_worker', 'api_key'),
-                config.get('job_runner_worker', 'secret')
-            ),
+        response = api_session.get(
+            urlparse.urljoin(settings.api_base_url, self._resource_path),
+            auth=settings.auth,
             headers={'content-type': 'application/json'},
             verify=False,
         )
 
         if response.status_code != 200:
             if response.status_code >= 500 and response.status_code <= 599:
-                raise RequestServerError('Server returned {0} - {1}'.format(
-                    response.status_code, response.content))
+                raise RequestServerError(
+                    'Server returned {0} - {1}'.format(
+                        response.status_code, response.content),
+                    response.status_code,
+                )
             else:
                 raise RequestClientError('Server returned {0} - {1}'.format(
                     response.status_code, response.content))
 
         return response.json
 
+    @retry_on_requests_error
+    def get_if_modified(self, etag=None, last_modified=None):
+        """
+        Load the model, unless it was not modified.
+
+        This performs a conditional GET when an ``etag`` or ``last_modified``
+        value of an earlier response is given.
+
+        :param etag:
+            The ``ETag`` header of an earlier response. Optional.
+
+        :param last_modified:
+            The ``Last-Modified`` header of an earlier response. Optional.
+
+        :return:
+            A tuple ``(modified, etag, last_modified)``, where ``modified``
+            is ``False`` when the API returned ``304 Not Modified``.
+
+        :raises:
+            :exc:`!RequestException` on ``requests`` error.
+
+        :raises:
+            :exc:`.RequestServerError` on 5xx response.
+
+        :raises:
+            :exc:`.RequestClientError` on errors caused client-side.
+
+        """
+        headers = {'content-type': 'application/json'}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+
+        response = api_session.get(
+            urlparse.urljoin(settings.api_base_url, self._resource_path),
+            auth=settings.auth,
+            headers=headers,
+            verify=False,
+        )
+
+        if response.status_code == 304:
+            return False, etag, last_modified
+
+        if response.status_code != 200:
+            if response.status_code >= 500 and response.status_code <= 599:
+                raise RequestServerError(
+                    'Server returned {0} - {1}'.format(
+                        response.status_code, response.content),
+                    response.status_code,
+                )
+            else:
+                raise RequestClientError('Server returned {0} - {1}'.format(
+                    response.status_code, response.content))
+
+        self._data = response.json
+        return (
+            True,
+            response.headers.get('etag'),
+            response.headers.get('last-modified'),
+        )
+
+    @classmethod
+    def get(cls, resource_path):
+        """
+        Return the model for ``resource_path`` from the identity map.
+
+        Within ``model_cache_ttl`` seconds, the same instance (and thus the
+        already fetched data) is returned for the same ``resource_path``.
+
+        :param resource_path:
+            The path of the resource.
+
+        :return:
+            A class instance.
+
+        """
+        return identity_map.get(cls, resource_path)
+
     def reload(self):
         """
         Reload the model.
+
+        This will also refresh the entry of the model in the identity map.
         """
         self._data = self._get_json_data()
+        identity_map.register(self)
 
-    @retry_on_requests_error
-    def patch(self, attributes={}):
+    def patch(self, attributes={}, defer=False):
         """
         PATCH resource with given keyword arguments.
 
+        :param attributes:
+            A ``dict`` containing the attributes to update.
+
+        :param defer:
+            When ``True``, the update is merged with other pending updates for
+            the same resource and sent after ``patch_coalesce_window`` seconds
+            (or together with the next non-deferred PATCH, whatever comes
+            first). When ``False`` (default), the update and all pending
+            updates are sent immediately.
+
+        :raises:
+            :exc:`!RequestException` on ``requests`` error.
+
+        :raises:
+            :exc:`.RequestServerError` on 5xx response.
+
+        :raises:
+            :exc:`.RequestClientError` on errors caused client-side.
+
+        """
+        if defer:
+            patch_buffer.add(self, attributes)
+        else:
+            patch_buffer.flush(self, attributes)
+
+    @retry_on_requests_error
+    def _patch(self, attributes):
+        """
+        Send the PATCH request. See :meth:`.patch`.
+
         :raises:
             :exc:`!RequestException` on ``requests`` error.
 
@@ -136,33 +366,40 @@ class BaseRestModel(object):
             self._resource_path,
             json.dumps(attributes))
         )
-        response = requests.patch(
-            urlparse.urljoin(
-                config.get('job_runner_worker', 'api_base_url'),
-                self._resource_path
-            ),
-            auth=HmacAuth(
-                config.get('job_runner_worker', 'api_key'),
-                config.get('job_runner_worker', 'secret')
-            ),
-            headers={'content-type': 'application/json'},
-            data=json.dumps(attributes),
+        headers, data = _encode_body(attributes)
+        response = api_session.patch(
+            urlparse.urljoin(settings.api_base_url, self._resource_path),
+            auth=settings.auth,
+            headers=headers,
+            data=data,
             verify=False,
         )
 
         if response.status_code != 202:
             if response.status_code >= 500 and response.status_code <= 599:
-                raise RequestServerError('Server returned {0} - {1}'.format(
-                    response.status_code, response.content))
+                raise RequestServerError(
+                    'Server returned {0} - {1}'.format(
+                        response.status_code, response.content),
+                    response.status_code,
+                )
             else:
                 raise RequestClientError('Server returned {0} - {1}'.format(
                     response.status_code, response.content))
 
+        # keep already loaded data in sync, the same instance might be
+        # returned again by the identity map
+        if self._data:
+            self._data.update(attributes)
+
     @retry_on_requests_error
     def post(self, attributes={}):
         """
         PATCH resource with given keyword arguments.
 
+        :return:
+            The path of the created resource (as returned in the
+            ``Location`` header), or ``None`` when it is not known.
+
         :raises:
             :exc:`!RequestException` on ``requests`` error.
 
@@ -177,30 +414,32 @@ class BaseRestModel(object):
             self._resource_path,
             json.dumps(attributes))
         )
-        response = requests.post(
-            urlparse.urljoin(
-                config.get('job_runner_worker', 'api_base_url'),
-                self._resource_path
-            ),
-            auth=HmacAuth(
-                config.get('job_runner_worker', 'api_key'),
-                config.get('job_runner_worker', 'secret')
-            ),
-            headers={'content-type': 'application/json'},
-            data=json.dumps(attributes),
+        headers, data = _encode_body(attributes)
+        response = api_session.post(
+            urlparse.urljoin(settings.api_base_url, self._resource_path),
+            auth=settings.auth,
+            headers=headers,
+            data=data,
             verify=False,
         )
 
         if response.status_code != 201:
             if response.status_code >= 500 and response.status_code <= 599:
-                raise RequestServerError('Server returned {0} - {1}'.format(
-                    response.status_code, response.content))
+                raise RequestServerError(
+                    'Server returned {0} - {1}'.format(
+                        response.status_code, response.content),
+                    response.status_code,
+                )
             else:
                 raise RequestClientError('Server returned {0} - {1}'.format(
                     response.status_code, response.content))
 
+        location = response.headers.get('location')
+        if location:
+            return urlparse.urlparse(location).path
+        return None
+
     @classmethod
-    @retry_on_requests_error
     def get_list(cls, resource_path, params={}):
         """
         Return a list of models for ``resource_path``.
@@ -218,15 +457,72 @@ class BaseRestModel(object):
             :exc:`.RestError` when response code is not 200.
 
         """
-        response = requests.get(
-            urlparse.urljoin(
-                config.get('job_runner_worker', 'api_base_url'),
-                resource_path
-            ),
-            auth=HmacAuth(
-                config.get('job_runner_worker', 'api_key'),
-                config.get('job_runner_worker', 'secret')
-            ),
+        return list(cls.iter_list(resource_path, params))
+
+    @classmethod
+    def iter_list(cls, resource_path, params={}):
+        """
+        Return a generator yielding the models for ``resource_path``.
+
+        The models are yielded as soon as their page has been received. While
+        the caller is processing the models of a page, the next page is
+        already fetched in the background.
+
+        .. note:: Since pages are fetched by offset, modifying the resources
+           while iterating may cause resources which are moved out of the
+           filtered result-set to shift the next page (and skipping some
+           resources).
+
+        :param resource_path:
+            The path of the resource.
+
+        :param params:
+            A ``dict`` containing optional request params. Optional.
+
+        :return:
+            A generator yielding class instances.
+
+        :raises:
+            :exc:`.RestError` when response code is not 200.
+
+        """
+        page = gevent.spawn(cls._get_page, resource_path, params)
+
+        try:
+            while page is not None:
+                json_data = page.get()
+                next_path = json_data['meta'].get('next')
+
+                if next_path:
+                    page = gevent.spawn(cls._get_page, next_path)
+                else:
+                    page = None
+
+                for obj_dict in json_data['objects']:
+                    yield cls(obj_dict['resource_uri'], obj_dict)
+        finally:
+            if page is not None:
+                page.kill()
+
+    @classmethod
+    @retry_on_requests_error
+    def _get_page(cls, resource_path, params={}):
+        """
+        Return the JSON data of a single page of ``resource_path``.
+
+        :raises:
+            :exc:`!RequestException` on ``requests`` error.
+
+        :raises:
+            :exc:`.RequestServerError` on 5xx response.
+
+        :raises:
+            :exc:`.RequestClientError` on errors caused client-side.
+
+        """
+        response = api_session.get(
+            urlparse.urljoin(settings.api_base_url, resource_path),
+            auth=settings.auth,
             params=params,
             headers={'content-type': 'application/json'},
             verify=False,
@@ -234,36 +530,231 @@ class BaseRestModel(object):
 
         if response.status_code != 200:
             if response.status_code >= 500 and response.status_code <= 599:
-                raise RequestServerError('Server returned {0} - {1}'.format(
-                    response.status_code, response.content))
+                raise RequestServerError(
+                    'Server returned {0} - {1}'.format(
+                        response.status_code, response.content),
+                    response.status_code,
+                )
             else:
                 raise RequestClientError('Server returned {0} - {1}'.format(
                     response.status_code, response.content))
 
-        output = []
+        return response.json
 
-        for obj_dict in response.json['objects']:
-            output.append(cls(obj_dict['resource_uri'], obj_dict))
 
-        if 'next' in response.json['meta'] and response.json['meta']['next']:
-            output.extend(cls.get_list(response.json['meta']['next']))
+class PatchBuffer(object):
+    """
+    Write-behind buffer for PATCH requests.
+
+    Deferred attribute updates are merged per resource and flushed as a single
+    PATCH request. Requests for the same resource are sent one at a time, in
+    the order they were flushed.
 
-        return output
+    """
+    def __init__(self):
+        self._pending = {}
+        self._timers = {}
+        self._locks = {}
+        self._lock_users = {}
+
+    def add(self, model, attributes):
+        """
+        Merge ``attributes`` into the pending updates of ``model``.
+
+        :param model:
+            An instance of :class:`.BaseRestModel`.
+
+        :param attributes:
+            A ``dict`` containing the attributes to update.
+
+        """
+        path = model._resource_path
+        pending_model, pending = self._pending.get(path, (model, {}))
+        pending.update(attributes)
+        self._pending[path] = (pending_model, pending)
+
+        if path not in self._timers:
+            self._timers[path] = gevent.spawn_later(
+                settings.patch_coalesce_window,
+                self._flush_deferred,
+                model
+            )
+
+    def flush(self, model, attributes=None):
+        """
+        Send the pending updates of ``model`` merged with ``attributes``.
+
+        :param model:
+            An instance of :class:`.BaseRestModel`.
+
+        :param attributes:
+            A ``dict`` containing additional attributes to update. When
+            ``None``, only the pending updates are sent (if any).
+
+        """
+        path = model._resource_path
+        lock = self._locks.setdefault(path, Semaphore())
+        self._lock_users[path] = self._lock_users.get(path, 0) + 1
+
+        try:
+            with lock:
+                timer = self._timers.pop(path, None)
+                if timer is not None and timer is not gevent.getcurrent():
+                    timer.kill()
+
+                pending_model, pending = self._pending.pop(path, (model, {}))
+                if attributes is not None:
+                    pending.update(attributes)
+                elif not pending:
+                    return
+
+                pending_model._patch(pending)
+        finally:
+            self._lock_users[path] -= 1
+            if not self._lock_users[path]:
+                del self._lock_users[path]
+                del self._locks[path]
+
+    def pop(self, model):
+        """
+        Remove and return the pending updates of ``model`` without sending.
+
+        :param model:
+            An instance of :class:`.BaseRestModel`.
+
+        :return:
+            A ``dict`` containing the pending updates (if any).
+
+        """
+        path = model._resource_path
+        timer = self._timers.pop(path, None)
+        if timer is not None and timer is not gevent.getcurrent():
+            timer.kill()
+
+        pending_model, pending = self._pending.pop(path, (model, {}))
+        return pending
+
+    def flush_all(self):
+        """
+        Send all pending updates.
+        """
+        for pending_model, pending in self._pending.values():
+            self.flush(pending_model)
+
+    def _flush_deferred(self, model):
+        """
+        Flush the pending updates of ``model`` once the window has passed.
+        """
+        try:
+            self.flush(model)
+        except Exception:
+            logger.exception('Unable to flush deferred PATCH of {0}'.format(
+                model._resource_path))
+
+
+patch_buffer = PatchBuffer()
+
+
+class IdentityMap(object):
+    """
+    Per-process registry of model instances, keyed by class and resource path.
+
+    This makes sure that resolving the same resource multiple times (e.g.
+    ``run.job``) does not result in a new instance (and a new GET request)
+    every time. Entries expire ``model_cache_ttl`` seconds after they were
+    registered (or reloaded), setting it to ``0`` disables the identity map.
+
+    """
+    def __init__(self):
+        self._models = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, model_class, resource_path):
+        """
+        Return the instance of ``model_class`` for ``resource_path``.
+
+        :param model_class:
+            A subclass of :class:`.BaseRestModel`.
+
+        :param resource_path:
+            The path of the resource.
+
+        :return:
+            An instance of ``model_class``.
+
+        """
+        key = (model_class, resource_path)
+        model, expire_time = self._models.get(key, (None, 0))
+
+        if model is not None and time.time() < expire_time:
+            self.hits += 1
+            return model
+
+        self.misses += 1
+        model = model_class(resource_path)
+        self.register(model)
+        return model
+
+    def register(self, model):
+        """
+        Register ``model``, replacing the current entry for its resource.
+
+        :param model:
+            An instance of :class:`.BaseRestModel`.
+
+        """
+        if not settings.model_cache_ttl:
+            return
+
+        now = time.time()
+
+        for key, (cached_model, expire_time) in self._models.items():
+            if expire_time <= now:
+                del self._models[key]
+
+        self._models[(model.__class__, model._resource_path)] = (
+            model, now + settings.model_cache_ttl)
+
+    def invalidate(self, model=None):
+        """
+        Remove ``model`` from the identity map, or all models when omitted.
+        """
+        if model is None:
+            self._models = {}
+        else:
+            self._models.pop((model.__class__, model._resource_path), None)
+
+    def get_stats(self):
+        """
+        Return a ``dict`` with the number of cache ``hits`` and ``misses``.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'models': len(self._models),
+        }
+
+
+identity_map = IdentityMap()
 
 
 class Run(BaseRestModel):
     """
     Model class for run resources.
     """
+    #: Seconds the run waited in the :class:`.RunQueue` (set by the queue).
+    queue_wait_time = None
+
     @property
     def job(self):
-        return Job(self.__getattr__('job'))
+        return Job.get(self.__getattr__('job'))
 
     @property
     def run_log(self):
         uri = self.__getattr__('run_log')
         if uri:
-            return RunLog(uri)
+            return RunLog.get(uri)
         return None
 
 
@@ -285,10 +776,67 @@ class KillRequest(BaseRestModel):
     """
     @property
     def run(self):
-        return Run(self.__getattr__('run'))
+        return Run.get(self.__getattr__('run'))
 
 
 class Worker(BaseRestModel):
     """
     Model class for worker resources.
     """
+
+
+class WorkerCache(object):
+    """
+    Cache for the :class:`.Worker` resource of this worker.
+
+    The worker resource of a given ``api_key`` does not change, so it is
+    only looked up again after ``worker_cache_ttl`` seconds, or after it has
+    been invalidated (e.g. on a 4xx response).
+
+    """
+    def __init__(self):
+        self._worker = None
+        self._expire_time = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self):
+        """
+        Return the worker resource.
+
+        :return:
+            An instance of :class:`.Worker` or ``None`` when the API did not
+            return exactly one worker.
+
+        """
+        if self._worker and time.time() < self._expire_time:
+            self.hits += 1
+            return self._worker
+
+        self.misses += 1
+        worker_list = Worker.get_list(settings.worker_resource_uri)
+
+        if len(worker_list) != 1:
+            logger.warning('API returned multiple workers, expected one')
+            self.invalidate()
+            return None
+
+        self._worker = worker_list[0]
+        self._expire_time = time.time() + settings.worker_cache_ttl
+        return self._worker
+
+    def invalidate(self):
+        """
+        Invalidate the cached worker resource.
+        """
+        self._worker = None
+        self._expire_time = 0
+
+    def get_stats(self):
+        """
+        Return a ``dict`` with the number of cache ``hits`` and ``misses``.
+        """
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+worker_cache = WorkerCache()
@@ -0,0 +1,359 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+
+import gevent
+from gevent.event import Event
+from gevent.threadpool import ThreadPool
+
+from job_runner_worker import retry
+from job_runner_worker.config import settings
+from job_runner_worker.models import (
+    BaseRestModel, RequestServerError, call_with_retry, patch_buffer)
+
+
+logger = logging.getLogger(__name__)
+
+# the requests which are not parked, and not held back by a parked request
+# of their group
+SENDABLE_WHERE = (
+    'parked <= :now AND request_group NOT IN ('
+    'SELECT request_group FROM outbox WHERE parked > :now)'
+)
+
+
+class Outbox(object):
+    """
+    Durable queue of API mutations.
+
+    ``PATCH`` and ``POST`` requests added to the outbox are stored in a SQLite
+    database (``outbox_path``) and sent in order by a background greenlet.
+    This way the caller does not block while the API is unreachable, and the
+    mutations survive a restart of the worker. When ``outbox_path`` is empty,
+    the database is stored in ``script_temp_path`` (see :meth:`.get_path`),
+    when it is ``:memory:`` the outbox is kept in memory.
+
+    Requests are sent at least once: a request which was in flight while the
+    worker terminated is sent again on the next start. Requests which are
+    rejected by the API (4xx response) are logged and dropped.
+
+    Every request belongs to a group (by default the resource it updates),
+    e.g. the log and the result of a run. A request which the API answered
+    ``outbox_max_attempts`` times with a 5xx response is parked for
+    ``outbox_park_time`` seconds, together with the later requests of its
+    group, so it doesn't hold back the requests of other groups while the
+    order within the group is kept. Requests which failed because the API
+    was unavailable (connection errors, or a 502, 503 or 504 response) are
+    retried until they succeed.
+
+    The database is accessed from a separate thread, so writing to disk
+    only blocks the calling greenlet, not the whole worker.
+
+    """
+    def __init__(self):
+        self._db = None
+        self._pool = None
+        self._replayer = None
+        self._wakeup = Event()
+        self._empty = Event()
+        self.sent = 0
+        self.dropped = 0
+        self.parked = 0
+
+    def get_path(self):
+        """
+        Return the path of the database.
+
+        By default this is ``job-runner-worker-outbox-<api_key>.sqlite`` in
+        ``script_temp_path``, so workers sharing this directory each have
+        their own outbox.
+
+        """
+        if settings.outbox_path:
+            return settings.outbox_path
+
+        return os.path.join(
+            settings.script_temp_path,
+            'job-runner-worker-outbox-{0}.sqlite'.format(
+                re.sub(r'[^\w-]', '_', settings.api_key)),
+        )
+
+    def _execute(self, sql, params=(), commit=False):
+        """
+        Execute ``sql`` in the database thread.
+
+        :param sql:
+            The SQL statement.
+
+        :param params:
+            The parameters of the statement. Optional.
+
+        :param commit:
+            A ``bool`` indicating if the transaction should be committed.
+            Optional.
+
+        :return:
+            A ``list`` containing the resulting rows.
+
+        """
+        if self._pool is None:
+            # a single thread, which owns the database connection
+            self._pool = ThreadPool(1)
+        return self._pool.apply(
+            self._execute_in_thread, (sql, params, commit))
+
+    def _execute_in_thread(self, sql, params, commit):
+        db = self._get_db()
+        rows = db.execute(sql, params).fetchall()
+        if commit:
+            db.commit()
+        return rows
+
+    def _get_db(self):
+        """
+        Return the database connection (creating the table if needed).
+
+        This must only be called from the database thread.
+
+        Requests parked by a previous process are retried.
+
+        """
+        # the parked column contains the time until which the request (and
+        # the later requests of its group) is parked
+        if self._db is None:
+            db = sqlite3.connect(self.get_path())
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS outbox ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                'method TEXT NOT NULL, '
+                'resource_path TEXT NOT NULL, '
+                'body TEXT NOT NULL, '
+                'attempts INTEGER NOT NULL DEFAULT 0, '
+                'parked REAL NOT NULL DEFAULT 0, '
+                'request_group TEXT)'
+            )
+
+            # outboxes created by a previous version lack these columns
+            columns = [row[1] for row in db.execute(
+                'PRAGMA table_info(outbox)')]
+            for column, definition in (
+                    ('attempts', 'INTEGER NOT NULL DEFAULT 0'),
+                    ('parked', 'REAL NOT NULL DEFAULT 0'),
+                    ('request_group', 'TEXT')):
+                if column not in columns:
+                    db.execute('ALTER TABLE outbox ADD COLUMN {0} {1}'.format(
+                        column, definition))
+
+            db.execute(
+                'UPDATE outbox SET request_group = resource_path '
+                'WHERE request_group IS NULL')
+            db.execute('UPDATE outbox SET attempts = 0, parked = 0')
+            db.commit()
+            self._db = db
+        return self._db
+
+    def _add(self, method, resource_path, attributes, group=None):
+        """
+        Store a request and wake up the replaying greenlet.
+        """
+        self._execute(
+            'INSERT INTO outbox (method, resource_path, body, request_group) '
+            'VALUES (?, ?, ?, ?)',
+            (method, resource_path, json.dumps(attributes),
+             group or resource_path),
+            commit=True,
+        )
+        self._empty.clear()
+        self._wakeup.set()
+
+    def patch(self, model, attributes, group=None):
+        """
+        Queue a ``PATCH`` of ``model``.
+
+        Pending deferred updates of ``model`` (see :meth:`.PatchBuffer.add`)
+        are merged into the same request.
+
+        :param model:
+            An instance of :class:`.BaseRestModel`.
+
+        :param attributes:
+            A ``dict`` containing the attributes to update.
+
+        :param group:
+            The group of the request. Defaults to the resource path of
+            ``model``.
+
+        """
+        pending = patch_buffer.pop(model)
+        pending.update(attributes)
+
+        if model._data:
+            model._data.update(pending)
+
+        self._add('PATCH', model._resource_path, pending, group)
+
+    def post(self, model, attributes, group=None):
+        """
+        Queue a ``POST`` to ``model``.
+
+        :param model:
+            An instance of :class:`.BaseRestModel`.
+
+        :param attributes:
+            A ``dict`` containing the attributes to post.
+
+        :param group:
+            The group of the request. Defaults to the resource path of
+            ``model``.
+
+        """
+        self._add('POST', model._resource_path, attributes, group)
+
+    def send_next(self):
+        """
+        Send the oldest request in the outbox.
+
+        :return:
+            ``False`` when the outbox was empty, else ``True``.
+
+        """
+        rows = self._execute(
+            'SELECT id, method, resource_path, body, attempts FROM outbox '
+            'WHERE ' + SENDABLE_WHERE + ' ORDER BY id LIMIT 1',
+            {'now': time.time()}
+        )
+
+        if not rows:
+            return False
+
+        entry_id, method, resource_path, body, attempts = rows[0]
+        model = BaseRestModel(str(resource_path))
+
+        if method == 'PATCH':
+            func = BaseRestModel._patch.undecorated
+        else:
+            func = BaseRestModel.post.undecorated
+
+        try:
+            # a single attempt per call, so the attempts are stored and
+            # requests which keep failing are parked
+            call_with_retry(
+                func, (model, json.loads(body)), max_server_errors=1)
+        except RequestServerError:
+            attempts += 1
+            if attempts >= settings.outbox_max_attempts:
+                logger.error(
+                    'Parking {0} of {1} after {2} attempts, it is retried '
+                    'in {3} seconds'.format(
+                        method, resource_path, attempts,
+                        settings.outbox_park_time))
+                self.parked += 1
+                self._execute(
+                    'UPDATE outbox SET attempts = ?, parked = ? '
+                    'WHERE id = ?',
+                    (attempts, time.time() + settings.outbox_park_time,
+                     entry_id),
+                    commit=True,
+                )
+            else:
+                self._execute(
+                    'UPDATE outbox SET attempts = ? WHERE id = ?',
+                    (attempts, entry_id),
+                    commit=True,
+                )
+                time.sleep(retry.retry_policy.get_delay(attempts))
+            return True
+        except Exception:
+            logger.exception('Dropping {0} of {1}'.format(
+                method, resource_path))
+            self.dropped += 1
+        else:
+            self.sent += 1
+
+        self._execute(
+            'DELETE FROM outbox WHERE id = ?', (entry_id, ), commit=True)
+        return True
+
+    def flush(self):
+        """
+        Send all requests in the outbox.
+        """
+        while self.send_next():
+            pass
+
+    def _replay(self):
+        """
+        Send requests as they are added to the outbox.
+        """
+        while True:
+            if not self.send_next():
+                self._empty.set()
+                self._wakeup.clear()
+                self._wakeup.wait(self._get_park_timeout())
+
+    def _get_park_timeout(self):
+        """
+        Return the number of seconds until the first parked request is
+        retried, or ``None`` when no requests are parked.
+        """
+        now = time.time()
+        parked = self._execute(
+            'SELECT MIN(parked) FROM outbox WHERE parked > ?', (now, ))[0][0]
+
+        if parked is None:
+            return None
+        return parked - now
+
+    def start(self):
+        """
+        Start the replaying greenlet.
+        """
+        if self._replayer is None:
+            self._replayer = gevent.spawn(self._replay)
+
+    def stop(self, timeout=None):
+        """
+        Stop the replaying greenlet.
+
+        :param timeout:
+            The number of seconds to wait for the outbox to be emptied.
+            Requests which were not sent by then are kept for the next start.
+
+        """
+        if self._replayer is None:
+            return
+
+        if not self._empty.wait(timeout):
+            logger.warning(
+                '{0} requests left in outbox'.format(self.get_pending()))
+
+        self._replayer.kill()
+        self._replayer = None
+
+    def get_pending(self):
+        """
+        Return the number of requests in the outbox (excluding the parked
+        requests and the requests held back by them).
+        """
+        return self._execute(
+            'SELECT COUNT(*) FROM outbox WHERE ' + SENDABLE_WHERE,
+            {'now': time.time()}
+        )[0][0]
+
+    def get_stats(self):
+        """
+        Return a ``dict`` with the number of ``pending``, ``sent``,
+        ``dropped`` and ``parked`` requests.
+        """
+        return {
+            'pending': self.get_pending(),
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'parked': self.parked,
+        }
+
+
+outbox = Outbox()
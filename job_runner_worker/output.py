@@ -0,0 +1,109 @@
+import errno
+import os
+
+from gevent.socket import wait_read
+
+
+class OutputCapture(object):
+    """
+    Capture of process output with bounded memory usage.
+
+    Only the first 20% of ``max_bytes`` (the head) and the last bytes (the
+    tail) of the output are kept, everything in between is dropped while
+    reading. The result is the same as reading the complete output and
+    truncating it afterwards.
+
+    :param max_bytes:
+        The maximum number of bytes of output to keep.
+
+    :param tee:
+        A file-like object to which the complete output is written as well
+        (e.g. an :class:`.ArchiveWriter`). Optional.
+
+    """
+    def __init__(self, max_bytes, tee=None):
+        self.max_bytes = max_bytes
+        self.tee = tee
+        self.head_size = int(max_bytes * 0.2)
+        self.tail_size = int(max_bytes * 0.8)
+        self._head = bytearray()
+        self._tail = bytearray()
+        self.total_bytes = 0
+
+    @property
+    def dropped_bytes(self):
+        """
+        The number of bytes of output which were dropped.
+        """
+        if self.total_bytes <= self.max_bytes:
+            return 0
+        return self.total_bytes - self.head_size - self.tail_size
+
+    def feed(self, data):
+        """
+        Add ``data`` to the captured output.
+
+        :param data:
+            A ``str``.
+
+        """
+        self.total_bytes += len(data)
+
+        if self.tee is not None:
+            self.tee.write(data)
+
+        head_space = self.head_size - len(self._head)
+        if head_space > 0:
+            self._head.extend(data[:head_space])
+            data = data[head_space:]
+
+        # the tail is kept up to the point where the output would not need
+        # to be truncated, so that short output is returned as a whole
+        self._tail.extend(data)
+        excess = len(self._tail) - (self.max_bytes - self.head_size)
+        if excess > 0:
+            del self._tail[:excess]
+
+    def read_from(self, file_obj, chunk_size=64 * 1024):
+        """
+        Read from ``file_obj`` until end of file.
+
+        :param file_obj:
+            A file-like object (e.g. the ``stdout`` of a process).
+
+        :param chunk_size:
+            The maximum number of bytes to read at once.
+
+        """
+        file_desc = file_obj.fileno()
+
+        while True:
+            wait_read(file_desc)
+            try:
+                data = os.read(file_desc, chunk_size)
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+                continue
+
+            if not data:
+                return
+
+            self.feed(data)
+
+    def getvalue(self):
+        """
+        Return the captured output.
+
+        :return:
+            A ``str``. When output was dropped, the head and tail are
+            separated by a ``[truncated]`` marker.
+
+        """
+        if self.total_bytes <= self.max_bytes:
+            return str(self._head + self._tail)
+
+        return '{0}\n\n[truncated]\n\n{1}'.format(
+            str(self._head),
+            str(self._tail[len(self._tail) - self.tail_size:]),
+        )
@@ -0,0 +1,69 @@
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_children_index(proc_path='/proc'):
+    """
+    Return a mapping of parent ``PID`` to children ``PID``s.
+
+    The index is built in a single scan of ``proc_path``. Processes which
+    exit during the scan are skipped.
+
+    :param proc_path:
+        The mount point of the proc filesystem.
+
+    :return:
+        A ``dict`` mapping a parent ``PID`` to a ``list`` of ``PID``s.
+
+    """
+    children_index = {}
+
+    for name in os.listdir(proc_path):
+        if not name.isdigit():
+            continue
+
+        try:
+            with open(os.path.join(proc_path, name, 'stat')) as stat_file:
+                stat = stat_file.read()
+        except IOError:
+            continue
+
+        # the command name (2nd field) can contain spaces and parentheses,
+        # the fields after it are: state, ppid, ...
+        fields = stat.rpartition(')')[2].split()
+        if len(fields) < 2:
+            continue
+
+        children_index.setdefault(int(fields[1]), []).append(int(name))
+
+    return children_index
+
+
+def get_descendant_pids(pid, children_index):
+    """
+    Return all descendants of ``pid``.
+
+    :param pid:
+        An ``int`` representing the parent ``PID``.
+
+    :param children_index:
+        A ``dict`` as returned by :func:`.get_children_index`.
+
+    :return:
+        A ``list`` of ``PID``s, parents before their children.
+
+    """
+    descendants = []
+    parents = [pid]
+
+    while parents:
+        children = []
+        for parent_pid in parents:
+            children.extend(children_index.get(parent_pid, []))
+        descendants.extend(children)
+        parents = children
+
+    return descendants
@@ -0,0 +1,94 @@
+import gevent
+
+
+def call_or_exit(func, exit_event, timeout=None):
+    """
+    Call the blocking ``func`` until it returns or ``exit_event`` is set.
+
+    ``func`` is called in a separate greenlet, which is killed when
+    ``exit_event`` is set (or ``timeout`` has passed) before it returned.
+
+    :param func:
+        The (blocking) callable to call.
+
+    :param exit_event:
+        An instance of ``gevent.event.Event``.
+
+    :param timeout:
+        The maximum number of seconds to wait. Optional.
+
+    :return:
+        The greenlet which called ``func`` when it returned (or raised),
+        else ``None``. Note that ``exit_event`` might be set as well when
+        ``func`` returned at the same time.
+
+    """
+    if exit_event.is_set():
+        return None
+
+    greenlet = gevent.spawn(func)
+    gevent.wait([greenlet, exit_event], timeout=timeout, count=1)
+
+    if not greenlet.ready():
+        greenlet.kill()
+        return None
+
+    return greenlet
+
+
+def get_or_exit(work_queue, exit_event):
+    """
+    Return the next item of ``work_queue``, or ``None`` on exit.
+
+    This blocks until an item is available or ``exit_event`` is set, whatever
+    comes first. When the exit is signaled, items are left in the queue.
+
+    :param work_queue:
+        An instance of ``gevent.queue.Queue``.
+
+    :param exit_event:
+        An instance of ``gevent.event.Event``.
+
+    :return:
+        The next item, or ``None`` when ``exit_event`` is set.
+
+    """
+    greenlet = call_or_exit(work_queue.get, exit_event)
+
+    if greenlet is None:
+        return None
+
+    if exit_event.is_set():
+        # the item was taken from the queue just before the exit was
+        # signaled, put it back so it is not lost
+        if greenlet.successful():
+            work_queue.put(greenlet.value)
+        return None
+
+    return greenlet.get()
+
+
+def peek_or_exit(work_queue, exit_event):
+    """
+    Return the next item of ``work_queue`` without taking it, or ``None`` on
+    exit.
+
+    This blocks until an item is available or ``exit_event`` is set, whatever
+    comes first.
+
+    :param work_queue:
+        An instance of ``gevent.queue.Queue``.
+
+    :param exit_event:
+        An instance of ``gevent.event.Event``.
+
+    :return:
+        The next item, or ``None`` when ``exit_event`` is set.
+
+    """
+    greenlet = call_or_exit(work_queue.peek, exit_event)
+
+    if greenlet is None or exit_event.is_set():
+        return None
+
+    return greenlet.get()
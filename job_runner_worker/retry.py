@@ -0,0 +1,212 @@
+import logging
+import random
+import time
+
+from job_runner_worker.config import register_reload_callback, settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class RetryPolicy(object):
+    """
+    Exponential backoff with jitter.
+
+    The delay doubles with every failed attempt (up to ``max_delay``). Half of
+    the delay is randomized, so that greenlets (and workers) which failed at
+    the same moment don't retry in lockstep.
+
+    To use a different policy, subclass this class, override
+    :meth:`.get_delay` and assign an instance to
+    :data:`job_runner_worker.retry.retry_policy`.
+
+    :param base_delay:
+        The delay (in seconds) after the first failed attempt.
+
+    :param max_delay:
+        The maximum delay (in seconds).
+
+    """
+    def __init__(self, base_delay=2, max_delay=60):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def get_delay(self, attempt):
+        """
+        Return the number of seconds to wait after a failed attempt.
+
+        :param attempt:
+            The number of the attempt that failed (starting at ``1``).
+
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay / 2.0 + random.uniform(0, delay / 2.0)
+
+
+class RetryBudget(object):
+    """
+    Per-process retry budget.
+
+    Every retry withdraws a token from the budget, every successful call
+    deposits ``ratio`` tokens (up to ``max_tokens``). When the budget is
+    exhausted, the API is considered to be down.
+
+    :param max_tokens:
+        The maximum (and initial) number of tokens.
+
+    :param ratio:
+        The number of tokens deposited per successful call.
+
+    """
+    def __init__(self, max_tokens=100, ratio=0.1):
+        self.max_tokens = max_tokens
+        self.ratio = ratio
+        self.tokens = float(max_tokens)
+
+    def deposit(self):
+        """
+        Deposit tokens for a successful call.
+        """
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        """
+        Withdraw a token for a retry.
+
+        :return:
+            ``True`` when a token was available, else ``False``.
+
+        """
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        return True
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker shared by all API calls.
+
+    After ``failure_threshold`` consecutive failures, the circuit is opened
+    and calls are held back for ``reset_timeout`` seconds. After that, the
+    circuit is half-open and a single call is let through to probe the API.
+    When this call succeeds the circuit is closed again, else it is re-opened.
+
+    :param failure_threshold:
+        The number of consecutive failures after which to open the circuit.
+
+    :param reset_timeout:
+        The number of seconds to keep the circuit open.
+
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=10, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self._opened_time = None
+        self._probe_time = None
+
+    def get_wait_time(self):
+        """
+        Return the number of seconds to wait before a call can be done.
+
+        :return:
+            ``0`` when the call can be done directly.
+
+        """
+        now = time.time()
+
+        if self.state == self.OPEN:
+            remaining = self._opened_time + self.reset_timeout - now
+            if remaining > 0:
+                return remaining
+            logger.info('API circuit is half-open, probing the API')
+            self.state = self.HALF_OPEN
+            self._probe_time = now
+            return 0
+
+        if self.state == self.HALF_OPEN:
+            # only let one call through at a time. when the probing call did
+            # not report back within reset_timeout, let another one through
+            remaining = self._probe_time + self.reset_timeout - now
+            if remaining > 0:
+                return remaining
+            self._probe_time = now
+
+        return 0
+
+    def record_success(self):
+        """
+        Record a call which reached the API.
+        """
+        if self.state != self.CLOSED:
+            logger.info('API is reachable again, closing circuit')
+
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        """
+        Record a call which failed because the API was not reachable.
+        """
+        self.failures += 1
+
+        if (self.state == self.HALF_OPEN or
+                self.failures >= self.failure_threshold):
+            self.trip()
+
+    def trip(self):
+        """
+        Open the circuit.
+        """
+        if self.state != self.OPEN:
+            logger.warning(
+                'API seems to be down, opening circuit for {0} seconds'.format(
+                    self.reset_timeout))
+            self.trips += 1
+
+        self.state = self.OPEN
+        self._opened_time = time.time()
+
+
+def get_api_health():
+    """
+    Return the state of the retry machinery for monitoring purposes.
+
+    :return:
+        A ``dict``.
+
+    """
+    return {
+        'circuit_state': circuit_breaker.state,
+        'circuit_failures': circuit_breaker.failures,
+        'circuit_trips': circuit_breaker.trips,
+        'retry_tokens': retry_budget.tokens,
+    }
+
+
+def configure():
+    """
+    Apply the retry related settings.
+    """
+    retry_policy.base_delay = settings.api_retry_base_delay
+    retry_policy.max_delay = settings.api_retry_max_delay
+    retry_budget.max_tokens = settings.api_retry_budget
+    retry_budget.ratio = settings.api_retry_budget_ratio
+    circuit_breaker.failure_threshold = settings.api_circuit_failure_threshold
+    circuit_breaker.reset_timeout = settings.api_circuit_reset_timeout
+
+
+retry_policy = RetryPolicy()
+retry_budget = RetryBudget(max_tokens=settings.api_retry_budget)
+circuit_breaker = CircuitBreaker()
+
+configure()
+register_reload_callback(configure)
@@ -0,0 +1,198 @@
+import calendar
+import itertools
+import logging
+import re
+import time
+from datetime import datetime
+
+from gevent.queue import Queue
+
+from job_runner_worker.config import settings
+from job_runner_worker.script_cache import script_cache
+
+
+logger = logging.getLogger(__name__)
+
+DTS_RE = re.compile(
+    r'^(\d{4}-\d{2}-\d{2})[T ](\d{2}:\d{2}:\d{2})(\.\d+)?'
+    r'(Z|([+-])(\d{2}):?(\d{2}))?$'
+)
+
+
+def parse_dts(value):
+    """
+    Return the timestamp of the ISO 8601 date-time string ``value``.
+
+    Date-times without timezone are assumed to be UTC.
+
+    :return:
+        A ``float``, or ``None`` when ``value`` can not be parsed.
+
+    """
+    match = DTS_RE.match(value or '')
+    if not match:
+        return None
+
+    date, time_of_day, fraction, zone, sign, hours, minutes = match.groups()
+    timestamp = calendar.timegm(datetime.strptime(
+        '{0} {1}'.format(date, time_of_day), '%Y-%m-%d %H:%M:%S').timetuple())
+
+    if fraction:
+        timestamp += float(fraction)
+
+    if sign:
+        offset = int(hours) * 3600 + int(minutes) * 60
+        timestamp -= offset if sign == '+' else -offset
+
+    return timestamp
+
+
+def get_run_priority(run):
+    """
+    Return the priority of ``run`` (higher runs first).
+
+    The priority is taken from the ``run_priority_field`` of the job (which
+    is loaded from the script cache when possible).
+
+    """
+    job = run.job
+    script_cache.load_job(job)
+    try:
+        return float(job.get_attribute(settings.run_priority_field, 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def get_run_deadline(run):
+    """
+    Return the timestamp at which ``run`` was scheduled, or ``None``.
+    """
+    return parse_dts(run.get_attribute('schedule_dts'))
+
+
+class RunQueueEntry(object):
+    """
+    A run in the :class:`.RunQueue`.
+    """
+    __slots__ = ('run', 'sequence', 'enqueued_at', 'priority', 'deadline')
+
+    def __init__(self, run, sequence, enqueued_at, priority=0, deadline=None):
+        self.run = run
+        self.sequence = sequence
+        self.enqueued_at = enqueued_at
+        self.priority = priority
+        self.deadline = deadline
+
+
+def _fifo_key(entry, now):
+    return entry.sequence
+
+
+def _priority_key(entry, now):
+    priority = entry.priority
+
+    if settings.run_queue_aging:
+        # starvation protection: every run_queue_aging seconds of waiting
+        # increase the priority by one
+        priority += (now - entry.enqueued_at) / settings.run_queue_aging
+
+    return (-priority, entry.sequence)
+
+
+def _deadline_key(entry, now):
+    if entry.deadline is None:
+        return (entry.enqueued_at, entry.sequence)
+    return (entry.deadline, entry.sequence)
+
+
+DISCIPLINES = {
+    'fifo': _fifo_key,
+    'priority': _priority_key,
+    'deadline': _deadline_key,
+}
+
+
+class RunQueue(Queue):
+    """
+    Queue of claimed runs, ordered by ``run_queue_discipline``:
+
+    ``fifo``
+        In the order the runs were claimed.
+
+    ``priority``
+        The run with the highest priority first (see
+        :func:`.get_run_priority`). Waiting runs are aged, so they are not
+        starved by runs with a higher priority.
+
+    ``deadline``
+        Earliest deadline first, the deadline being the time the run was
+        scheduled at (see :func:`.get_run_deadline`).
+
+    The time a run waited in the queue is stored as its
+    ``queue_wait_time``.
+
+    """
+    def __init__(self, *args, **kwargs):
+        Queue.__init__(self, *args, **kwargs)
+        self._sequence = itertools.count()
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.runs = 0
+
+    def put(self, run, block=True, timeout=None):
+        """
+        Put ``run`` into the queue.
+
+        Depending on the discipline this requests the job of the run, so it
+        should not be called from within the hub.
+
+        """
+        entry = RunQueueEntry(run, next(self._sequence), time.time())
+
+        if settings.run_queue_discipline == 'priority':
+            entry.priority = get_run_priority(run)
+        elif settings.run_queue_discipline == 'deadline':
+            entry.deadline = get_run_deadline(run)
+
+        Queue.put(self, entry, block, timeout)
+
+    def _create_queue(self, items=()):
+        return list(items)
+
+    def _put(self, entry):
+        self.queue.append(entry)
+
+    def _get(self):
+        entry = self._get_next_entry()
+        self.queue.remove(entry)
+
+        wait_time = time.time() - entry.enqueued_at
+        entry.run.queue_wait_time = wait_time
+        self.runs += 1
+        self.total_wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+
+        return entry.run
+
+    def _peek(self):
+        return self._get_next_entry().run
+
+    def _get_next_entry(self):
+        """
+        Return the entry which is next according to the discipline.
+        """
+        key = DISCIPLINES.get(settings.run_queue_discipline, _fifo_key)
+        now = time.time()
+        return min(self.queue, key=lambda entry: key(entry, now))
+
+    def get_stats(self):
+        """
+        Return a ``dict`` with the number of ``runs`` taken from the queue,
+        and their average and max. wait time (in seconds).
+        """
+        return {
+            'runs': self.runs,
+            'avg_wait_time': self.total_wait_time / self.runs
+            if self.runs else 0.0,
+            'max_wait_time': self.max_wait_time,
+        }
@@ -5,13 +5,25 @@ import sys
 import gevent
 import gevent.pool
 import zmq.green as zmq
-from gevent.queue import JoinableQueue, Queue
+from gevent.event import Event
+from gevent.queue import Queue
 
+from job_runner_worker.accounting import resource_stats
 from job_runner_worker.cleanup import reset_incomplete_runs
-from job_runner_worker.config import config
+from job_runner_worker.concurrency import concurrency_controller
+from job_runner_worker.config import ConfigError, reload_settings, settings
 from job_runner_worker.enqueuer import enqueue_actions
 from job_runner_worker.events import publish
-from job_runner_worker.worker import execute_run, kill_run
+from job_runner_worker.log_archive import log_archive
+from job_runner_worker.materializer import script_materializer
+from job_runner_worker.models import (
+    identity_map, patch_buffer, worker_cache)
+from job_runner_worker.outbox import outbox
+from job_runner_worker.retry import get_api_health
+from job_runner_worker.run_queue import RunQueue
+from job_runner_worker.session import api_session
+from job_runner_worker.worker import execute_run, finalize_runs, kill_run
+from job_runner_worker.zygote import stop_zygotes
 
 
 logger = logging.getLogger(__name__)
@@ -21,25 +33,49 @@ def run():
     """
     Start consuming runs and executing them.
     """
+    settings.validate()
     context = zmq.Context(1)
 
     gevent_pool = gevent.pool.Group()
-    reset_incomplete_runs()
-    concurrent_jobs = config.getint('job_runner_worker', 'concurrent_jobs')
+    finalizer_pool = gevent.pool.Group()
+
+    # send the requests left by the previous process first, so runs which
+    # did complete are not reset
+    outbox.flush()
+    outbox.start()
 
-    run_queue = Queue()
+    reset_incomplete_runs()
+    script_materializer.collect_garbage()
+    if log_archive.is_enabled():
+        log_archive.evict()
+    worker_cache.get()
+    # the number of runs executed at the same time is limited by the
+    # concurrency controller
+    concurrent_jobs = concurrency_controller.get_max_slots()
+
+    run_queue = RunQueue()
+    concurrency_controller.start(run_queue)
     kill_queue = Queue()
     event_queue = Queue()
-    exit_queue = JoinableQueue()
-    event_exit_queue = Queue()
+    finalize_queue = Queue(settings.finalize_backlog)
+    exit_event = Event()
+    finalize_exit_event = Event()
+    event_exit_event = Event()
 
     # callback for SIGTERM
     def terminate_callback(*args, **kwargs):
         logger.warning('Worker is going to terminate!')
-        for i in range(concurrent_jobs + 2):
-            # we don't want to kill the event greenlet, since we want to
-            # publish events of already running jobs
-            exit_queue.put(None)
+        # we don't want to stop the event greenlet yet, since we want to
+        # publish events of already running jobs
+        exit_event.set()
+
+    # callback for SIGHUP
+    def reload_callback(*args, **kwargs):
+        logger.warning('Reloading settings')
+        try:
+            reload_settings()
+        except ConfigError:
+            logger.exception('Invalid settings, keeping the current settings')
 
     # callback for when an exception is raised in a execute_run greenlet
     def recover_run(greenlet):
@@ -50,7 +86,8 @@ def run():
             execute_run,
             run_queue,
             event_queue,
-            exit_queue,
+            exit_event,
+            finalize_queue,
         ).link_exception(recover_run)
 
     # callback for when an exception is raised in enqueue_actions greenlet
@@ -64,7 +101,7 @@ def run():
             run_queue,
             kill_queue,
             event_queue,
-            exit_queue,
+            exit_event,
         ).link_exception(recover_enqueue_actions)
 
     # callback for when an exception is raised in kill_run greenlet
@@ -75,7 +112,7 @@ def run():
             kill_run,
             kill_queue,
             event_queue,
-            exit_queue,
+            exit_event,
         ).link_exception(recover_kill_run)
 
     # start the enqueue_actions greenlet
@@ -85,7 +122,7 @@ def run():
         run_queue,
         kill_queue,
         event_queue,
-        exit_queue,
+        exit_event,
     ).link_exception(recover_enqueue_actions)
 
     # start the execute_run greenlets
@@ -94,29 +131,63 @@ def run():
             execute_run,
             run_queue,
             event_queue,
-            exit_queue,
+            exit_event,
+            finalize_queue,
         ).link_exception(recover_run)
 
+    # start the finalize_runs greenlets, they are stopped once all runs have
+    # ended, so the results of all runs are sent
+    for x in range(settings.finalizers):
+        finalizer_pool.spawn(
+            finalize_runs,
+            finalize_queue,
+            finalize_exit_event,
+        )
+
     # start the kill_run greenlet
     gevent_pool.spawn(
         kill_run,
         kill_queue,
         event_queue,
-        exit_queue
+        exit_event
     ).link_exception(recover_kill_run)
 
     # start the publish (event publisher) greentlet
     publisher_loop = gevent.spawn(
-        publish, context, event_queue, event_exit_queue)
+        publish, context, event_queue, event_exit_event)
 
     # catch SIGTERM signal
     signal.signal(signal.SIGTERM, terminate_callback)
 
+    # catch SIGHUP signal
+    signal.signal(signal.SIGHUP, reload_callback)
+
     # wait for all the greenlets to complete in this group
     gevent_pool.join()
+    concurrency_controller.stop()
+
+    finalize_exit_event.set()
+    finalizer_pool.join()
+
+    # make sure all deferred updates have been sent to the API
+    patch_buffer.flush_all()
+    outbox.stop(settings.outbox_drain_timeout)
+    script_materializer.clear()
+    stop_zygotes()
 
     # now terminate the event queue. this one should be terminated at the
     # end, since we want all events to be published.
-    event_exit_queue.put(None)
+    event_exit_event.set()
     publisher_loop.join()
+
+    logger.info('API connection stats: {0}'.format(api_session.get_stats()))
+    logger.info('Identity map stats: {0}'.format(identity_map.get_stats()))
+    logger.info('Outbox stats: {0}'.format(outbox.get_stats()))
+    logger.info('Run queue stats: {0}'.format(run_queue.get_stats()))
+    logger.info('Concurrency stats: {0}'.format(
+        concurrency_controller.get_stats()))
+    logger.info('Jobs using the most CPU time: {0}'.format(
+        resource_stats.get_top()))
+    logger.info('API health: {0}'.format(get_api_health()))
+    api_session.close()
     sys.exit('Worker terminated')
@@ -0,0 +1,163 @@
+import hashlib
+import itertools
+import logging
+
+from job_runner_worker.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class CachedScript(object):
+    """
+    A cached job script.
+
+    :param content:
+        The script content (``unicode``).
+
+    :param etag:
+        The ``ETag`` header of the job resource response (if any).
+
+    :param last_modified:
+        The ``Last-Modified`` header of the job resource response (if any).
+
+    :param job_data:
+        A ``dict`` with the other attributes of the job resource (if any).
+
+    """
+    __slots__ = (
+        'content', 'content_hash', 'size', 'etag', 'last_modified',
+        'job_data', 'last_used',
+    )
+
+    def __init__(self, content, etag=None, last_modified=None, job_data=None):
+        encoded_content = content.encode('utf-8')
+        self.content = content
+        self.content_hash = hashlib.sha1(encoded_content).hexdigest()
+        self.size = len(encoded_content)
+        self.etag = etag
+        self.last_modified = last_modified
+        self.job_data = job_data
+        self.last_used = None
+
+
+class ScriptCache(object):
+    """
+    LRU cache of job scripts, keyed by job URI.
+
+    A cached script is re-validated on every lookup with a conditional GET
+    (based on the ``ETag`` / ``Last-Modified`` headers returned by the API),
+    so an unchanged script is not transferred again. When the API doesn't
+    support conditional requests, the script is fetched as before.
+
+    The other attributes of the job are cached next to the script, so the
+    job is loaded from the cache when the API returns ``304 Not Modified``
+    (instead of fetching the full job again on the first attribute access).
+
+    The total size of the cached scripts is kept below
+    ``script_cache_max_bytes``, by evicting the least recently used scripts.
+
+    """
+    def __init__(self):
+        self._scripts = {}
+        self._counter = itertools.count()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, job):
+        """
+        Return the script of ``job``.
+
+        :param job:
+            An instance of :class:`.Job`.
+
+        :return:
+            An instance of :class:`.CachedScript`.
+
+        """
+        job_uri = job._resource_path
+        cached_script = self._scripts.get(job_uri)
+
+        if cached_script:
+            modified, etag, last_modified = job.get_if_modified(
+                cached_script.etag, cached_script.last_modified)
+        else:
+            modified, etag, last_modified = job.get_if_modified()
+
+        if cached_script and not modified:
+            self.hits += 1
+            if not job._data or 'script_content' not in job._data:
+                self._load_job(job, cached_script)
+        else:
+            self.misses += 1
+            job_data = dict(job._data)
+            job_data.pop('script_content', None)
+            cached_script = CachedScript(
+                job.script_content, etag, last_modified, job_data)
+            self._add(job_uri, cached_script)
+
+        cached_script.last_used = next(self._counter)
+        return cached_script
+
+    def load_job(self, job):
+        """
+        Load the data of ``job`` from the cache, when not loaded yet.
+
+        This avoids fetching the full job (including its script) when only
+        its other attributes are needed. The data is re-validated by
+        :meth:`get` before the job is executed.
+
+        :param job:
+            An instance of :class:`.Job`.
+
+        """
+        cached_script = self._scripts.get(job._resource_path)
+        if cached_script and not job._data:
+            self._load_job(job, cached_script)
+
+    def _load_job(self, job, cached_script):
+        """
+        Set the data of ``job`` to the cached data of ``cached_script``.
+        """
+        if cached_script.job_data is not None:
+            job._data = dict(
+                cached_script.job_data, script_content=cached_script.content)
+
+    def _add(self, job_uri, cached_script):
+        """
+        Add ``cached_script`` to the cache and evict old scripts (if needed).
+        """
+        self._scripts.pop(job_uri, None)
+
+        max_bytes = settings.script_cache_max_bytes
+        if cached_script.size > max_bytes:
+            return
+
+        total_bytes = sum([s.size for s in self._scripts.values()])
+
+        while total_bytes + cached_script.size > max_bytes:
+            lru_uri = min(
+                self._scripts, key=lambda k: self._scripts[k].last_used)
+            logger.debug('Evicting script of {0} from cache'.format(lru_uri))
+            total_bytes -= self._scripts.pop(lru_uri).size
+
+        self._scripts[job_uri] = cached_script
+
+    def get_content_hashes(self):
+        """
+        Return a ``set`` with the content hashes of the cached scripts.
+        """
+        return set([s.content_hash for s in self._scripts.values()])
+
+    def get_stats(self):
+        """
+        Return a ``dict`` with the number of cache ``hits`` and ``misses``.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'scripts': len(self._scripts),
+        }
+
+
+script_cache = ScriptCache()
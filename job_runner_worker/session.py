@@ -0,0 +1,136 @@
+import logging
+import time
+
+import requests
+
+from job_runner_worker.config import register_reload_callback, settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class ApiSession(object):
+    """
+    Shared keep-alive HTTP session for all API calls.
+
+    All greenlets share the same pool of connections, so subsequent requests
+    to the API re-use an already open TCP (and TLS) connection instead of
+    setting up a new one for every call. When the session has not been used
+    for ``api_idle_timeout`` seconds, the pooled connections are closed before
+    sending the next request, to avoid re-using connections which were
+    already dropped by the other side.
+
+    """
+    def __init__(self):
+        self._session = None
+        self._last_used = None
+        self._evicted_connections = 0
+        self._evicted_requests = 0
+
+    def _get_session(self):
+        """
+        Return the underlying ``requests`` session.
+
+        This will evict the pooled connections first when they have been idle
+        for too long.
+
+        """
+        now = time.time()
+
+        if (self._session and settings.api_idle_timeout and
+                now - self._last_used > settings.api_idle_timeout):
+            logger.debug('Evicting idle API connections')
+            self.close()
+
+        if not self._session:
+            self._session = requests.session(config={
+                'keep_alive': True,
+                'pool_maxsize': settings.api_pool_maxsize,
+            })
+
+        self._last_used = now
+        return self._session
+
+    def _get_pools(self):
+        """
+        Return a ``list`` of connection-pools of the current session.
+        """
+        if not self._session:
+            return []
+
+        pools = self._session.poolmanager.pools
+        return filter(None, [pools.get(key) for key in pools.keys()])
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request through the shared session.
+
+        :param method:
+            The HTTP method (e.g. ``'GET'``).
+
+        :param url:
+            The absolute URL of the request.
+
+        :return:
+            An instance of ``requests.Response``.
+
+        """
+        return self._get_session().request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        """
+        Send a ``GET`` request. See :meth:`.request`.
+        """
+        return self.request('GET', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        """
+        Send a ``PATCH`` request. See :meth:`.request`.
+        """
+        return self.request('PATCH', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """
+        Send a ``POST`` request. See :meth:`.request`.
+        """
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        """
+        Close all pooled connections.
+        """
+        for pool in self._get_pools():
+            self._evicted_connections += pool.num_connections
+            self._evicted_requests += pool.num_requests
+
+        if self._session:
+            self._session.close()
+            self._session = None
+
+    def get_stats(self):
+        """
+        Return connection statistics.
+
+        :return:
+            A ``dict`` containing the number of ``requests`` sent, the number
+            of ``connections_opened`` and the number of ``connections_reused``.
+
+        """
+        connections = self._evicted_connections
+        num_requests = self._evicted_requests
+
+        for pool in self._get_pools():
+            connections += pool.num_connections
+            num_requests += pool.num_requests
+
+        return {
+            'requests': num_requests,
+            'connections_opened': connections,
+            'connections_reused': max(num_requests - connections, 0),
+        }
+
+
+api_session = ApiSession()
+
+# re-create the pools with the new settings on reload
+register_reload_callback(api_session.close)
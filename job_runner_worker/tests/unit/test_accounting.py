@@ -0,0 +1,84 @@
+import errno
+import subprocess
+import unittest2 as unittest
+
+from mock import Mock, patch
+
+from job_runner_worker.accounting import (
+    ResourceStats, get_rusage_usage, wait_for_process)
+
+
+class ModuleTestCase(unittest.TestCase):
+    """
+    Tests for :mod:`job_runner_worker.accounting`.
+    """
+    def test_wait_for_process(self):
+        """
+        Test :func:`.wait_for_process`.
+        """
+        sub_proc = subprocess.Popen(['sh', '-c', 'exit 3'])
+        returncode, rusage = wait_for_process(sub_proc.pid)
+
+        self.assertEqual(3, returncode)
+        self.assertTrue(rusage.ru_maxrss > 0)
+
+    @patch('job_runner_worker.accounting.os.wait4')
+    def test_wait_for_process_reaped(self, wait4):
+        """
+        Test :func:`.wait_for_process` when the process was already reaped.
+        """
+        wait4.side_effect = OSError(errno.ECHILD, 'No child processes')
+
+        self.assertEqual((None, None), wait_for_process(1234))
+
+    def test_get_rusage_usage(self):
+        """
+        Test :func:`.get_rusage_usage`.
+        """
+        rusage = Mock()
+        rusage.ru_utime = 1.5
+        rusage.ru_stime = 0.5
+        rusage.ru_maxrss = 2048
+        rusage.ru_inblock = 1
+        rusage.ru_oublock = 2
+        rusage.ru_nvcsw = 3
+        rusage.ru_nivcsw = 4
+
+        self.assertEqual({
+            'user_time': 1.5,
+            'system_time': 0.5,
+            'max_rss_kb': 2048,
+            'block_input': 1,
+            'block_output': 2,
+            'voluntary_switches': 3,
+            'involuntary_switches': 4,
+        }, get_rusage_usage(rusage))
+
+
+class ResourceStatsTestCase(unittest.TestCase):
+    """
+    Tests for :class:`.ResourceStats`.
+    """
+    def test_get_top(self):
+        """
+        Test :meth:`.ResourceStats.get_top`.
+        """
+        resource_stats = ResourceStats()
+        resource_stats.add('/api/job/1/', {
+            'wall_time': 10, 'user_time': 1, 'system_time': 1,
+            'max_rss_kb': 100})
+        resource_stats.add('/api/job/2/', {
+            'wall_time': 10, 'user_time': 5, 'system_time': 1,
+            'max_rss_kb': 50})
+        resource_stats.add('/api/job/1/', {
+            'wall_time': 5, 'user_time': 3, 'system_time': 0,
+            'max_rss_kb': 200})
+
+        self.assertEqual([
+            ('/api/job/2/', {
+                'runs': 1, 'wall_time': 10, 'cpu_time': 6,
+                'max_rss_kb': 50}),
+        ], resource_stats.get_top(1))
+        self.assertEqual({
+            'runs': 2, 'wall_time': 15, 'cpu_time': 5, 'max_rss_kb': 200,
+        }, resource_stats.get_top()[1][1])
@@ -1,4 +1,7 @@
+import hashlib
+import hmac
 import unittest2 as unittest
+import zlib
 
 from mock import Mock
 
@@ -25,3 +28,22 @@ class HmacAuthTestCase(unittest.TestCase):
             'ApiKey public:2b989ffc81712758d070fb46055b55f18a245d15',
             auth(r).headers['Authorization']
         )
+
+    def test_hmac_calculation_compressed_body(self):
+        """
+        Test HMAC calculation over a compressed body.
+        """
+        auth = HmacAuth('public', 'key')
+        body = zlib.compress('{"content": "data body"}')
+
+        r = Mock()
+        r.method = 'post'
+        r.path_url = '/path/'
+        r.data = body
+        r.headers = {}
+
+        self.assertEqual(
+            'ApiKey public:{0}'.format(hmac.new(
+                'key', 'POST/path/' + body, hashlib.sha1).hexdigest()),
+            auth(r).headers['Authorization']
+        )
@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import unittest2 as unittest
+
+from mock import call, patch
+
+from job_runner_worker.cgroup import RunCgroup
+
+
+class RunCgroupTestCase(unittest.TestCase):
+    """
+    Tests for :class:`.RunCgroup`.
+    """
+    def setUp(self):
+        self.cgroup_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cgroup_path)
+
+        settings_patcher = patch('job_runner_worker.cgroup.settings')
+        self.settings = settings_patcher.start()
+        self.settings.cgroup_path = self.cgroup_path
+        self.addCleanup(settings_patcher.stop)
+
+    def test_create_and_remove(self):
+        """
+        Test :meth:`.RunCgroup.create` and :meth:`.RunCgroup.remove`.
+        """
+        cgroup = RunCgroup(1234)
+        cgroup.create()
+        cgroup.create()
+
+        self.assertTrue(
+            os.path.isdir(os.path.join(self.cgroup_path, 'run-1234')))
+
+        cgroup.remove()
+        self.assertFalse(os.path.exists(cgroup.path))
+
+    def test_add_current_process(self):
+        """
+        Test :meth:`.RunCgroup.add_current_process`.
+        """
+        cgroup = RunCgroup(1234)
+        cgroup.create()
+        cgroup.add_current_process()
+
+        self.assertEqual([os.getpid()], cgroup.get_pids())
+
+    @patch('job_runner_worker.cgroup.os.kill')
+    def test_kill(self, kill):
+        """
+        Test :meth:`.RunCgroup.kill` without ``cgroup.kill``.
+        """
+        cgroup = RunCgroup(1234)
+        cgroup.create()
+        with open(os.path.join(cgroup.path, 'cgroup.procs'), 'w') as procs:
+            procs.write('10\n11\n')
+
+        cgroup.kill()
+
+        self.assertEqual([call(10, 9), call(11, 9)], kill.call_args_list)
+
+    def test_kill_cgroup_kill(self):
+        """
+        Test :meth:`.RunCgroup.kill` with ``cgroup.kill``.
+        """
+        cgroup = RunCgroup(1234)
+        cgroup.create()
+        kill_path = os.path.join(cgroup.path, 'cgroup.kill')
+        open(kill_path, 'w').close()
+
+        cgroup.kill()
+
+        with open(kill_path) as kill_file:
+            self.assertEqual('1', kill_file.read())
+
+    def test_get_usage(self):
+        """
+        Test :meth:`.RunCgroup.get_usage`.
+        """
+        cgroup = RunCgroup(1234)
+        cgroup.create()
+
+        for file_name, content in [
+                ('cpu.stat', 'usage_usec 3000000\nuser_usec 2000000\n'
+                             'system_usec 1000000\n'),
+                ('memory.peak', '2097152\n'),
+                ('io.stat', '8:0 rbytes=10 wbytes=20 rios=1 wios=2\n'
+                            '8:16 rbytes=1 wbytes=2 rios=1 wios=1\n')]:
+            with open(os.path.join(cgroup.path, file_name), 'w') as f:
+                f.write(content)
+
+        self.assertEqual({
+            'user_time': 2.0,
+            'system_time': 1.0,
+            'max_rss_kb': 2048,
+            'read_bytes': 11,
+            'write_bytes': 22,
+        }, cgroup.get_usage())
+
+    def test_set_limits(self):
+        """
+        Test :meth:`.RunCgroup.set_limits` and ``get_oom_kills``.
+        """
+        cgroup = RunCgroup(1234)
+        cgroup.create()
+        cgroup.set_limits(memory_max=1024, cpu_max=1.5)
+
+        with open(os.path.join(cgroup.path, 'memory.max')) as f:
+            self.assertEqual('1024', f.read())
+        with open(os.path.join(cgroup.path, 'cpu.max')) as f:
+            self.assertEqual('150000 100000', f.read())
+
+        self.assertEqual(0, cgroup.get_oom_kills())
+        with open(os.path.join(cgroup.path, 'memory.events'), 'w') as f:
+            f.write('low 0\nhigh 0\nmax 3\noom 1\noom_kill 1\n')
+        self.assertEqual(1, cgroup.get_oom_kills())
+
+    def test_is_enabled(self):
+        """
+        Test :meth:`.RunCgroup.is_enabled`.
+        """
+        self.assertTrue(RunCgroup.is_enabled())
+        self.settings.cgroup_path = ''
+        self.assertFalse(RunCgroup.is_enabled())
@@ -0,0 +1,149 @@
+import os
+import shutil
+import tempfile
+import unittest2 as unittest
+
+import gevent
+from gevent.event import Event
+from gevent.queue import Queue
+from mock import patch
+
+from job_runner_worker.concurrency import (
+    ConcurrencyController, get_memory_available, get_pressure)
+
+
+class ModuleTestCase(unittest.TestCase):
+    """
+    Tests for :mod:`job_runner_worker.concurrency`.
+    """
+    def setUp(self):
+        self.proc_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.proc_path)
+
+    def test_get_memory_available(self):
+        """
+        Test :func:`.get_memory_available`.
+        """
+        self.assertIsNone(get_memory_available(self.proc_path))
+
+        with open(os.path.join(self.proc_path, 'meminfo'), 'w') as f:
+            f.write(
+                'MemTotal:        1000 kB\n'
+                'MemFree:          100 kB\n'
+                'MemAvailable:     250 kB\n'
+                'HugePages_Total:    0\n'
+            )
+
+        self.assertEqual(0.25, get_memory_available(self.proc_path))
+
+    def test_get_pressure(self):
+        """
+        Test :func:`.get_pressure`.
+        """
+        self.assertIsNone(get_pressure(self.proc_path))
+
+        os.mkdir(os.path.join(self.proc_path, 'pressure'))
+        for name, avg10 in (('cpu', '12.50'), ('memory', '3.00')):
+            pressure_path = os.path.join(self.proc_path, 'pressure', name)
+            with open(pressure_path, 'w') as f:
+                f.write(
+                    'some avg10={0} avg60=1.00 avg300=0.50 total=100\n'
+                    'full avg10=99.00 avg60=0.00 avg300=0.00 total=0\n'.format(
+                        avg10))
+
+        self.assertEqual(12.5, get_pressure(self.proc_path))
+
+
+class ConcurrencyControllerTestCase(unittest.TestCase):
+    """
+    Tests for :class:`.ConcurrencyController`.
+    """
+    def setUp(self):
+        settings_patcher = patch('job_runner_worker.concurrency.settings')
+        self.settings = settings_patcher.start()
+        self.settings.concurrent_jobs = 2
+        self.settings.concurrent_jobs_min = 1
+        self.settings.concurrent_jobs_max = 3
+        self.settings.concurrency_max_load = 1.0
+        self.settings.concurrency_min_memory = 0.1
+        self.settings.concurrency_max_pressure = 20
+        self.addCleanup(settings_patcher.stop)
+
+    def test_acquire_and_release(self):
+        """
+        Test :meth:`.ConcurrencyController.acquire` and ``release``.
+        """
+        controller = ConcurrencyController()
+        exit_event = Event()
+
+        self.assertTrue(controller.acquire(exit_event))
+        self.assertTrue(controller.acquire(exit_event))
+
+        waiter = gevent.spawn(controller.acquire, exit_event)
+        gevent.sleep(0)
+        self.assertFalse(waiter.ready())
+
+        controller.release()
+        self.assertTrue(waiter.get(timeout=1))
+        self.assertEqual(2, controller.active)
+
+        # a higher limit frees a slot
+        waiter = gevent.spawn(controller.acquire, exit_event)
+        gevent.sleep(0)
+        controller.set_limit(3)
+        self.assertTrue(waiter.get(timeout=1))
+
+        waiter = gevent.spawn(controller.acquire, exit_event)
+        gevent.sleep(0)
+        exit_event.set()
+        self.assertFalse(waiter.get(timeout=1))
+        self.assertEqual(3, controller.active)
+
+    @patch('job_runner_worker.concurrency.get_pressure')
+    @patch('job_runner_worker.concurrency.get_memory_available')
+    @patch('job_runner_worker.concurrency.get_load_per_cpu')
+    def test_adjust(self, get_load_per_cpu, get_memory_available,
+                    get_pressure):
+        """
+        Test :meth:`.ConcurrencyController.adjust`.
+        """
+        get_load_per_cpu.return_value = 0.5
+        get_memory_available.return_value = 0.5
+        get_pressure.return_value = None
+
+        run_queue = Queue()
+        controller = ConcurrencyController()
+        controller.start(run_queue)
+        self.addCleanup(controller.stop)
+
+        # not all slots are in use
+        run_queue.put('run')
+        controller.adjust()
+        self.assertEqual(2, controller.get_limit())
+
+        # all slots are in use, but no runs are waiting
+        run_queue.get()
+        controller.active = 2
+        controller.adjust()
+        self.assertEqual(2, controller.get_limit())
+
+        run_queue.put('run')
+        controller.adjust()
+        self.assertEqual(3, controller.get_limit())
+
+        controller.active = 3
+        controller.adjust()
+        self.assertEqual(3, controller.get_limit())
+
+        get_pressure.return_value = 30.0
+        controller.adjust()
+        self.assertEqual(2, controller.get_limit())
+
+        get_pressure.return_value = None
+        get_memory_available.return_value = 0.05
+        controller.adjust()
+        self.assertEqual(1, controller.get_limit())
+
+        get_load_per_cpu.return_value = 4.0
+        controller.adjust()
+        self.assertEqual(1, controller.get_limit())
@@ -2,7 +2,13 @@ import unittest2 as unittest
 
 from mock import Mock, patch
 
-from job_runner_worker.config import get_config_parser, setup_log_handler
+from job_runner_worker.config import (
+    ConfigError,
+    Settings,
+    get_config_parser,
+    reload_settings,
+    setup_log_handler,
+)
 
 
 class ModuleTestCase(unittest.TestCase):
@@ -30,14 +36,75 @@ class ModuleTestCase(unittest.TestCase):
             'run_log_resource_uri': '/api/v1/run_log/',
             'kill_request_resource_uri': '/api/v1/kill_request/',
             'concurrent_jobs': '4',
+            'concurrent_jobs_min': '1',
+            'concurrent_jobs_max': '0',
+            'concurrency_interval': '10',
+            'concurrency_max_load': '1.0',
+            'concurrency_min_memory': '0.1',
+            'concurrency_max_pressure': '20',
+            'run_queue_discipline': 'fifo',
+            'run_priority_field': 'priority',
+            'run_queue_aging': '60',
+            'finalizers': '2',
+            'finalize_backlog': '100',
             'ws_server_port': '5555',
             'broadcaster_server_port': '5556',
             'reconnect_after_inactivity': str(60 * 10),
             'script_temp_path': '/tmp',
+            'script_storage': 'file',
+            'zygote_shebangs': '',
+            'zygote_modules': '',
+            'api_pool_maxsize': '10',
+            'api_idle_timeout': '60',
+            'patch_coalesce_window': '0.5',
+            'worker_cache_ttl': str(60 * 10),
+            'api_retry_base_delay': '2',
+            'api_retry_max_delay': '60',
+            'api_retry_budget': '100',
+            'api_retry_budget_ratio': '0.1',
+            'api_circuit_failure_threshold': '10',
+            'api_circuit_reset_timeout': '30',
+            'script_cache_max_bytes': str(10 * 1024 * 1024),
+            'model_cache_ttl': '5',
+            'api_compress_encoding': '',
+            'api_compress_min_bytes': str(4 * 1024),
+            'outbox_path': '',
+            'outbox_drain_timeout': '30',
+            'outbox_max_attempts': '10',
+            'outbox_park_time': '300',
+            'log_ship_interval': '60',
+            'log_ship_min_bytes': '1',
+            'log_archive_path': '',
+            'log_archive_max_bytes': str(1024 * 1024 * 1024),
+            'log_archive_max_age': str(60 * 60 * 24 * 7),
+            'cgroup_path': '',
+            'resource_usage_field': '',
+            'run_max_address_space': '0',
+            'run_max_cpu_time': '0',
+            'run_max_open_files': '0',
+            'run_nice': '0',
+            'run_timeout': '0',
+            'run_timeout_field': '',
+            'run_timeout_grace': '10',
+            'run_timed_out_field': '',
+            'cgroup_memory_max': '0',
+            'cgroup_cpu_max': '0',
         })
         config_mock.read.assert_called_once_with('/path/to/settings')
         self.assertEqual(config_mock, config)
 
+    @patch('job_runner_worker.config.os')
+    def test_get_config_parser_missing_file(self, os):
+        """
+        Test :py:func:`.get_config_parser` when the config file is missing.
+        """
+        os.environ = {'CONFIG_PATH': '/does/not/exist'}
+
+        config = get_config_parser()
+
+        self.assertEqual(
+            4, config.getint('job_runner_worker', 'concurrent_jobs'))
+
     @patch('job_runner_worker.config.logging')
     def test_setup_log_handler(self, logging):
         """
@@ -49,3 +116,112 @@ class ModuleTestCase(unittest.TestCase):
             level=logging.INFO,
             format='%(levelname)s - %(asctime)s - %(name)s: %(message)s',
         )
+
+
+class SettingsTestCase(unittest.TestCase):
+    """
+    Tests for :py:class:`.Settings`.
+    """
+    def setUp(self):
+        self.config_parser = get_config_parser()
+        for name, value in [
+                ('api_base_url', 'http://api/'),
+                ('api_key', 'public'),
+                ('secret', 'key'),
+                ('ws_server_hostname', 'ws'),
+                ('broadcaster_server_hostname', 'broadcaster')]:
+            self.config_parser.set('job_runner_worker', name, value)
+
+    def test_load(self):
+        """
+        Test :py:meth:`.Settings.load`.
+        """
+        self.config_parser.set('job_runner_worker', 'concurrent_jobs', '8')
+
+        settings = Settings(self.config_parser)
+
+        self.assertEqual('http://api/', settings.api_base_url)
+        self.assertEqual(8, settings.concurrent_jobs)
+        self.assertEqual(0.5, settings.patch_coalesce_window)
+        self.assertEqual(800 * 1024, settings.max_log_bytes)
+        self.assertEqual('public', settings.auth.api_key)
+        self.assertEqual('key', settings.auth.secret)
+        settings.validate()
+
+        self.assertRaises(AttributeError, setattr, settings, 'foo', 'bar')
+
+    def test_load_invalid(self):
+        """
+        Test :py:meth:`.Settings.load` with an invalid value.
+        """
+        settings = Settings(self.config_parser)
+
+        self.config_parser.set('job_runner_worker', 'concurrent_jobs', '8')
+        self.config_parser.set('job_runner_worker', 'max_log_bytes', 'foo')
+
+        self.assertRaises(ConfigError, settings.load, self.config_parser)
+        # the current settings are kept
+        self.assertEqual(4, settings.concurrent_jobs)
+
+    def test_validate(self):
+        """
+        Test :py:meth:`.Settings.validate`.
+        """
+        self.config_parser.remove_option('job_runner_worker', 'secret')
+        self.assertRaises(
+            ConfigError, Settings(self.config_parser).validate)
+
+        self.config_parser.set('job_runner_worker', 'secret', 'key')
+        self.config_parser.set('job_runner_worker', 'concurrent_jobs', '0')
+        self.assertRaises(
+            ConfigError, Settings(self.config_parser).validate)
+
+        self.config_parser.set('job_runner_worker', 'concurrent_jobs', '1')
+        self.config_parser.set(
+            'job_runner_worker', 'concurrent_jobs_max', '8')
+        self.config_parser.set(
+            'job_runner_worker', 'concurrent_jobs_min', '2')
+        self.assertRaises(
+            ConfigError, Settings(self.config_parser).validate)
+
+        self.config_parser.set(
+            'job_runner_worker', 'concurrent_jobs_min', '1')
+        self.config_parser.set(
+            'job_runner_worker', 'api_compress_encoding', 'br')
+        self.assertRaises(
+            ConfigError, Settings(self.config_parser).validate)
+
+        self.config_parser.set(
+            'job_runner_worker', 'api_compress_encoding', '')
+        self.config_parser.set('job_runner_worker', 'script_storage', 'ram')
+        self.assertRaises(
+            ConfigError, Settings(self.config_parser).validate)
+
+        self.config_parser.set('job_runner_worker', 'script_storage', 'file')
+        self.config_parser.set(
+            'job_runner_worker', 'run_queue_discipline', 'lifo')
+        self.assertRaises(
+            ConfigError, Settings(self.config_parser).validate)
+
+        self.config_parser.set(
+            'job_runner_worker', 'run_queue_discipline', 'fifo')
+        self.config_parser.set('job_runner_worker', 'finalizers', '0')
+        self.assertRaises(
+            ConfigError, Settings(self.config_parser).validate)
+
+    @patch('job_runner_worker.config._reload_callbacks')
+    @patch('job_runner_worker.config.settings')
+    @patch('job_runner_worker.config.get_config_parser')
+    def test_reload_settings(
+            self, get_config_parser, settings, reload_callbacks):
+        """
+        Test :py:func:`.reload_settings`.
+        """
+        callback = Mock()
+        reload_callbacks.__iter__.return_value = iter([callback])
+        get_config_parser.return_value = self.config_parser
+
+        reload_settings()
+
+        settings.load.assert_called_once_with(self.config_parser)
+        callback.assert_called_once_with()
@@ -1,7 +1,7 @@
 import unittest2 as unittest
 
 import gevent
-from gevent.queue import Queue
+from gevent.event import Event
 from mock import Mock, patch
 from pytz import utc
 
@@ -12,6 +12,7 @@ from job_runner_worker.enqueuer import (
     _handle_ping_action,
     enqueue_actions
 )
+from job_runner_worker.models import RequestClientError
 
 
 class ModuleTestCase(unittest.TestCase):
@@ -19,12 +20,13 @@ class ModuleTestCase(unittest.TestCase):
     Tests for :mod:`job_runner_worker.enqueuer`.
     """
     @patch('job_runner_worker.enqueuer._handle_enqueue_action')
-    @patch('job_runner_worker.enqueuer.config')
-    def test_enqueue_actions_enqueue(self, config, enqueue_action):
+    @patch('job_runner_worker.enqueuer.settings')
+    def test_enqueue_actions_enqueue(self, settings, enqueue_action):
         """
         Test :func:`.enqueue_actions` with ``'enqueue'`` action.
         """
-        config.get.return_value = 'foo'
+        settings.api_key = 'foo'
+        settings.reconnect_after_inactivity = 600
 
         enqueue_action.side_effect = Exception('Boom!')
 
@@ -46,36 +48,44 @@ class ModuleTestCase(unittest.TestCase):
             run_queue,
             kill_queue,
             event_queue,
-            Queue()
+            Event()
         )
 
         enqueue_action.assert_called_once_with(
             {'action': 'enqueue'}, run_queue, event_queue)
 
-    @patch('job_runner_worker.enqueuer.config')
-    def test_enqueue_actions_exit(self, config):
+    @patch('job_runner_worker.enqueuer.settings')
+    def test_enqueue_actions_exit(self, settings):
         """
         Test :func:`.enqueue_actions` returning.
 
-        The infinite loop should return because we put something in the
-        ``exit_queue``.
+        The infinite loop should return because the ``exit_event`` is set
+        while waiting for a message.
 
         """
-        config.get.side_effect = lambda *args: '.'.join(args)
-        exit_queue = Queue()
-        exit_queue.put(Mock())
+        settings.reconnect_after_inactivity = 600
+        exit_event = Event()
+        zmq_context = Mock()
+        subscriber = zmq_context.socket.return_value
+        subscriber.recv_multipart.side_effect = lambda: gevent.sleep(10)
 
         greenlet = gevent.spawn(
-            enqueue_actions, Mock(), Mock(), Mock(), Mock(), exit_queue)
-        greenlet.join()
+            enqueue_actions, zmq_context, Mock(), Mock(), Mock(), exit_event)
+        gevent.sleep(0)
+        exit_event.set()
+        greenlet.join(1)
+
+        self.assertTrue(greenlet.successful())
+        subscriber.close.assert_called_once_with()
 
     @patch('job_runner_worker.enqueuer._handle_kill_action')
-    @patch('job_runner_worker.enqueuer.config')
-    def test_enqueue_actions_kill(self, config, kill_action):
+    @patch('job_runner_worker.enqueuer.settings')
+    def test_enqueue_actions_kill(self, settings, kill_action):
         """
         Test :func:`.enqueue_actions` with ``'kill'`` action.
         """
-        config.get.return_value = 'foo'
+        settings.api_key = 'foo'
+        settings.reconnect_after_inactivity = 600
 
         kill_action.side_effect = Exception('Boom!')
 
@@ -97,22 +107,22 @@ class ModuleTestCase(unittest.TestCase):
             run_queue,
             kill_queue,
             event_queue,
-            Queue()
+            Event()
         )
 
         kill_action.assert_called_once_with(
             {'action': 'kill'}, kill_queue, event_queue)
 
-    @patch('job_runner_worker.enqueuer.config')
+    @patch('job_runner_worker.enqueuer.settings')
     @patch('job_runner_worker.enqueuer.datetime')
     @patch('job_runner_worker.enqueuer.Run')
-    @patch('job_runner_worker.enqueuer.Worker')
-    def test__handle_enqueue_action(self, Worker, Run, datetime, config):
+    @patch('job_runner_worker.enqueuer.worker_cache')
+    def test__handle_enqueue_action(
+            self, worker_cache, Run, datetime, settings):
         """
         Test :func:`._handle_enqueue_action`.
         """
-        worker = Mock()
-        Worker.get_list.return_value = [worker]
+        worker = worker_cache.get.return_value
 
         run_queue = Mock()
         event_queue = Mock()
@@ -138,14 +148,14 @@ class ModuleTestCase(unittest.TestCase):
             '{"kind": "run", "event": "enqueued", "run_id": 1234}')
         datetime.now.assert_called_with(utc)
 
-    @patch('job_runner_worker.enqueuer.config')
+    @patch('job_runner_worker.enqueuer.settings')
     @patch('job_runner_worker.enqueuer.datetime')
     @patch('job_runner_worker.enqueuer.KillRequest')
-    def test__handle_kill_action(self, KillRequest, datetime, config):
+    def test__handle_kill_action(self, KillRequest, datetime, settings):
         """
         Test :func:`._handle_kill_action`.
         """
-        config.get.return_value = 'foo'
+        settings.api_key = 'foo'
 
         kill_queue = Mock()
         event_queue = Mock()
@@ -171,28 +181,38 @@ class ModuleTestCase(unittest.TestCase):
         ))
         datetime.now.assert_called_once_with(utc)
 
+    @patch('job_runner_worker.enqueuer.concurrency_controller')
     @patch('job_runner_worker.enqueuer.datetime')
-    @patch('job_runner_worker.enqueuer.Worker')
-    @patch('job_runner_worker.enqueuer.config')
-    def test__handle_ping_action(self, config, Worker, datetime):
+    @patch('job_runner_worker.enqueuer.worker_cache')
+    @patch('job_runner_worker.enqueuer.settings')
+    def test__handle_ping_action(
+            self, settings, worker_cache, datetime, concurrency_controller):
         """
         Test func:`._handle_ping_action`.
         """
-        config.get.side_effect = lambda *args: '.'.join(args)
-        config.getint.return_value = 4
+        concurrency_controller.get_limit.return_value = 6
 
-        worker = Mock()
-        Worker.get_list.return_value = [worker]
+        worker = worker_cache.get.return_value
 
         _handle_ping_action(Mock())
 
-        Worker.get_list.assert_called_once_with(
-            'job_runner_worker.worker_resource_uri'
-        )
+        worker_cache.get.assert_called_once_with()
 
         dts = datetime.now.return_value.isoformat.return_value
         worker.patch.assert_called_once_with({
             'ping_response_dts': dts,
             'worker_version': job_runner_worker.__version__,
-            'concurrent_jobs': 4,
+            'concurrent_jobs': 6,
         })
+
+    @patch('job_runner_worker.enqueuer.worker_cache')
+    @patch('job_runner_worker.enqueuer.settings')
+    def test__handle_ping_action_client_error(self, settings, worker_cache):
+        """
+        Test func:`._handle_ping_action` invalidating the worker cache.
+        """
+        settings.concurrent_jobs = 4
+        worker_cache.get.return_value.patch.side_effect = RequestClientError
+
+        self.assertRaises(RequestClientError, _handle_ping_action, Mock())
+        worker_cache.invalidate.assert_called_once_with()
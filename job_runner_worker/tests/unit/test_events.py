@@ -1,6 +1,7 @@
 import unittest2 as unittest
 
-from gevent.queue import Empty, Queue
+from gevent.event import Event
+from gevent.queue import Queue
 from mock import Mock, call, patch
 
 from job_runner_worker.events import publish
@@ -10,18 +11,13 @@ class ModuleTestCase(unittest.TestCase):
     """
     Tests for :mod:`job_runner_worker.events`.
     """
-    @patch('job_runner_worker.events.config')
-    def test_publish(self, config):
+    @patch('job_runner_worker.events.settings')
+    def test_publish(self, settings):
         """
-        Test :func:`.websocket`.
+        Test :func:`.publish` publishing all events before terminating.
         """
-        def config_side_effect(*args):
-            return {
-                ('job_runner_worker', 'ws_server_hostname'): 'localhost',
-                ('job_runner_worker', 'ws_server_port'): 5555,
-            }[args]
-
-        config.get.side_effect = config_side_effect
+        settings.ws_server_hostname = 'localhost'
+        settings.ws_server_port = 5555
 
         context = Mock()
         publisher = context.socket.return_value
@@ -29,9 +25,10 @@ class ModuleTestCase(unittest.TestCase):
         event_queue = Queue()
         event_queue.put('foo')
         event_queue.put('bar')
-        exit_queue = Mock()
+        exit_event = Event()
+        exit_event.set()
 
-        publish(context, event_queue, exit_queue)
+        publish(context, event_queue, exit_event)
 
         self.assertEqual([
             call(['worker.event', 'foo']),
@@ -0,0 +1,83 @@
+import resource
+import signal
+import unittest2 as unittest
+
+from mock import Mock, call, patch
+
+from job_runner_worker.limits import (
+    apply_process_limits, get_limit_failure, get_rlimits, get_run_timeout)
+
+
+class ModuleTestCase(unittest.TestCase):
+    """
+    Tests for :mod:`job_runner_worker.limits`.
+    """
+    @patch('job_runner_worker.limits.settings')
+    def test_get_rlimits(self, settings):
+        """
+        Test :func:`.get_rlimits`.
+        """
+        settings.run_max_address_space = 1024
+        settings.run_max_cpu_time = 60
+        settings.run_max_open_files = 0
+
+        self.assertEqual([
+            (resource.RLIMIT_AS, (1024, 1024)),
+            (resource.RLIMIT_CPU, (60, 61)),
+        ], get_rlimits())
+
+    @patch('job_runner_worker.limits.os')
+    @patch('job_runner_worker.limits.resource')
+    def test_apply_process_limits(self, resource_mock, os):
+        """
+        Test :func:`.apply_process_limits`.
+        """
+        apply_process_limits([('as', (1, 1)), ('cpu', (2, 3))], 5)
+
+        self.assertEqual(
+            [call('as', (1, 1)), call('cpu', (2, 3))],
+            resource_mock.setrlimit.call_args_list
+        )
+        os.nice.assert_called_once_with(5)
+
+    @patch('job_runner_worker.limits.settings')
+    def test_get_limit_failure(self, settings):
+        """
+        Test :func:`.get_limit_failure`.
+        """
+        settings.run_max_cpu_time = 60
+        settings.cgroup_memory_max = 1024
+
+        self.assertIsNone(get_limit_failure(0))
+        self.assertIsNone(get_limit_failure(
+            -signal.SIGKILL, {'user_time': 1, 'system_time': 1}))
+        self.assertIn('CPU time limit', get_limit_failure(-signal.SIGXCPU))
+        self.assertIn('CPU time limit', get_limit_failure(
+            -signal.SIGKILL, {'user_time': 50, 'system_time': 11}))
+
+        cgroup = Mock()
+        cgroup.get_oom_kills.return_value = 1
+        self.assertIn('memory limit', get_limit_failure(-9, None, cgroup))
+
+        settings.run_max_cpu_time = 0
+        cgroup.get_oom_kills.return_value = 0
+        self.assertIsNone(get_limit_failure(-signal.SIGXCPU, None, cgroup))
+
+    @patch('job_runner_worker.limits.settings')
+    def test_get_run_timeout(self, settings):
+        """
+        Test :func:`.get_run_timeout`.
+        """
+        settings.run_timeout = 60
+        settings.run_timeout_field = ''
+        run = Mock()
+        self.assertEqual(60, get_run_timeout(run))
+        self.assertFalse(run.job.get_attribute.called)
+
+        settings.run_timeout_field = 'timeout'
+        run.job.get_attribute.return_value = '600'
+        self.assertEqual(600, get_run_timeout(run))
+        run.job.get_attribute.assert_called_once_with('timeout', 0)
+
+        run.job.get_attribute.return_value = 'never'
+        self.assertEqual(60, get_run_timeout(run))
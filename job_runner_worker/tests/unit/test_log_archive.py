@@ -0,0 +1,135 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest2 as unittest
+
+from mock import patch
+
+from job_runner_worker.log_archive import EVICT_INTERVAL, LogArchive
+
+
+class LogArchiveTestCase(unittest.TestCase):
+    """
+    Tests for :class:`.LogArchive`.
+    """
+    def setUp(self):
+        self.archive_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_path)
+
+        settings_patcher = patch('job_runner_worker.log_archive.settings')
+        self.settings = settings_patcher.start()
+        self.settings.log_archive_path = self.archive_path
+        self.settings.log_archive_max_bytes = 1024 * 1024
+        self.settings.log_archive_max_age = 3600
+        self.addCleanup(settings_patcher.stop)
+
+    def _archive(self, archive, run_id, content):
+        writer = archive.open(run_id)
+        writer.write(content)
+        self.assertTrue(writer.close())
+        return writer.path
+
+    def test_open_and_read(self):
+        """
+        Test :meth:`.LogArchive.open` and :meth:`.LogArchive.read`.
+        """
+        archive = LogArchive()
+        self.assertTrue(archive.is_enabled())
+
+        writer = archive.open(1234)
+        writer.write('Hello ')
+        # nothing is archived until the writer is closed
+        self.assertIsNone(archive.read(1234))
+        writer.write('World!')
+        writer.close()
+
+        self.assertEqual(
+            os.path.join(self.archive_path, 'run-1234.log.gz'), writer.path)
+        self.assertEqual('Hello World!', archive.read(1234))
+        self.assertEqual(['run-1234.log.gz'], os.listdir(self.archive_path))
+
+    def test_write_error(self):
+        """
+        Test :meth:`.ArchiveWriter.write` failing.
+        """
+        archive = LogArchive()
+        writer = archive.open(1234)
+        writer._gzip_file.write = lambda data: os.write(-1, data)
+
+        writer.write('Hello')
+        self.assertFalse(writer.close())
+        self.assertEqual([], os.listdir(self.archive_path))
+
+    def test_close_error(self):
+        """
+        Test :meth:`.ArchiveWriter.close` when the archive was removed.
+        """
+        archive = LogArchive()
+        writer = archive.open(1234)
+        writer.write('Hello')
+
+        shutil.rmtree(self.archive_path)
+        self.addCleanup(os.mkdir, self.archive_path)
+
+        self.assertFalse(writer.close())
+        self.assertIsNone(archive.read(1234))
+
+    def test_evict(self):
+        """
+        Test :meth:`.LogArchive.evict`.
+        """
+        archive = LogArchive()
+        now = time.time()
+
+        paths = [self._archive(archive, i, os.urandom(1000))
+                 for i in range(4)]
+        open(os.path.join(self.archive_path, 'other'), 'w').close()
+        partial_path = os.path.join(self.archive_path, 'run-9.log.gz.partial')
+        open(partial_path, 'w').close()
+
+        os.utime(paths[0], (now - 7200, now - 7200))
+        os.utime(partial_path, (now - 7200, now - 7200))
+        os.utime(paths[1], (now - 20, now - 20))
+        os.utime(paths[2], (now - 30, now - 30))
+        os.utime(paths[3], (now - 10, now - 10))
+
+        # reading marks the output as recently used
+        archive.read(2)
+
+        self.settings.log_archive_max_bytes = os.path.getsize(paths[2]) * 2
+        archive.evict()
+
+        self.assertEqual(
+            ['other', 'run-2.log.gz', 'run-3.log.gz'],
+            sorted(os.listdir(self.archive_path))
+        )
+
+    def test_add(self):
+        """
+        Test :meth:`.LogArchive.add` when output is archived.
+        """
+        archive = LogArchive()
+        first_path = self._archive(archive, 1, os.urandom(1000))
+        self.assertEqual(os.path.getsize(first_path), archive.total_bytes)
+
+        with patch.object(archive, 'evict', wraps=archive.evict) as evict:
+            second_path = self._archive(archive, 2, os.urandom(1000))
+            self.assertFalse(evict.called)
+            total_bytes = (
+                os.path.getsize(first_path) + os.path.getsize(second_path))
+            self.assertEqual(total_bytes, archive.total_bytes)
+
+            # expired output is removed after the evict interval
+            archive._evicted_at -= EVICT_INTERVAL + 1
+            self._archive(archive, 3, os.urandom(1000))
+            self.assertEqual(1, evict.call_count)
+
+            self.settings.log_archive_max_bytes = archive.total_bytes
+            self._archive(archive, 4, os.urandom(1000))
+            self.assertEqual(2, evict.call_count)
+
+        self.assertEqual(
+            ['run-2.log.gz', 'run-3.log.gz', 'run-4.log.gz'],
+            sorted(os.listdir(self.archive_path))
+        )
@@ -0,0 +1,115 @@
+import unittest2 as unittest
+
+import gevent
+from mock import Mock, patch
+
+from job_runner_worker.log_shipper import LogShipper
+from job_runner_worker.output import OutputCapture
+
+
+class LogShipperTestCase(unittest.TestCase):
+    """
+    Tests for :class:`.LogShipper`.
+    """
+    def setUp(self):
+        self.settings_patcher = patch('job_runner_worker.log_shipper.settings')
+        self.settings = self.settings_patcher.start()
+        self.settings.log_ship_interval = 0.01
+        self.settings.log_ship_min_bytes = 1
+        self.settings.run_log_resource_uri = '/api/run_log/'
+        self.settings.run_resource_uri = '/api/run/'
+
+    def tearDown(self):
+        self.settings_patcher.stop()
+
+    @patch('job_runner_worker.log_shipper.RunLog')
+    def test_ship(self, RunLog):
+        """
+        Test :meth:`.LogShipper.ship` creating and updating the log.
+        """
+        run = Mock()
+        run.id = 1234
+        run.run_log = None
+        RunLog.return_value.post.return_value = '/api/run_log/1/'
+        output = OutputCapture(100)
+        output.feed('foo')
+
+        log_shipper = LogShipper(run, Mock(), output)
+        log_shipper.ship()
+
+        RunLog.return_value.post.assert_called_once_with({
+            'run': '/api/run/1234/',
+            'content': 'foo',
+        })
+        RunLog.assert_called_with('/api/run_log/1/')
+        self.assertEqual(RunLog.return_value, log_shipper.run_log)
+
+        output.feed('bar')
+        log_shipper.ship()
+
+        RunLog.return_value.patch.assert_called_once_with(
+            {'content': 'foobar'})
+        self.assertEqual(2, log_shipper.shipments)
+
+    @patch('job_runner_worker.log_shipper.RunLog')
+    def test_ship_existing_log(self, RunLog):
+        """
+        Test :meth:`.LogShipper.ship` when the run already has a log.
+        """
+        run = Mock()
+        run_reload = Mock()
+        output = OutputCapture(100)
+        output.feed('foo')
+
+        log_shipper = LogShipper(run, run_reload, output)
+        log_shipper.ship()
+
+        run_reload.join.assert_called_once_with()
+        run.run_log.patch.assert_called_once_with({'content': 'foo'})
+        self.assertFalse(RunLog.called)
+
+    def test_start_and_stop(self):
+        """
+        Test :meth:`.LogShipper.start` and :meth:`.LogShipper.stop`.
+        """
+        output = OutputCapture(100)
+        log_shipper = LogShipper(Mock(), Mock(), output)
+        log_shipper.ship = Mock()
+
+        log_shipper.start()
+        gevent.sleep(0.05)
+        self.assertFalse(log_shipper.ship.called)
+
+        output.feed('foo')
+        gevent.sleep(0.05)
+        log_shipper.stop()
+        self.assertTrue(log_shipper.ship.called)
+        self.assertFalse(log_shipper.interrupted)
+
+    def test_stop_interrupts_shipment(self):
+        """
+        Test :meth:`.LogShipper.stop` while a shipment is in progress.
+        """
+        output = OutputCapture(100)
+        output.feed('foo')
+        log_shipper = LogShipper(Mock(), Mock(), output)
+        log_shipper.ship = Mock(side_effect=lambda: gevent.sleep(60))
+
+        log_shipper.start()
+        gevent.sleep(0.05)
+        self.assertTrue(log_shipper.ship.called)
+
+        with gevent.Timeout(1):
+            log_shipper.stop()
+        self.assertTrue(log_shipper.interrupted)
+
+    def test_start_disabled(self):
+        """
+        Test :meth:`.LogShipper.start` when ``log_ship_interval`` is ``0``.
+        """
+        self.settings.log_ship_interval = 0
+        log_shipper = LogShipper(Mock(), Mock(), OutputCapture(100))
+        log_shipper.start()
+        log_shipper.stop()
+
+        self.assertIsNone(log_shipper._greenlet)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest2 as unittest
+
+from mock import patch
+
+from job_runner_worker.materializer import ScriptMaterializer
+from job_runner_worker.script_cache import CachedScript
+
+
+class ScriptMaterializerTestCase(unittest.TestCase):
+    """
+    Tests for :class:`.ScriptMaterializer`.
+    """
+    def setUp(self):
+        self.script_temp_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.script_temp_path)
+
+        settings_patcher = patch('job_runner_worker.materializer.settings')
+        self.settings = settings_patcher.start()
+        self.settings.script_temp_path = self.script_temp_path
+        self.settings.script_storage = 'file'
+        self.addCleanup(settings_patcher.stop)
+
+        cache_patcher = patch('job_runner_worker.materializer.script_cache')
+        self.script_cache = cache_patcher.start()
+        self.script_cache.get_content_hashes.return_value = set()
+        self.addCleanup(cache_patcher.stop)
+
+        self.cached_script = CachedScript(u'#!/bin/sh\r\necho "H\xe9llo"\n')
+
+    def test_acquire_and_release(self):
+        """
+        Test :meth:`.ScriptMaterializer.acquire` and ``release``.
+        """
+        materializer = ScriptMaterializer()
+        path = materializer.acquire(self.cached_script)
+
+        self.assertEqual(self.script_temp_path, os.path.dirname(path))
+        with open(path) as script_file:
+            self.assertEqual(
+                u'#!/bin/sh\necho "H\xe9llo"\n'.encode('utf-8'),
+                script_file.read()
+            )
+
+        # the same content is materialized only once
+        self.assertEqual(path, materializer.acquire(self.cached_script))
+
+        materializer.release(path)
+        self.assertTrue(os.path.exists(path))
+        materializer.release(path)
+        self.assertFalse(os.path.exists(path))
+
+    def test_release_cached(self):
+        """
+        Test :meth:`.ScriptMaterializer.release` of a cached script.
+        """
+        self.script_cache.get_content_hashes.return_value = set([
+            self.cached_script.content_hash])
+
+        materializer = ScriptMaterializer()
+        path = materializer.acquire(self.cached_script)
+        materializer.release(path)
+        self.assertTrue(os.path.exists(path))
+
+        materializer.clear()
+        self.assertFalse(os.path.exists(path))
+
+    def test_acquire_memfd(self):
+        """
+        Test :meth:`.ScriptMaterializer.acquire` with memfd storage.
+        """
+        self.settings.script_storage = 'memfd'
+
+        materializer = ScriptMaterializer()
+        path = materializer.acquire(self.cached_script)
+
+        # falls back on a file when memfd is not supported
+        if materializer._memfd_supported:
+            self.assertTrue(path.startswith('/proc/'))
+            self.assertEqual([], os.listdir(self.script_temp_path))
+        with open(path) as script_file:
+            self.assertEqual(
+                u'#!/bin/sh\necho "H\xe9llo"\n'.encode('utf-8'),
+                script_file.read()
+            )
+
+        materializer.release(path)
+        self.assertFalse(os.path.exists(path))
+
+    def test_collect_garbage(self):
+        """
+        Test :meth:`.ScriptMaterializer.collect_garbage`.
+        """
+        names = [
+            'job-runner-worker-{0}-abc'.format(os.getpid()),
+            'job-runner-worker-999999999-abc',
+            'job-runner-worker-999999999-abc.tmp',
+            'other-file',
+        ]
+        for name in names:
+            open(os.path.join(self.script_temp_path, name), 'w').close()
+
+        ScriptMaterializer().collect_garbage()
+
+        self.assertEqual(
+            sorted([names[0], names[3]]),
+            sorted(os.listdir(self.script_temp_path))
+        )
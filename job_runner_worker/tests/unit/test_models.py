@@ -1,15 +1,24 @@
+import json
 import unittest2 as unittest
+import zlib
 
-from mock import Mock, patch
+import gevent
+from mock import Mock, call, patch
 from requests.exceptions import RequestException
 
 from job_runner_worker.models import (
     BaseRestModel,
+    IdentityMap,
+    Job,
     KillRequest,
+    PatchBuffer,
     RequestClientError,
     RequestServerError,
     Run,
-    retry_on_requests_error
+    WorkerCache,
+    call_with_retry,
+    retry_on_requests_error,
+    _encode_body,
 )
 
 
@@ -17,194 +26,268 @@ class ModuleTestCase(unittest.TestCase):
     """
     Tests for :mod:`~job_runner_worker.models`.
     """
+    @patch('job_runner_worker.models.settings')
+    def test__encode_body(self, settings):
+        """
+        Test :func:`._encode_body`.
+        """
+        settings.api_compress_min_bytes = 20
+        attributes = {'content': 'a' * 100}
+
+        settings.api_compress_encoding = ''
+        self.assertEqual(
+            ({'content-type': 'application/json'}, json.dumps(attributes)),
+            _encode_body(attributes)
+        )
+
+        settings.api_compress_encoding = 'gzip'
+        self.assertEqual(
+            ({'content-type': 'application/json'}, '{"foo": 1}'),
+            _encode_body({'foo': 1})
+        )
+        headers, data = _encode_body(attributes)
+        self.assertEqual('gzip', headers['content-encoding'])
+        self.assertEqual(
+            json.dumps(attributes),
+            zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        )
+
+        settings.api_compress_encoding = 'deflate'
+        headers, data = _encode_body(attributes)
+        self.assertEqual('deflate', headers['content-encoding'])
+        self.assertEqual(json.dumps(attributes), zlib.decompress(data))
+
+    @patch('job_runner_worker.models.retry')
     @patch('job_runner_worker.models.time')
-    def test_retry_on_requests_error(self, time):
+    def test_retry_on_requests_error(self, time, retry):
         """
         Test :func:`.retry_on_requests_error`.
         """
         exceptions = [RequestException, RequestServerError, Exception]
+        retry.circuit_breaker.get_wait_time.return_value = 0
+        retry.retry_policy.get_delay.side_effect = lambda attempt: attempt
 
         def func():
             exc = exceptions.pop(0)
             raise exc('Boom!')
 
         self.assertRaises(Exception, retry_on_requests_error(func))
-        self.assertEqual(2, time.sleep.call_count)
+        self.assertEqual([call(1), call(2)], time.sleep.call_args_list)
+        self.assertEqual(2, retry.circuit_breaker.record_failure.call_count)
+        self.assertEqual(2, retry.retry_budget.withdraw.call_count)
+        retry.circuit_breaker.record_success.assert_called_once_with()
+
+    @patch('job_runner_worker.models.retry')
+    @patch('job_runner_worker.models.time')
+    def test_call_with_retry_max_server_errors(self, time, retry):
+        """
+        Test :func:`.call_with_retry` giving up after 5xx responses.
+        """
+        retry.circuit_breaker.get_wait_time.return_value = 0
+        func = Mock(side_effect=[
+            RequestException,
+            RequestServerError('Boom!', 500),
+            RequestServerError('Unavailable', 503),
+            RequestServerError('Boom!', 500),
+            'foo',
+        ])
+        func.__name__ = 'func'
+
+        # the 503 of an outage is retried like a connection error
+        self.assertRaises(
+            RequestServerError,
+            call_with_retry, func, ('foo', ), max_server_errors=2)
+        self.assertEqual(4, func.call_count)
+        func.assert_called_with('foo')
+
+    @patch('job_runner_worker.models.retry')
+    @patch('job_runner_worker.models.time')
+    def test_retry_on_requests_error_circuit_open(self, time, retry):
+        """
+        Test :func:`.retry_on_requests_error` when the circuit is open.
+        """
+        retry.circuit_breaker.get_wait_time.side_effect = [10, 0]
+        retry.retry_policy.base_delay = 0
+        func = Mock(return_value='foo')
+        func.__name__ = 'func'
+
+        self.assertEqual('foo', retry_on_requests_error(func)())
+        time.sleep.assert_called_once_with(10)
+        func.assert_called_once_with()
+        retry.retry_budget.deposit.assert_called_once_with()
+
+    @patch('job_runner_worker.models.retry')
+    @patch('job_runner_worker.models.time')
+    def test_retry_on_requests_error_budget_exhausted(self, time, retry):
+        """
+        Test :func:`.retry_on_requests_error` when the budget is exhausted.
+        """
+        retry.circuit_breaker.get_wait_time.return_value = 0
+        retry.retry_budget.withdraw.return_value = False
+        retry.retry_policy.get_delay.return_value = 1
+        func = Mock(side_effect=[RequestServerError, 'foo'])
+        func.__name__ = 'func'
+
+        self.assertEqual('foo', retry_on_requests_error(func)())
+        retry.circuit_breaker.trip.assert_called_once_with()
 
 
 class BaseRestModelTestCase(unittest.TestCase):
     """
     Tests for :class:`.BaseRestModel`.
     """
-    @patch('job_runner_worker.models.HmacAuth')
-    @patch('job_runner_worker.models.config')
-    @patch('job_runner_worker.models.requests')
-    def test_patch(self, requests, config, HmacAuth):
+    @patch('job_runner_worker.models.settings')
+    @patch('job_runner_worker.models.api_session')
+    def test_patch(self, api_session, settings):
         """
         Test :meth:`.BaseRestModel.patch`.
         """
-        def config_get_side_effect(*args):
-            return {
-                ('job_runner_worker', 'api_base_url'): 'http://api/',
-                ('job_runner_worker', 'secret'): 'key',
-                ('job_runner_worker', 'api_key'): 'public',
-            }[args]
-
-        config.get.side_effect = config_get_side_effect
-        response = requests.patch.return_value
+        settings.api_base_url = 'http://api/'
+        settings.api_compress_encoding = ''
+        response = api_session.patch.return_value
         response.status_code = 202
 
-        base_model = BaseRestModel('/path/to/resource')
+        base_model = BaseRestModel('/path/to/resource', {'published': False})
         base_model.patch({'field_name': 'field_value', 'published': True})
 
-        requests.patch.assert_called_once_with(
+        api_session.patch.assert_called_once_with(
             'http://api/path/to/resource',
-            auth=HmacAuth.return_value,
+            auth=settings.auth,
             headers={'content-type': 'application/json'},
             data='{"field_name": "field_value", "published": true}',
             verify=False,
         )
+        self.assertTrue(base_model.published)
 
-    @patch('job_runner_worker.models.HmacAuth')
-    @patch('job_runner_worker.models.config')
-    @patch('job_runner_worker.models.requests')
-    def test_post(self, requests, config, HmacAuth):
+    @patch('job_runner_worker.models.settings')
+    @patch('job_runner_worker.models.api_session')
+    def test_post(self, api_session, settings):
         """
         Test :meth:`.BaseRestModel.post`.
         """
-        def config_get_side_effect(*args):
-            return {
-                ('job_runner_worker', 'api_base_url'): 'http://api/',
-                ('job_runner_worker', 'secret'): 'key',
-                ('job_runner_worker', 'api_key'): 'public',
-            }[args]
-
-        config.get.side_effect = config_get_side_effect
-        response = requests.post.return_value
+        settings.api_base_url = 'http://api/'
+        settings.api_compress_encoding = ''
+        response = api_session.post.return_value
         response.status_code = 201
+        response.headers = {'location': 'http://api/path/to/resource/1/'}
 
         base_model = BaseRestModel('/path/to/resource')
-        base_model.post({'field_name': 'field_value', 'published': True})
+        self.assertEqual(
+            '/path/to/resource/1/',
+            base_model.post({'field_name': 'field_value', 'published': True})
+        )
 
-        requests.post.assert_called_once_with(
+        api_session.post.assert_called_once_with(
             'http://api/path/to/resource',
-            auth=HmacAuth.return_value,
+            auth=settings.auth,
             headers={'content-type': 'application/json'},
             data='{"field_name": "field_value", "published": true}',
             verify=False,
         )
 
-    @patch('job_runner_worker.models.HmacAuth')
-    @patch('job_runner_worker.models.config')
-    @patch('job_runner_worker.models.requests')
-    def test_patch_not_202(self, requests, config, HmacAuth):
+    @patch('job_runner_worker.models.settings')
+    @patch('job_runner_worker.models.api_session')
+    def test_patch_not_202(self, api_session, settings):
         """
         Test :meth:`.BaseRestModel.patch`.
         """
-        def config_get_side_effect(*args):
-            return {
-                ('job_runner_worker', 'api_base_url'): 'http://api/',
-                ('job_runner_worker', 'secret'): 'key',
-                ('job_runner_worker', 'api_key'): 'public',
-            }[args]
-
-        config.get.side_effect = config_get_side_effect
-        response = requests.patch.return_value
+        settings.api_base_url = 'http://api/'
+        response = api_session.patch.return_value
         response.status_code = 418
 
         base_model = BaseRestModel('/path/to/resource')
         self.assertRaises(RequestClientError, base_model.patch, {'foo': 'bar'})
 
-    @patch('job_runner_worker.models.HmacAuth')
-    @patch('job_runner_worker.models.config')
-    @patch('job_runner_worker.models.requests')
-    def test_post_not_201(self, requests, config, HmacAuth):
+    @patch('job_runner_worker.models.settings')
+    @patch('job_runner_worker.models.api_session')
+    def test_post_not_201(self, api_session, settings):
         """
         Test :meth:`.BaseRestModel.patch`.
         """
-        def config_get_side_effect(*args):
-            return {
-                ('job_runner_worker', 'api_base_url'): 'http://api/',
-                ('job_runner_worker', 'secret'): 'key',
-                ('job_runner_worker', 'api_key'): 'public',
-            }[args]
-
-        config.get.side_effect = config_get_side_effect
-        response = requests.post.return_value
+        settings.api_base_url = 'http://api/'
+        response = api_session.post.return_value
         response.status_code = 418
 
         base_model = BaseRestModel('/path/to/resource')
         self.assertRaises(RequestClientError, base_model.post, {'foo': 'bar'})
 
-    @patch('job_runner_worker.models.HmacAuth')
-    @patch('job_runner_worker.models.config')
-    @patch('job_runner_worker.models.requests')
-    def test__get_json_data(self, requests, config, HmacAuth):
+    @patch('job_runner_worker.models.settings')
+    @patch('job_runner_worker.models.api_session')
+    def test__get_json_data(self, api_session, settings):
         """
         Tests :meth:`.BaseRestModel._get_json_data`.
         """
-        def config_get_side_effect(*args):
-            return {
-                ('job_runner_worker', 'api_base_url'): 'http://api/',
-                ('job_runner_worker', 'secret'): 'key',
-                ('job_runner_worker', 'api_key'): 'public',
-            }[args]
-
-        config.get.side_effect = config_get_side_effect
-        response = requests.get.return_value
+        settings.api_base_url = 'http://api/'
+        response = api_session.get.return_value
         response.status_code = 200
 
         base_model = BaseRestModel('/path/to/resource')
 
         self.assertEqual(response.json, base_model._get_json_data())
 
-        requests.get.assert_called_once_with(
+        api_session.get.assert_called_once_with(
             'http://api/path/to/resource',
-            auth=HmacAuth.return_value,
+            auth=settings.auth,
             headers={'content-type': 'application/json'},
             verify=False,
         )
 
-        HmacAuth.assert_called_once_with('public', 'key')
+    @patch('job_runner_worker.models.settings')
+    @patch('job_runner_worker.models.api_session')
+    def test_get_if_modified(self, api_session, settings):
+        """
+        Test :meth:`.BaseRestModel.get_if_modified`.
+        """
+        settings.api_base_url = 'http://api/'
+        response = api_session.get.return_value
+        response.status_code = 200
+        response.json = {'foo': 'bar'}
+        response.headers = {'etag': '"abc"', 'last-modified': 'yesterday'}
+
+        base_model = BaseRestModel('/path/to/resource')
+
+        self.assertEqual(
+            (True, '"abc"', 'yesterday'), base_model.get_if_modified())
+        self.assertEqual('bar', base_model.foo)
+
+        response.status_code = 304
+        self.assertEqual(
+            (False, '"abc"', 'yesterday'),
+            base_model.get_if_modified('"abc"', 'yesterday')
+        )
+        api_session.get.assert_called_with(
+            'http://api/path/to/resource',
+            auth=settings.auth,
+            headers={
+                'content-type': 'application/json',
+                'If-None-Match': '"abc"',
+                'If-Modified-Since': 'yesterday',
+            },
+            verify=False,
+        )
 
-    @patch('job_runner_worker.models.HmacAuth')
-    @patch('job_runner_worker.models.config')
-    @patch('job_runner_worker.models.requests')
-    def test__get_json_data_not_200(self, requests, config, HmacAuth):
+    @patch('job_runner_worker.models.settings')
+    @patch('job_runner_worker.models.api_session')
+    def test__get_json_data_not_200(self, api_session, settings):
         """
         Tests :meth:`.BaseRestModel._get_json_data` not returning 200.
         """
-        def config_get_side_effect(*args):
-            return {
-                ('job_runner_worker', 'api_base_url'): 'http://api/',
-                ('job_runner_worker', 'secret'): 'key',
-                ('job_runner_worker', 'api_key'): 'public',
-            }[args]
-
-        config.get.side_effect = config_get_side_effect
-        response = requests.get.return_value
+        settings.api_base_url = 'http://api/'
+        response = api_session.get.return_value
         response.status_code = 418
 
         base_model = BaseRestModel('/path/to/resource')
 
         self.assertRaises(RequestClientError, base_model._get_json_data)
 
-    @patch('job_runner_worker.models.HmacAuth')
-    @patch('job_runner_worker.models.config')
-    @patch('job_runner_worker.models.requests')
-    def test_get_list(self, requests, config, HmacAuth):
+    @patch('job_runner_worker.models.settings')
+    @patch('job_runner_worker.models.api_session')
+    def test_get_list(self, api_session, settings):
         """
         Test :meth:`.BaseRestModel.get_list`.
         """
-        def config_get_side_effect(*args):
-            return {
-                ('job_runner_worker', 'api_base_url'): 'http://api/',
-                ('job_runner_worker', 'secret'): 'key',
-                ('job_runner_worker', 'api_key'): 'public',
-            }[args]
-
-        config.get.side_effect = config_get_side_effect
-        response = requests.get.return_value
+        settings.api_base_url = 'http://api/'
+        response = api_session.get.return_value
         response.status_code = 200
         response.json = {
             'objects': [
@@ -221,22 +304,52 @@ class BaseRestModelTestCase(unittest.TestCase):
         self.assertEqual({'id': 1, 'resource_uri': 'foo'}, out[0]._data)
         self.assertEqual({'id': 2, 'resource_uri': 'bar'}, out[1]._data)
 
-    @patch('job_runner_worker.models.HmacAuth')
-    @patch('job_runner_worker.models.config')
-    @patch('job_runner_worker.models.requests')
-    def test_get_list_not_200(self, requests, config, HmacAuth):
+    @patch('job_runner_worker.models.settings')
+    @patch('job_runner_worker.models.api_session')
+    def test_iter_list(self, api_session, settings):
         """
-        Test :meth:`.BaseRestModel.get_list`.
+        Test :meth:`.BaseRestModel.iter_list` following the next pages.
         """
-        def config_get_side_effect(*args):
-            return {
-                ('job_runner_worker', 'api_base_url'): 'http://api/',
-                ('job_runner_worker', 'secret'): 'key',
-                ('job_runner_worker', 'api_key'): 'public',
-            }[args]
+        settings.api_base_url = 'http://api/'
+
+        first_response = Mock()
+        first_response.status_code = 200
+        first_response.json = {
+            'objects': [{'id': 1, 'resource_uri': 'foo'}],
+            'meta': {'next': '/path/to/resource?offset=1'},
+        }
+        second_response = Mock()
+        second_response.status_code = 200
+        second_response.json = {
+            'objects': [{'id': 2, 'resource_uri': 'bar'}],
+            'meta': {'next': None},
+        }
+        api_session.get.side_effect = [first_response, second_response]
+
+        models = BaseRestModel.iter_list('/path/to/resource', {'foo': 'bar'})
+
+        self.assertEqual('foo', next(models)._resource_path)
+        # the second page is fetched while processing the first page
+        gevent.sleep(0)
+        self.assertEqual(2, api_session.get.call_count)
+        self.assertEqual('bar', next(models)._resource_path)
+        self.assertRaises(StopIteration, next, models)
+
+        self.assertEqual({'foo': 'bar'}, api_session.get.call_args_list[0][1][
+            'params'])
+        self.assertEqual(
+            'http://api/path/to/resource?offset=1',
+            api_session.get.call_args_list[1][0][0]
+        )
 
-        config.get.side_effect = config_get_side_effect
-        response = requests.get.return_value
+    @patch('job_runner_worker.models.settings')
+    @patch('job_runner_worker.models.api_session')
+    def test_get_list_not_200(self, api_session, settings):
+        """
+        Test :meth:`.BaseRestModel.get_list`.
+        """
+        settings.api_base_url = 'http://api/'
+        response = api_session.get.return_value
         response.status_code = 418
 
         self.assertRaises(
@@ -250,6 +363,100 @@ class BaseRestModelTestCase(unittest.TestCase):
         base_model._get_json_data = Mock(return_value={'foo': 'bar'})
         self.assertEqual('bar', base_model.foo)
 
+    def test_get_attribute(self):
+        """
+        Test :meth:`.BaseRestModel.get_attribute`.
+        """
+        base_model = BaseRestModel(Mock())
+        base_model._get_json_data = Mock(
+            return_value={'foo': 'bar', 'empty': None})
+        self.assertEqual('bar', base_model.get_attribute('foo'))
+        self.assertEqual(1, base_model.get_attribute('empty', 1))
+        self.assertEqual(2, base_model.get_attribute('missing', 2))
+
+
+class PatchBufferTestCase(unittest.TestCase):
+    """
+    Tests for :class:`.PatchBuffer`.
+    """
+    @patch('job_runner_worker.models.settings')
+    def test_flush_merges_deferred(self, settings):
+        """
+        Test :meth:`.PatchBuffer.flush` merging deferred updates.
+        """
+        settings.patch_coalesce_window = 10
+        model = Mock()
+        model._resource_path = '/api/run/1/'
+
+        patch_buffer = PatchBuffer()
+        patch_buffer.add(model, {'start_dts': 'foo', 'pid': None})
+        patch_buffer.flush(model, {'pid': 1234})
+
+        model._patch.assert_called_once_with({
+            'start_dts': 'foo',
+            'pid': 1234,
+        })
+        self.assertEqual({}, patch_buffer._pending)
+        self.assertEqual({}, patch_buffer._timers)
+
+    @patch('job_runner_worker.models.settings')
+    def test_add_flushes_after_window(self, settings):
+        """
+        Test :meth:`.PatchBuffer.add` flushing after the window has passed.
+        """
+        settings.patch_coalesce_window = 0.01
+        model = Mock()
+        model._resource_path = '/api/run/1/'
+
+        patch_buffer = PatchBuffer()
+        patch_buffer.add(model, {'start_dts': 'foo'})
+        patch_buffer.add(model, {'enqueue_dts': 'bar'})
+        self.assertEqual(0, model._patch.call_count)
+
+        gevent.sleep(0.05)
+
+        model._patch.assert_called_once_with({
+            'start_dts': 'foo',
+            'enqueue_dts': 'bar',
+        })
+
+    @patch('job_runner_worker.models.settings')
+    def test_flush_all(self, settings):
+        """
+        Test :meth:`.PatchBuffer.flush_all`.
+        """
+        settings.patch_coalesce_window = 10
+        model_a = Mock()
+        model_a._resource_path = '/api/run/1/'
+        model_b = Mock()
+        model_b._resource_path = '/api/run/2/'
+
+        patch_buffer = PatchBuffer()
+        patch_buffer.add(model_a, {'foo': 'a'})
+        patch_buffer.add(model_b, {'foo': 'b'})
+        patch_buffer.flush_all()
+        patch_buffer.flush(model_a)
+
+        self.assertEqual([call({'foo': 'a'})], model_a._patch.call_args_list)
+        self.assertEqual([call({'foo': 'b'})], model_b._patch.call_args_list)
+
+    @patch('job_runner_worker.models.settings')
+    def test_pop(self, settings):
+        """
+        Test :meth:`.PatchBuffer.pop`.
+        """
+        settings.patch_coalesce_window = 0
+        model = Mock()
+        model._resource_path = '/api/run/1/'
+
+        patch_buffer = PatchBuffer()
+        patch_buffer.add(model, {'foo': 'bar'})
+
+        self.assertEqual({'foo': 'bar'}, patch_buffer.pop(model))
+        self.assertEqual({}, patch_buffer.pop(model))
+        gevent.sleep(0.01)
+        self.assertFalse(model._patch.called)
+
 
 class RunTestCase(unittest.TestCase):
     """
@@ -262,9 +469,9 @@ class RunTestCase(unittest.TestCase):
         """
         run_model = Run(Mock(), {'job': '/job/resource'})
 
-        self.assertEqual(JobMock.return_value, run_model.job)
+        self.assertEqual(JobMock.get.return_value, run_model.job)
 
-        JobMock.assert_called_once_with('/job/resource')
+        JobMock.get.assert_called_once_with('/job/resource')
 
 
 class KillRequestTestCase(unittest.TestCase):
@@ -278,5 +485,123 @@ class KillRequestTestCase(unittest.TestCase):
         """
         kill_request_model = KillRequest(Mock(), {'run': '/run/resource'})
 
-        self.assertEqual(RunMock.return_value, kill_request_model.run)
-        RunMock.assert_called_once_with('/run/resource')
+        self.assertEqual(RunMock.get.return_value, kill_request_model.run)
+        RunMock.get.assert_called_once_with('/run/resource')
+
+
+class IdentityMapTestCase(unittest.TestCase):
+    """
+    Tests for :class:`.IdentityMap`.
+    """
+    @patch('job_runner_worker.models.time')
+    @patch('job_runner_worker.models.settings')
+    def test_get(self, settings, time):
+        """
+        Test :meth:`.IdentityMap.get`.
+        """
+        settings.model_cache_ttl = 5
+        identity_map = IdentityMap()
+
+        time.time.return_value = 1000
+        job = identity_map.get(Job, '/api/job/1/')
+        self.assertIsInstance(job, Job)
+        self.assertEqual('/api/job/1/', job._resource_path)
+
+        time.time.return_value = 1004
+        self.assertIs(job, identity_map.get(Job, '/api/job/1/'))
+        self.assertIsNot(job, identity_map.get(Run, '/api/job/1/'))
+
+        time.time.return_value = 1005
+        self.assertIsNot(job, identity_map.get(Job, '/api/job/1/'))
+
+        self.assertEqual(
+            {'hits': 1, 'misses': 3, 'models': 2}, identity_map.get_stats())
+
+    @patch('job_runner_worker.models.settings')
+    def test_get_disabled(self, settings):
+        """
+        Test :meth:`.IdentityMap.get` with ``model_cache_ttl`` set to ``0``.
+        """
+        settings.model_cache_ttl = 0
+        identity_map = IdentityMap()
+
+        self.assertIsNot(
+            identity_map.get(Job, '/api/job/1/'),
+            identity_map.get(Job, '/api/job/1/'),
+        )
+
+    @patch('job_runner_worker.models.settings')
+    def test_register_and_invalidate(self, settings):
+        """
+        Test :meth:`.IdentityMap.register` and :meth:`.IdentityMap.invalidate`.
+        """
+        settings.model_cache_ttl = 5
+        identity_map = IdentityMap()
+
+        job = identity_map.get(Job, '/api/job/1/')
+        new_job = Job('/api/job/1/')
+        identity_map.register(new_job)
+        self.assertIs(new_job, identity_map.get(Job, '/api/job/1/'))
+
+        identity_map.invalidate(new_job)
+        self.assertIsNot(new_job, identity_map.get(Job, '/api/job/1/'))
+        self.assertIsNot(job, identity_map.get(Job, '/api/job/1/'))
+
+
+class WorkerCacheTestCase(unittest.TestCase):
+    """
+    Tests for :class:`.WorkerCache`.
+    """
+    @patch('job_runner_worker.models.time')
+    @patch('job_runner_worker.models.Worker')
+    @patch('job_runner_worker.models.settings')
+    def test_get(self, settings, Worker, time):
+        """
+        Test :meth:`.WorkerCache.get`.
+        """
+        settings.worker_resource_uri = '/api/worker/'
+        settings.worker_cache_ttl = 600
+        worker = Mock()
+        Worker.get_list.return_value = [worker]
+
+        worker_cache = WorkerCache()
+
+        time.time.return_value = 1000
+        self.assertEqual(worker, worker_cache.get())
+        time.time.return_value = 1500
+        self.assertEqual(worker, worker_cache.get())
+        time.time.return_value = 1700
+        self.assertEqual(worker, worker_cache.get())
+
+        self.assertEqual(2, Worker.get_list.call_count)
+        Worker.get_list.assert_called_with('/api/worker/')
+        self.assertEqual({'hits': 1, 'misses': 2}, worker_cache.get_stats())
+
+    @patch('job_runner_worker.models.Worker')
+    @patch('job_runner_worker.models.settings')
+    def test_get_invalidated(self, settings, Worker):
+        """
+        Test :meth:`.WorkerCache.get` after invalidation.
+        """
+        settings.worker_cache_ttl = 600
+        Worker.get_list.return_value = [Mock()]
+
+        worker_cache = WorkerCache()
+        worker_cache.get()
+        worker_cache.invalidate()
+        worker_cache.get()
+
+        self.assertEqual(2, Worker.get_list.call_count)
+
+    @patch('job_runner_worker.models.Worker')
+    @patch('job_runner_worker.models.settings')
+    def test_get_multiple_workers(self, settings, Worker):
+        """
+        Test :meth:`.WorkerCache.get` when multiple workers are returned.
+        """
+        Worker.get_list.return_value = [Mock(), Mock()]
+
+        worker_cache = WorkerCache()
+        self.assertEqual(None, worker_cache.get())
+        self.assertEqual(None, worker_cache.get())
+        self.assertEqual(2, Worker.get_list.call_count)
@@ -0,0 +1,218 @@
+import os
+import tempfile
+import thread
+import time
+import unittest2 as unittest
+
+import gevent
+from mock import Mock, call, patch
+
+from job_runner_worker.models import RequestClientError, RequestServerError
+from job_runner_worker.outbox import Outbox
+
+
+class OutboxTestCase(unittest.TestCase):
+    """
+    Tests for :class:`.Outbox`.
+    """
+    def setUp(self):
+        self.settings_patcher = patch('job_runner_worker.outbox.settings')
+        settings = self.settings_patcher.start()
+        settings.outbox_path = ':memory:'
+        settings.outbox_max_attempts = 2
+        settings.outbox_park_time = 300
+
+    def tearDown(self):
+        self.settings_patcher.stop()
+
+    @patch('job_runner_worker.outbox.BaseRestModel')
+    @patch('job_runner_worker.outbox.patch_buffer')
+    def test_flush(self, patch_buffer, BaseRestModel):
+        """
+        Test :meth:`.Outbox.flush` sending the requests in order.
+        """
+        patch_buffer.pop.return_value = {'start_dts': 'now'}
+        model = Mock()
+        model._resource_path = '/api/run/1/'
+        model._data = {'pid': None}
+        log_model = Mock()
+        log_model._resource_path = '/api/run_log/'
+
+        outbox = Outbox()
+        outbox.patch(model, {'pid': 1234})
+        outbox.post(log_model, {'content': 'foo'})
+
+        patch_buffer.pop.assert_called_once_with(model)
+        self.assertEqual({'pid': 1234, 'start_dts': 'now'}, model._data)
+        self.assertEqual(2, outbox.get_pending())
+
+        outbox.flush()
+
+        self.assertEqual(
+            [call('/api/run/1/'), call('/api/run_log/')],
+            BaseRestModel.call_args_list
+        )
+        BaseRestModel._patch.undecorated.assert_called_once_with(
+            BaseRestModel.return_value, {'pid': 1234, 'start_dts': 'now'})
+        BaseRestModel.post.undecorated.assert_called_once_with(
+            BaseRestModel.return_value, {'content': 'foo'})
+        self.assertEqual(
+            {'pending': 0, 'sent': 2, 'dropped': 0, 'parked': 0},
+            outbox.get_stats())
+
+    @patch('job_runner_worker.outbox.BaseRestModel')
+    @patch('job_runner_worker.outbox.patch_buffer')
+    def test_flush_rejected(self, patch_buffer, BaseRestModel):
+        """
+        Test :meth:`.Outbox.flush` dropping a request rejected by the API.
+        """
+        patch_buffer.pop.return_value = {}
+        BaseRestModel._patch.undecorated.side_effect = [
+            RequestClientError('Boom!'), None]
+        model = Mock()
+        model._resource_path = '/api/run/1/'
+
+        outbox = Outbox()
+        outbox.patch(model, {'pid': 1234})
+        outbox.patch(model, {'return_success': True})
+        outbox.flush()
+
+        self.assertEqual(
+            {'pending': 0, 'sent': 1, 'dropped': 1, 'parked': 0},
+            outbox.get_stats())
+
+    @patch('job_runner_worker.outbox.time')
+    @patch('job_runner_worker.models.time')
+    @patch('job_runner_worker.outbox.BaseRestModel')
+    @patch('job_runner_worker.outbox.patch_buffer')
+    def test_flush_server_error(
+            self, patch_buffer, BaseRestModel, models_time, time):
+        """
+        Test :meth:`.Outbox.flush` parking a request failing with 5xx.
+        """
+        time.time.return_value = 1000.0
+        patch_buffer.pop.return_value = {}
+        BaseRestModel.post.undecorated.side_effect = [
+            RequestServerError('Boom!', 500), RequestServerError('Boom!', 500)]
+        BaseRestModel.post.undecorated.__name__ = 'post'
+        run = Mock()
+        run._resource_path = '/api/run/1/'
+        run_log = Mock()
+        run_log._resource_path = '/api/run_log/'
+        other_run = Mock()
+        other_run._resource_path = '/api/run/2/'
+
+        outbox = Outbox()
+        outbox.post(run_log, {'content': 'foo'}, group='/api/run/1/')
+        outbox.patch(run, {'return_success': True})
+        outbox.patch(other_run, {'return_success': True})
+        outbox.flush()
+
+        # the result of the run is held back by its parked log
+        self.assertEqual(2, BaseRestModel.post.undecorated.call_count)
+        BaseRestModel._patch.undecorated.assert_called_once_with(
+            BaseRestModel.return_value, {'return_success': True})
+        self.assertEqual(
+            [call('/api/run_log/'), call('/api/run_log/'),
+             call('/api/run/2/')],
+            BaseRestModel.call_args_list)
+        self.assertEqual(1, time.sleep.call_count)
+        self.assertEqual(
+            {'pending': 0, 'sent': 1, 'dropped': 0, 'parked': 1},
+            outbox.get_stats())
+        self.assertEqual(300, outbox._get_park_timeout())
+
+        # parked requests are retried once the park time has passed
+        time.time.return_value = 1300.0
+        BaseRestModel.post.undecorated.side_effect = None
+        outbox.flush()
+
+        self.assertEqual(3, BaseRestModel.post.undecorated.call_count)
+        self.assertEqual(2, BaseRestModel._patch.undecorated.call_count)
+        self.assertEqual(0, outbox.get_pending())
+        self.assertIsNone(outbox._get_park_timeout())
+
+    @patch('job_runner_worker.outbox.BaseRestModel')
+    @patch('job_runner_worker.outbox.patch_buffer')
+    def test_start_and_stop(self, patch_buffer, BaseRestModel):
+        """
+        Test :meth:`.Outbox.start` and :meth:`.Outbox.stop`.
+        """
+        patch_buffer.pop.return_value = {}
+        model = Mock()
+        model._resource_path = '/api/run/1/'
+
+        outbox = Outbox()
+        outbox.start()
+        outbox.patch(model, {'pid': 1234})
+        gevent.sleep(0)
+        outbox.stop(1)
+
+        BaseRestModel._patch.undecorated.assert_called_once_with(
+            BaseRestModel.return_value, {'pid': 1234})
+        self.assertEqual(0, outbox.get_pending())
+
+    def test_execute(self):
+        """
+        Test that :meth:`.Outbox._execute` uses a separate thread.
+        """
+        outbox = Outbox()
+        thread_ids = []
+        execute_in_thread = outbox._execute_in_thread
+
+        def _execute_in_thread(*args):
+            thread_ids.append(thread.get_ident())
+            return execute_in_thread(*args)
+
+        outbox._execute_in_thread = _execute_in_thread
+
+        self.assertEqual([(1, )], outbox._execute('SELECT 1'))
+        self.assertEqual(0, outbox.get_pending())
+        self.assertEqual(1, len(set(thread_ids)))
+        self.assertNotEqual(thread.get_ident(), thread_ids[0])
+
+    def test_get_path(self):
+        """
+        Test :meth:`.Outbox.get_path`.
+        """
+        with patch('job_runner_worker.outbox.settings') as settings:
+            settings.outbox_path = ''
+            settings.script_temp_path = '/tmp'
+            settings.api_key = 'public/key'
+
+            self.assertEqual(
+                '/tmp/job-runner-worker-outbox-public_key.sqlite',
+                Outbox().get_path())
+
+            settings.outbox_path = '/var/lib/outbox.sqlite'
+            self.assertEqual('/var/lib/outbox.sqlite', Outbox().get_path())
+
+    @patch('job_runner_worker.outbox.BaseRestModel')
+    @patch('job_runner_worker.outbox.patch_buffer')
+    def test_durable(self, patch_buffer, BaseRestModel):
+        """
+        Test that requests are kept in ``outbox_path`` until sent.
+        """
+        file_desc, file_path = tempfile.mkstemp()
+        os.close(file_desc)
+        self.addCleanup(os.remove, file_path)
+
+        with patch('job_runner_worker.outbox.settings') as settings:
+            settings.outbox_path = file_path
+            patch_buffer.pop.return_value = {}
+            model = Mock()
+            model._resource_path = '/api/run/1/'
+
+            previous_outbox = Outbox()
+            previous_outbox.patch(model, {'pid': 1234})
+            previous_outbox._execute(
+                'UPDATE outbox SET parked = ?', (time.time() + 300, ),
+                commit=True)
+
+            # parked requests are retried on the next start
+            outbox = Outbox()
+            self.assertEqual(1, outbox.get_pending())
+            outbox.flush()
+
+        BaseRestModel._patch.undecorated.assert_called_once_with(
+            BaseRestModel.return_value, {'pid': 1234})
@@ -0,0 +1,80 @@
+import os
+import unittest2 as unittest
+
+from mock import Mock, call
+
+from job_runner_worker.output import OutputCapture
+
+
+class OutputCaptureTestCase(unittest.TestCase):
+    """
+    Tests for :class:`.OutputCapture`.
+    """
+    def test_getvalue(self):
+        """
+        Test :meth:`.OutputCapture.getvalue` when nothing is dropped.
+        """
+        output = OutputCapture(7)
+        output.feed('abc')
+        output.feed('defg')
+
+        self.assertEqual('abcdefg', output.getvalue())
+        self.assertEqual(0, output.dropped_bytes)
+
+    def test_getvalue_truncated(self):
+        """
+        Test :meth:`.OutputCapture.getvalue` when output is dropped.
+        """
+        output = OutputCapture(100)
+        for x in range(13):
+            output.feed('a' * 10)
+        output.feed('b' * 100)
+
+        self.assertEqual(
+            '{0}\n\n[truncated]\n\n{1}'.format('a' * 20, 'b' * 80),
+            output.getvalue()
+        )
+        self.assertEqual(230, output.total_bytes)
+        self.assertEqual(130, output.dropped_bytes)
+        self.assertTrue(len(output._tail) <= 80)
+
+    def test_getvalue_truncated_single_feed(self):
+        """
+        Test :meth:`.OutputCapture.getvalue` when a single chunk exceeds
+        ``max_bytes``.
+        """
+        output = OutputCapture(100)
+        output.feed('a' * 30 + 'b' * 100)
+
+        self.assertEqual(
+            '{0}\n\n[truncated]\n\n{1}'.format('a' * 20, 'b' * 80),
+            output.getvalue()
+        )
+
+    def test_read_from(self):
+        """
+        Test :meth:`.OutputCapture.read_from`.
+        """
+        read_desc, write_desc = os.pipe()
+        os.write(write_desc, 'a' * 30 + 'b' * 100)
+        os.close(write_desc)
+
+        output = OutputCapture(100)
+        output.read_from(os.fdopen(read_desc), chunk_size=7)
+
+        self.assertEqual(
+            '{0}\n\n[truncated]\n\n{1}'.format('a' * 20, 'b' * 80),
+            output.getvalue()
+        )
+
+    def test_feed_tee(self):
+        """
+        Test :meth:`.OutputCapture.feed` writing to a ``tee``.
+        """
+        tee = Mock()
+        output = OutputCapture(4, tee)
+        output.feed('abc')
+        output.feed('defgh')
+
+        self.assertEqual(
+            [call('abc'), call('defgh')], tee.write.call_args_list)
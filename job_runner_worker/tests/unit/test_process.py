@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+import unittest2 as unittest
+
+from job_runner_worker.process import get_children_index, get_descendant_pids
+
+
+class ModuleTestCase(unittest.TestCase):
+    """
+    Tests for :mod:`job_runner_worker.process`.
+    """
+    def test_get_children_index(self):
+        """
+        Test :func:`.get_children_index`.
+        """
+        proc_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, proc_path)
+
+        for pid, stat in [
+                ('1', '1 (init) S 0 1 1'),
+                ('10', '10 (bash) S 1 10 10'),
+                ('11', '11 (my (odd) name) R 10 10 10'),
+                ('12', '12 (sleep) S 10 10 10')]:
+            os.mkdir(os.path.join(proc_path, pid))
+            with open(os.path.join(proc_path, pid, 'stat'), 'w') as stat_file:
+                stat_file.write(stat)
+
+        # a process which exited during the scan, and a non-process entry
+        os.mkdir(os.path.join(proc_path, '13'))
+        os.mkdir(os.path.join(proc_path, 'self'))
+
+        children_index = get_children_index(proc_path)
+
+        self.assertEqual({0: [1], 1: [10], 10: [11, 12]}, dict(
+            (ppid, sorted(pids)) for ppid, pids in children_index.items()))
+
+    def test_get_descendant_pids(self):
+        """
+        Test :func:`.get_descendant_pids`.
+        """
+        children_index = {1: [10, 20], 10: [11, 12], 12: [13], 20: [21]}
+
+        self.assertEqual([11, 12, 13], get_descendant_pids(10, children_index))
+        self.assertEqual([], get_descendant_pids(13, children_index))
@@ -0,0 +1,65 @@
+import unittest2 as unittest
+
+import gevent
+from gevent.event import Event
+from gevent.queue import Queue
+
+from job_runner_worker.queues import (
+    call_or_exit, get_or_exit, peek_or_exit)
+
+
+class ModuleTestCase(unittest.TestCase):
+    """
+    Tests for :mod:`job_runner_worker.queues`.
+    """
+    def test_call_or_exit(self):
+        """
+        Test :func:`.call_or_exit`.
+        """
+        exit_event = Event()
+
+        self.assertEqual(
+            'foo', call_or_exit(lambda: 'foo', exit_event).get())
+        self.assertIsNone(
+            call_or_exit(lambda: gevent.sleep(10), exit_event, 0.01))
+
+        exit_event.set()
+        self.assertIsNone(call_or_exit(lambda: 'foo', exit_event))
+
+    def test_get_or_exit(self):
+        """
+        Test :func:`.get_or_exit` waking up for new items.
+        """
+        exit_event = Event()
+        work_queue = Queue()
+        gevent.spawn_later(0.01, work_queue.put, 'foo')
+
+        self.assertEqual('foo', get_or_exit(work_queue, exit_event))
+
+    def test_get_or_exit_exit(self):
+        """
+        Test :func:`.get_or_exit` waking up when the exit is signaled.
+        """
+        exit_event = Event()
+        work_queue = Queue()
+        gevent.spawn_later(0.01, exit_event.set)
+
+        self.assertIsNone(get_or_exit(work_queue, exit_event))
+
+        work_queue.put('foo')
+        self.assertIsNone(get_or_exit(work_queue, exit_event))
+        self.assertEqual(1, work_queue.qsize())
+
+    def test_peek_or_exit(self):
+        """
+        Test :func:`.peek_or_exit`.
+        """
+        exit_event = Event()
+        work_queue = Queue()
+        gevent.spawn_later(0.01, work_queue.put, 'foo')
+
+        self.assertEqual('foo', peek_or_exit(work_queue, exit_event))
+        self.assertEqual(1, work_queue.qsize())
+
+        exit_event.set()
+        self.assertIsNone(peek_or_exit(work_queue, exit_event))
@@ -0,0 +1,94 @@
+import unittest2 as unittest
+
+from mock import patch
+
+from job_runner_worker.retry import CircuitBreaker, RetryBudget, RetryPolicy
+
+
+class RetryPolicyTestCase(unittest.TestCase):
+    """
+    Tests for :class:`.RetryPolicy`.
+    """
+    def test_get_delay(self):
+        """
+        Test :meth:`.RetryPolicy.get_delay`.
+        """
+        retry_policy = RetryPolicy(base_delay=2, max_delay=60)
+
+        for attempt, (low, high) in enumerate([
+                (1, 2), (2, 4), (4, 8), (8, 16), (16, 32), (30, 60),
+                (30, 60)]):
+            delay = retry_policy.get_delay(attempt + 1)
+            self.assertTrue(low <= delay <= high)
+
+
+class RetryBudgetTestCase(unittest.TestCase):
+    """
+    Tests for :class:`.RetryBudget`.
+    """
+    def test_withdraw_and_deposit(self):
+        """
+        Test :meth:`.RetryBudget.withdraw` and :meth:`.RetryBudget.deposit`.
+        """
+        retry_budget = RetryBudget(max_tokens=2, ratio=0.5)
+
+        self.assertTrue(retry_budget.withdraw())
+        self.assertTrue(retry_budget.withdraw())
+        self.assertFalse(retry_budget.withdraw())
+
+        retry_budget.deposit()
+        self.assertFalse(retry_budget.withdraw())
+        retry_budget.deposit()
+        self.assertTrue(retry_budget.withdraw())
+
+        for x in range(10):
+            retry_budget.deposit()
+        self.assertEqual(2, retry_budget.tokens)
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+    """
+    Tests for :class:`.CircuitBreaker`.
+    """
+    @patch('job_runner_worker.retry.time')
+    def test_open_and_close(self, time):
+        """
+        Test opening, probing and closing the circuit.
+        """
+        time.time.return_value = 100
+        circuit_breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+
+        circuit_breaker.record_failure()
+        self.assertEqual(CircuitBreaker.CLOSED, circuit_breaker.state)
+        self.assertEqual(0, circuit_breaker.get_wait_time())
+
+        circuit_breaker.record_failure()
+        self.assertEqual(CircuitBreaker.OPEN, circuit_breaker.state)
+        self.assertEqual(30, circuit_breaker.get_wait_time())
+
+        time.time.return_value = 130
+        self.assertEqual(0, circuit_breaker.get_wait_time())
+        self.assertEqual(CircuitBreaker.HALF_OPEN, circuit_breaker.state)
+        # only one probe at a time
+        self.assertEqual(30, circuit_breaker.get_wait_time())
+
+        circuit_breaker.record_success()
+        self.assertEqual(CircuitBreaker.CLOSED, circuit_breaker.state)
+        self.assertEqual(0, circuit_breaker.get_wait_time())
+        self.assertEqual(1, circuit_breaker.trips)
+
+    @patch('job_runner_worker.retry.time')
+    def test_failed_probe(self, time):
+        """
+        Test re-opening the circuit when the probe fails.
+        """
+        time.time.return_value = 100
+        circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        circuit_breaker.record_failure()
+
+        time.time.return_value = 140
+        self.assertEqual(0, circuit_breaker.get_wait_time())
+        circuit_breaker.record_failure()
+
+        self.assertEqual(CircuitBreaker.OPEN, circuit_breaker.state)
+        self.assertEqual(30, circuit_breaker.get_wait_time())
@@ -0,0 +1,142 @@
+import unittest2 as unittest
+
+import gevent
+from mock import Mock, patch
+
+from job_runner_worker.run_queue import (
+    RunQueue, get_run_deadline, get_run_priority, parse_dts)
+
+
+class ModuleTestCase(unittest.TestCase):
+    """
+    Tests for :mod:`job_runner_worker.run_queue`.
+    """
+    def test_parse_dts(self):
+        """
+        Test :func:`.parse_dts`.
+        """
+        self.assertEqual(0, parse_dts('1970-01-01T00:00:00'))
+        self.assertEqual(0.5, parse_dts('1970-01-01 00:00:00.5Z'))
+        self.assertEqual(-3600, parse_dts('1970-01-01 00:00:00+01:00'))
+        self.assertEqual(5400, parse_dts('1970-01-01T00:00:00-0130'))
+        self.assertIsNone(parse_dts('tomorrow'))
+        self.assertIsNone(parse_dts(None))
+
+    @patch('job_runner_worker.run_queue.script_cache')
+    @patch('job_runner_worker.run_queue.settings')
+    def test_get_run_priority(self, settings, script_cache):
+        """
+        Test :func:`.get_run_priority`.
+        """
+        settings.run_priority_field = 'priority'
+        run = Mock()
+        run.job.get_attribute.return_value = '5'
+        self.assertEqual(5, get_run_priority(run))
+        run.job.get_attribute.assert_called_once_with('priority', 0)
+        script_cache.load_job.assert_called_once_with(run.job)
+
+        run.job.get_attribute.return_value = 'high'
+        self.assertEqual(0, get_run_priority(run))
+
+    def test_get_run_deadline(self):
+        """
+        Test :func:`.get_run_deadline`.
+        """
+        run = Mock()
+        run.get_attribute.return_value = '1970-01-01 00:01:00'
+        self.assertEqual(60, get_run_deadline(run))
+        run.get_attribute.assert_called_once_with('schedule_dts')
+
+
+class RunQueueTestCase(unittest.TestCase):
+    """
+    Tests for :class:`.RunQueue`.
+    """
+    def setUp(self):
+        settings_patcher = patch('job_runner_worker.run_queue.settings')
+        self.settings = settings_patcher.start()
+        self.settings.run_priority_field = 'priority'
+        self.settings.run_queue_aging = 0
+        self.addCleanup(settings_patcher.stop)
+
+        time_patcher = patch('job_runner_worker.run_queue.time')
+        self.time = time_patcher.start()
+        self.time.time.return_value = 1000
+        self.addCleanup(time_patcher.stop)
+
+    def _get_run(self, priority=0, schedule_dts=None):
+        run = Mock()
+        run.job.get_attribute.return_value = priority
+        run.get_attribute.return_value = schedule_dts
+        return run
+
+    def test_fifo(self):
+        """
+        Test the ``fifo`` discipline.
+        """
+        self.settings.run_queue_discipline = 'fifo'
+        runs = [self._get_run(priority=i) for i in range(3)]
+        run_queue = RunQueue()
+        for run in runs:
+            run_queue.put(run)
+
+        self.time.time.return_value = 1010
+        self.assertEqual(3, run_queue.qsize())
+        self.assertEqual(runs, [run_queue.get() for run in runs])
+        self.assertEqual(10, runs[0].queue_wait_time)
+        self.assertEqual(
+            {'runs': 3, 'avg_wait_time': 10, 'max_wait_time': 10},
+            run_queue.get_stats()
+        )
+
+    def test_priority(self):
+        """
+        Test the ``priority`` discipline.
+        """
+        self.settings.run_queue_discipline = 'priority'
+        low = self._get_run(priority=1)
+        high = self._get_run(priority=5)
+        other_high = self._get_run(priority=5)
+        run_queue = RunQueue()
+        run_queue.put(low)
+        run_queue.put(high)
+        run_queue.put(other_high)
+
+        self.assertEqual(high, run_queue.peek())
+        self.assertEqual(
+            [high, other_high, low], [run_queue.get() for x in range(3)])
+
+        # after waiting 50 seconds, the low priority run goes first
+        self.settings.run_queue_aging = 10
+        run_queue.put(low)
+        self.time.time.return_value = 1050
+        run_queue.put(high)
+        self.assertEqual([low, high], [run_queue.get() for x in range(2)])
+
+    def test_deadline(self):
+        """
+        Test the ``deadline`` discipline.
+        """
+        self.settings.run_queue_discipline = 'deadline'
+        late = self._get_run(schedule_dts='1970-01-01 00:15:00')
+        unscheduled = self._get_run()
+        early = self._get_run(schedule_dts='1970-01-01 00:05:00')
+        run_queue = RunQueue()
+        for run in (late, unscheduled, early):
+            run_queue.put(run)
+
+        self.assertEqual(
+            [early, late, unscheduled], [run_queue.get() for x in range(3)])
+
+    def test_get_blocking(self):
+        """
+        Test :meth:`.RunQueue.get` waiting for a run.
+        """
+        self.settings.run_queue_discipline = 'fifo'
+        run = self._get_run()
+        run_queue = RunQueue()
+
+        getter = gevent.spawn(run_queue.get)
+        gevent.sleep(0)
+        run_queue.put(run)
+        self.assertEqual(run, getter.get(timeout=1))
@@ -0,0 +1,128 @@
+import unittest2 as unittest
+
+from mock import Mock, patch
+
+from job_runner_worker.script_cache import ScriptCache
+
+
+class ScriptCacheTestCase(unittest.TestCase):
+    """
+    Tests for :class:`.ScriptCache`.
+    """
+    def _get_job(self, uri, content):
+        job = Mock()
+        job._resource_path = uri
+        job.script_content = content
+        job._data = {'script_content': content, 'title': 'Job'}
+        job.get_if_modified.return_value = (True, '"{0}"'.format(uri), None)
+        return job
+
+    @patch('job_runner_worker.script_cache.settings')
+    def test_get(self, settings):
+        """
+        Test :meth:`.ScriptCache.get`.
+        """
+        settings.script_cache_max_bytes = 1024
+        job = self._get_job('/api/job/1/', u'#!/bin/bash\necho "H\xe9llo"')
+        script_cache = ScriptCache()
+
+        cached_script = script_cache.get(job)
+        self.assertEqual(
+            u'#!/bin/bash\necho "H\xe9llo"', cached_script.content)
+        self.assertEqual(25, cached_script.size)
+        job.get_if_modified.assert_called_once_with()
+
+        job.get_if_modified.return_value = (False, '"/api/job/1/"', None)
+        self.assertEqual(cached_script, script_cache.get(job))
+        job.get_if_modified.assert_called_with('"/api/job/1/"', None)
+
+        job.get_if_modified.return_value = (True, '"new"', None)
+        job.script_content = u'#!/bin/bash\necho "Hello"'
+        new_script = script_cache.get(job)
+        self.assertNotEqual(
+            cached_script.content_hash, new_script.content_hash)
+
+        self.assertEqual(
+            {'hits': 1, 'misses': 2, 'scripts': 1}, script_cache.get_stats())
+
+    @patch('job_runner_worker.script_cache.settings')
+    def test_get_not_modified_loads_job(self, settings):
+        """
+        Test :meth:`.ScriptCache.get` loading the job from the cache on a 304.
+        """
+        settings.script_cache_max_bytes = 1024
+        job = self._get_job('/api/job/1/', u'echo "Hello"')
+        script_cache = ScriptCache()
+        cached_script = script_cache.get(job)
+        self.assertEqual({'title': 'Job'}, cached_script.job_data)
+
+        job = self._get_job('/api/job/1/', u'echo "Hello"')
+        job._data = None
+        job.get_if_modified.return_value = (False, '"/api/job/1/"', None)
+
+        self.assertEqual(cached_script, script_cache.get(job))
+        self.assertEqual(
+            {'script_content': u'echo "Hello"', 'title': 'Job'}, job._data)
+
+    @patch('job_runner_worker.script_cache.settings')
+    def test_load_job(self, settings):
+        """
+        Test :meth:`.ScriptCache.load_job`.
+        """
+        settings.script_cache_max_bytes = 1024
+        job = self._get_job('/api/job/1/', u'echo "Hello"')
+        script_cache = ScriptCache()
+
+        job._data = None
+        script_cache.load_job(job)
+        self.assertIsNone(job._data)
+
+        job._data = {'script_content': u'echo "Hello"', 'title': 'Job'}
+        script_cache.get(job)
+
+        job = self._get_job('/api/job/1/', u'echo "Hello"')
+        job._data = None
+        script_cache.load_job(job)
+        self.assertEqual(
+            {'script_content': u'echo "Hello"', 'title': 'Job'}, job._data)
+        self.assertFalse(job.get_if_modified.called)
+
+        job._data = {'title': 'Other'}
+        script_cache.load_job(job)
+        self.assertEqual({'title': 'Other'}, job._data)
+
+    @patch('job_runner_worker.script_cache.settings')
+    def test_get_lru_eviction(self, settings):
+        """
+        Test :meth:`.ScriptCache.get` evicting the least recently used script.
+        """
+        settings.script_cache_max_bytes = 20
+        job_a = self._get_job('/api/job/1/', u'a' * 8)
+        job_b = self._get_job('/api/job/2/', u'b' * 8)
+        job_c = self._get_job('/api/job/3/', u'c' * 8)
+        script_cache = ScriptCache()
+
+        script_cache.get(job_a)
+        script_cache.get(job_b)
+        job_a.get_if_modified.return_value = (False, None, None)
+        script_cache.get(job_a)
+        script_cache.get(job_c)
+
+        self.assertEqual(
+            ['/api/job/1/', '/api/job/3/'], sorted(script_cache._scripts))
+        self.assertEqual(set([
+            script_cache._scripts['/api/job/1/'].content_hash,
+            script_cache._scripts['/api/job/3/'].content_hash,
+        ]), script_cache.get_content_hashes())
+
+    @patch('job_runner_worker.script_cache.settings')
+    def test_get_too_large(self, settings):
+        """
+        Test :meth:`.ScriptCache.get` with a script larger than the cache.
+        """
+        settings.script_cache_max_bytes = 4
+        job = self._get_job('/api/job/1/', u'a' * 8)
+        script_cache = ScriptCache()
+
+        self.assertEqual(u'a' * 8, script_cache.get(job).content)
+        self.assertEqual({}, script_cache._scripts)
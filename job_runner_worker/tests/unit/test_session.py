@@ -0,0 +1,105 @@
+import unittest2 as unittest
+
+from mock import Mock, patch
+
+from job_runner_worker.session import ApiSession
+
+
+class ApiSessionTestCase(unittest.TestCase):
+    """
+    Tests for :class:`.ApiSession`.
+    """
+    @patch('job_runner_worker.session.requests')
+    @patch('job_runner_worker.session.settings')
+    def test_request(self, settings, requests):
+        """
+        Test :meth:`.ApiSession.request` re-using the same session.
+        """
+        settings.api_pool_maxsize = 5
+        settings.api_idle_timeout = 60
+
+        api_session = ApiSession()
+
+        api_session.get('http://api/foo/', verify=False)
+        api_session.patch('http://api/bar/', data='{}')
+
+        requests.session.assert_called_once_with(config={
+            'keep_alive': True,
+            'pool_maxsize': 5,
+        })
+        session = requests.session.return_value
+        session.request.assert_any_call(
+            'GET', 'http://api/foo/', verify=False)
+        session.request.assert_any_call(
+            'PATCH', 'http://api/bar/', data='{}')
+
+    @patch('job_runner_worker.session.time')
+    @patch('job_runner_worker.session.requests')
+    @patch('job_runner_worker.session.settings')
+    def test_request_idle_eviction(self, settings, requests, time):
+        """
+        Test :meth:`.ApiSession.request` evicting idle connections.
+        """
+        settings.api_pool_maxsize = 10
+        settings.api_idle_timeout = 60
+
+        pool = Mock()
+        pool.num_connections = 1
+        pool.num_requests = 3
+
+        first_session = Mock()
+        first_session.poolmanager.pools.keys.return_value = ['api']
+        first_session.poolmanager.pools.get.return_value = pool
+        second_session = Mock()
+        second_session.poolmanager.pools.keys.return_value = []
+        requests.session.side_effect = [first_session, second_session]
+
+        api_session = ApiSession()
+
+        time.time.return_value = 100
+        api_session.get('http://api/foo/')
+        time.time.return_value = 200
+        api_session.get('http://api/foo/')
+
+        first_session.close.assert_called_once_with()
+        second_session.request.assert_called_once_with(
+            'GET', 'http://api/foo/')
+        self.assertEqual({
+            'requests': 3,
+            'connections_opened': 1,
+            'connections_reused': 2,
+        }, api_session.get_stats())
+
+    @patch('job_runner_worker.session.requests')
+    @patch('job_runner_worker.session.settings')
+    def test_get_stats(self, settings, requests):
+        """
+        Test :meth:`.ApiSession.get_stats`.
+        """
+        settings.api_pool_maxsize = 10
+        settings.api_idle_timeout = 60
+
+        pool_a = Mock()
+        pool_a.num_connections = 2
+        pool_a.num_requests = 10
+        pool_b = Mock()
+        pool_b.num_connections = 1
+        pool_b.num_requests = 1
+
+        pools = requests.session.return_value.poolmanager.pools
+        pools.keys.return_value = ['a', 'b']
+        pools.get.side_effect = lambda key: {'a': pool_a, 'b': pool_b}[key]
+
+        api_session = ApiSession()
+        self.assertEqual({
+            'requests': 0,
+            'connections_opened': 0,
+            'connections_reused': 0,
+        }, api_session.get_stats())
+
+        api_session.get('http://api/')
+        self.assertEqual({
+            'requests': 11,
+            'connections_opened': 3,
+            'connections_reused': 8,
+        }, api_session.get_stats())
@@ -0,0 +1,71 @@
+import os
+import signal
+import subprocess
+import unittest2 as unittest
+
+import gevent
+from mock import Mock, patch
+
+from job_runner_worker.watchdog import RunWatchdog
+
+
+class RunWatchdogTestCase(unittest.TestCase):
+    """
+    Tests for :class:`.RunWatchdog`.
+    """
+    def _start_process(self, script):
+        proc = subprocess.Popen(['bash', '-c', script], preexec_fn=os.setsid)
+        self.addCleanup(_kill, proc)
+        return proc
+
+    def _wait(self, proc):
+        while proc.poll() is None:
+            gevent.sleep(0.01)
+        return proc.returncode
+
+    def test_no_timeout(self):
+        """
+        Test :class:`.RunWatchdog` without timeout.
+        """
+        watchdog = RunWatchdog(1234, 0, Mock())
+        watchdog.start()
+        watchdog.stop()
+        self.assertFalse(watchdog.timed_out)
+
+    @patch('job_runner_worker.watchdog.settings')
+    def test_terminate(self, settings):
+        """
+        Test :class:`.RunWatchdog` terminating a run.
+        """
+        settings.run_timeout_grace = 10
+        proc = self._start_process('sleep 30')
+        kill = Mock()
+        watchdog = RunWatchdog(proc.pid, 0.1, kill)
+        watchdog.start()
+
+        self.assertEqual(-signal.SIGTERM, self._wait(proc))
+        watchdog.stop()
+        self.assertTrue(watchdog.timed_out)
+        self.assertFalse(kill.called)
+
+    @patch('job_runner_worker.watchdog.settings')
+    def test_kill(self, settings):
+        """
+        Test :class:`.RunWatchdog` killing a run ignoring ``SIGTERM``.
+        """
+        settings.run_timeout_grace = 0.1
+        proc = self._start_process('trap "" TERM; sleep 30 & wait')
+        kill = Mock(side_effect=lambda pid: _kill(proc))
+        watchdog = RunWatchdog(proc.pid, 0.1, kill)
+        watchdog.start()
+
+        self.assertEqual(-signal.SIGKILL, self._wait(proc))
+        kill.assert_called_once_with(proc.pid)
+        self.assertTrue(watchdog.timed_out)
+
+
+def _kill(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
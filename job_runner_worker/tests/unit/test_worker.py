@@ -1,224 +1,555 @@
+import json
+import signal
 import subprocess
+import sys
 import unittest2 as unittest
 
-from gevent.queue import Queue, Empty
+import gevent
+from gevent.event import Event
+from gevent.queue import Queue
 from mock import Mock, call, patch
 from pytz import utc
 
+from job_runner_worker.concurrency import ConcurrencyController
 from job_runner_worker.worker import (
-    execute_run, kill_run, _get_child_pids, _truncate_log
+    execute_run,
+    finalize_runs,
+    kill_run,
+    _finalize_run,
+    _get_preexec_fn,
+    _kill_pid_tree,
+    _kill_run_process,
+    _reload_run,
 )
+from job_runner_worker.zygote import Zygote
 
 
 class ModuleTestCase(unittest.TestCase):
     """
     Tests for :mod:`job_runner_worker.worker`.
     """
+    @patch('job_runner_worker.worker.resource_stats')
+    @patch('job_runner_worker.worker.outbox')
+    @patch('job_runner_worker.worker.script_cache')
     @patch('job_runner_worker.worker.subprocess', subprocess)
     @patch('job_runner_worker.worker.RunLog')
     @patch('job_runner_worker.worker.datetime')
-    @patch('job_runner_worker.worker.config')
-    def test_execute_run(self, config, datetime, RunLog):
+    @patch('job_runner_worker.worker.settings')
+    def test_execute_run(
+            self, settings, datetime, RunLog, script_cache, outbox,
+            resource_stats):
         """
         Test :func:`.execute_run`.
         """
-        config.get.return_value = '/tmp'
+        settings.script_temp_path = '/tmp'
+        settings.max_log_bytes = 800 * 1024
+        settings.log_ship_interval = 0
+        settings.cgroup_path = ''
+        settings.resource_usage_field = ''
+        settings.run_timed_out_field = ''
+        settings.run_nice = 0
 
         run = Mock()
         run.run_log = None
         run.id = 1234
-        run.job.script_content = (
+        run.queue_wait_time = 0.5
+        script_cache.get.return_value.content_hash = 'abc123'
+        script_cache.get.return_value.content = (
             u'#!/usr/bin/env bash\n\necho "H\xe9llo World!";\n')
 
         event_queue = Mock()
-        exit_queue = Mock()
+        exit_event = Event()
         run_queue = Queue()
         run_queue.put(run)
 
-        exit_queue_return = [Empty, None]
+        # terminate after handling the first item
+        event_queue.put.side_effect = lambda event: exit_event.set()
 
-        def exit_queue_side_effect(*args, **kwargs):
-            value = exit_queue_return.pop(0)
-            if callable(value):
-                raise value()
-
-        exit_queue.get.side_effect = exit_queue_side_effect
-
-        execute_run(run_queue, event_queue, exit_queue)
+        execute_run(run_queue, event_queue, exit_event)
 
         dts = datetime.now.return_value.isoformat.return_value
-        self.assertTrue('pid' in run.patch.call_args_list[1][0][0])
+        self.assertTrue('pid' in outbox.patch.call_args_list[0][0][1])
         self.assertEqual(dts, run.patch.call_args_list[0][0][0]['start_dts'])
+        self.assertEqual(
+            RunLog.return_value, outbox.post.call_args_list[0][0][0])
         self.assertEqual(
             u'H\xe9llo World!\n'.encode('utf-8'),
-            RunLog.return_value.post.call_args_list[0][0][0]['content']
+            outbox.post.call_args_list[0][0][1]['content']
         )
+        script_cache.get.assert_called_once_with(run.job)
         self.assertEqual([
-            call({
+            call(run, {
                 'return_dts': dts,
                 'return_success': True,
             })
-        ], run.patch.call_args_list[2:])
-        self.assertEqual([
-            call('{"kind": "run", "event": "started", "run_id": 1234}'),
-            call('{"kind": "run", "event": "returned", "run_id": 1234}'),
-        ], event_queue.put.call_args_list)
+        ], outbox.patch.call_args_list[1:])
+        self.assertEqual({
+            'kind': 'run',
+            'event': 'started',
+            'run_id': 1234,
+            'queue_wait_time': 0.5,
+        }, json.loads(event_queue.put.call_args_list[0][0][0]))
+        returned_event = json.loads(event_queue.put.call_args_list[1][0][0])
+        self.assertEqual('returned', returned_event['event'])
+        self.assertEqual(
+            returned_event['resource_usage'],
+            resource_stats.add.call_args[0][1]
+        )
+        self.assertTrue('wall_time' in returned_event['resource_usage'])
+        self.assertTrue('max_rss_kb' in returned_event['resource_usage'])
         datetime.now.assert_called_with(utc)
 
+    @patch('job_runner_worker.worker.resource_stats')
+    @patch('job_runner_worker.worker.outbox')
+    @patch('job_runner_worker.worker.script_cache')
     @patch('job_runner_worker.worker.subprocess', subprocess)
     @patch('job_runner_worker.worker.datetime')
-    @patch('job_runner_worker.worker.config')
-    def test_execute_run_with_log(self, config, datetime):
+    @patch('job_runner_worker.worker.settings')
+    def test_execute_run_with_log(
+            self, settings, datetime, script_cache, outbox, resource_stats):
         """
         Test :func:`.execute_run` with existing log.
         """
-        config.get.return_value = '/tmp'
+        settings.script_temp_path = '/tmp'
+        settings.max_log_bytes = 800 * 1024
+        settings.log_ship_interval = 0
+        settings.cgroup_path = ''
+        settings.resource_usage_field = ''
+        settings.run_timed_out_field = ''
+        settings.run_nice = 0
 
         run = Mock()
         run.id = 1234
-        run.job.script_content = (
+        run.queue_wait_time = 0.5
+        script_cache.get.return_value.content_hash = 'abc123'
+        script_cache.get.return_value.content = (
             u'#!/usr/bin/env bash\n\necho "H\xe9llo World!";\n')
 
         event_queue = Mock()
-        exit_queue = Mock()
+        exit_event = Event()
         run_queue = Queue()
         run_queue.put(run)
 
-        exit_queue_return = [Empty, None]
+        # terminate after handling the first item
+        event_queue.put.side_effect = lambda event: exit_event.set()
 
-        def exit_queue_side_effect(*args, **kwargs):
-            value = exit_queue_return.pop(0)
-            if callable(value):
-                raise value()
-
-        exit_queue.get.side_effect = exit_queue_side_effect
-
-        execute_run(run_queue, event_queue, exit_queue)
+        execute_run(run_queue, event_queue, exit_event)
 
         dts = datetime.now.return_value.isoformat.return_value
-        self.assertTrue('pid' in run.patch.call_args_list[1][0][0])
+        self.assertTrue('pid' in outbox.patch.call_args_list[0][0][1])
         self.assertEqual(dts, run.patch.call_args_list[0][0][0]['start_dts'])
-        self.assertEqual(
-            u'H\xe9llo World!\n'.encode('utf-8'),
-            run.run_log.patch.call_args_list[0][0][0]['content']
-        )
         self.assertEqual([
-            call({
+            call(run.run_log, {
+                'content': u'H\xe9llo World!\n'.encode('utf-8'),
+            }, group=run._resource_path),
+            call(run, {
                 'return_dts': dts,
                 'return_success': True,
             })
-        ], run.patch.call_args_list[2:])
-        self.assertEqual([
-            call('{"kind": "run", "event": "started", "run_id": 1234}'),
-            call('{"kind": "run", "event": "returned", "run_id": 1234}'),
-        ], event_queue.put.call_args_list)
+        ], outbox.patch.call_args_list[1:])
+        self.assertEqual({
+            'kind': 'run',
+            'event': 'started',
+            'run_id': 1234,
+            'queue_wait_time': 0.5,
+        }, json.loads(event_queue.put.call_args_list[0][0][0]))
+        returned_event = json.loads(event_queue.put.call_args_list[1][0][0])
+        self.assertEqual('returned', returned_event['event'])
+        self.assertEqual(
+            returned_event['resource_usage'],
+            resource_stats.add.call_args[0][1]
+        )
+        self.assertTrue('wall_time' in returned_event['resource_usage'])
+        self.assertTrue('max_rss_kb' in returned_event['resource_usage'])
         datetime.now.assert_called_with(utc)
 
+    @patch('job_runner_worker.worker.wait_for_process')
+    @patch('job_runner_worker.worker.resource_stats')
+    @patch('job_runner_worker.worker.outbox')
+    @patch('job_runner_worker.worker.script_cache')
+    @patch('job_runner_worker.worker.subprocess', subprocess)
+    @patch('job_runner_worker.worker.settings')
+    def test_execute_run_without_usage(
+            self, settings, script_cache, outbox, resource_stats,
+            wait_for_process):
+        """
+        Test :func:`.execute_run` when the resource usage is not available.
+        """
+        settings.script_temp_path = '/tmp'
+        settings.max_log_bytes = 800 * 1024
+        settings.log_ship_interval = 0
+        settings.cgroup_path = ''
+        settings.resource_usage_field = ''
+        settings.run_timed_out_field = ''
+        settings.run_nice = 0
+        # the process was reaped by someone else
+        wait_for_process.return_value = (None, None)
+
+        run = Mock()
+        run.id = 1234
+        run.queue_wait_time = 0.5
+        script_cache.get.return_value.content_hash = 'abc123'
+        script_cache.get.return_value.content = (
+            u'#!/usr/bin/env bash\n\necho "Hello World!";\n')
+
+        event_queue = Mock()
+        exit_event = Event()
+        run_queue = Queue()
+        run_queue.put(run)
+
+        # terminate after handling the first item
+        event_queue.put.side_effect = lambda event: exit_event.set()
+
+        execute_run(run_queue, event_queue, exit_event)
+
+        returned_event = json.loads(event_queue.put.call_args_list[1][0][0])
+        self.assertEqual(
+            ['wall_time'], list(returned_event['resource_usage']))
+        resource_stats.add.assert_called_once_with(
+            run.job._resource_path, returned_event['resource_usage'])
+
+    @patch('job_runner_worker.worker.get_run_timeout')
+    @patch('job_runner_worker.worker.resource_stats')
+    @patch('job_runner_worker.worker.outbox')
+    @patch('job_runner_worker.worker.script_cache')
     @patch('job_runner_worker.worker.subprocess', subprocess)
     @patch('job_runner_worker.worker.RunLog')
     @patch('job_runner_worker.worker.datetime')
-    @patch('job_runner_worker.worker.config')
-    def test_execute_bad_shebang(self, config, datetime, RunLog):
+    @patch('job_runner_worker.worker.settings')
+    def test_execute_run_timeout(
+            self, settings, datetime, RunLog, script_cache, outbox,
+            resource_stats, get_run_timeout):
         """
-        Test :func:`.execute_run` when the shebang is invalid.
+        Test :func:`.execute_run` with a run exceeding its timeout.
         """
-        config.get.return_value = '/tmp'
+        settings.max_log_bytes = 800 * 1024
+        settings.log_ship_interval = 0
+        settings.cgroup_path = ''
+        settings.resource_usage_field = ''
+        settings.run_timed_out_field = ''
+        settings.run_nice = 0
+        # the timeout needs to be known before the process is started
+        get_run_timeout.side_effect = lambda run: (
+            self.assertFalse(outbox.patch.called) or 0.2)
 
         run = Mock()
         run.run_log = None
         run.id = 1234
-        run.job.script_content = (
-            u'#!I love cheese\n\necho "H\xe9llo World!";\n')
+        run.queue_wait_time = 0.5
+        script_cache.get.return_value.content_hash = 'ghi789'
+        script_cache.get.return_value.content = (
+            u'#!/usr/bin/env bash\necho start\nsleep 30\n')
+
+        event_queue = Mock()
+        exit_event = Event()
+        run_queue = Queue()
+        run_queue.put(run)
+
+        # terminate after handling the first item
+        event_queue.put.side_effect = lambda event: exit_event.set()
+
+        execute_run(run_queue, event_queue, exit_event)
+
+        self.assertEqual(
+            'start\n\n[job runner worker] Run was killed because it '
+            'exceeded its timeout of 0.2 seconds\n',
+            outbox.post.call_args_list[0][0][1]['content']
+        )
+        self.assertFalse(
+            outbox.patch.call_args_list[1][0][1]['return_success'])
+        returned_event = json.loads(event_queue.put.call_args_list[1][0][0])
+        self.assertTrue(returned_event['timed_out'])
+
+    @patch('job_runner_worker.worker.get_zygote')
+    @patch('job_runner_worker.worker.resource_stats')
+    @patch('job_runner_worker.worker.outbox')
+    @patch('job_runner_worker.worker.script_cache')
+    @patch('job_runner_worker.worker.RunLog')
+    @patch('job_runner_worker.worker.datetime')
+    @patch('job_runner_worker.worker.settings')
+    def test_execute_run_zygote(
+            self, settings, datetime, RunLog, script_cache, outbox,
+            resource_stats, get_zygote):
+        """
+        Test :func:`.execute_run` with a zygote.
+        """
+        settings.max_log_bytes = 800 * 1024
+        settings.log_ship_interval = 0
+        settings.cgroup_path = ''
+        settings.resource_usage_field = ''
+        settings.run_timed_out_field = ''
+        settings.run_nice = 0
+
+        zygote = Zygote(sys.executable)
+        self.addCleanup(zygote.stop)
+        get_zygote.return_value = zygote
+
+        run = Mock()
+        run.run_log = None
+        run.id = 1234
+        run.queue_wait_time = 0.5
+        script_cache.get.return_value.content_hash = 'def456'
+        script_cache.get.return_value.content = (
+            u'#!/usr/bin/env python\nimport os, sys\n'
+            u'print("pid %d" % os.getpid())\nsys.exit(2)\n')
 
         event_queue = Mock()
-        exit_queue = Mock()
+        exit_event = Event()
         run_queue = Queue()
         run_queue.put(run)
 
-        exit_queue_return = [Empty, None]
+        # terminate after handling the first item
+        event_queue.put.side_effect = lambda event: exit_event.set()
+
+        execute_run(run_queue, event_queue, exit_event)
 
-        def exit_queue_side_effect(*args, **kwargs):
-            value = exit_queue_return.pop(0)
-            if callable(value):
-                raise value()
+        get_zygote.assert_called_once_with(u'#!/usr/bin/env python')
+        pid = outbox.patch.call_args_list[0][0][1]['pid']
+        self.assertEqual(
+            'pid {0}\n'.format(pid),
+            outbox.post.call_args_list[0][0][1]['content']
+        )
+        self.assertFalse(
+            outbox.patch.call_args_list[1][0][1]['return_success'])
+        returned_event = json.loads(event_queue.put.call_args_list[1][0][0])
+        self.assertTrue('max_rss_kb' in returned_event['resource_usage'])
+
+    @patch('job_runner_worker.worker.outbox')
+    @patch('job_runner_worker.worker.script_cache')
+    @patch('job_runner_worker.worker.subprocess', subprocess)
+    @patch('job_runner_worker.worker.RunLog')
+    @patch('job_runner_worker.worker.datetime')
+    @patch('job_runner_worker.worker.settings')
+    def test_execute_bad_shebang(
+            self, settings, datetime, RunLog, script_cache, outbox):
+        """
+        Test :func:`.execute_run` when the shebang is invalid.
+        """
+        settings.script_temp_path = '/tmp'
+        settings.max_log_bytes = 800 * 1024
+        settings.log_ship_interval = 0
+        settings.cgroup_path = ''
+        settings.resource_usage_field = ''
+        settings.run_timed_out_field = ''
+        settings.run_nice = 0
 
-        exit_queue.get.side_effect = exit_queue_side_effect
+        run = Mock()
+        run.run_log = None
+        run.id = 1234
+        run.queue_wait_time = 0.5
+        script_cache.get.return_value.content_hash = 'abc123'
+        script_cache.get.return_value.content = (
+            u'#!I love cheese\n\necho "H\xe9llo World!";\n')
 
-        execute_run(run_queue, event_queue, exit_queue)
+        event_queue = Mock()
+        exit_event = Event()
+        run_queue = Queue()
+        run_queue.put(run)
+
+        # terminate after handling the first item
+        event_queue.put.side_effect = lambda event: exit_event.set()
+
+        execute_run(run_queue, event_queue, exit_event)
 
         dts = datetime.now.return_value.isoformat.return_value
 
         self.assertEqual(dts, run.patch.call_args_list[0][0][0]['start_dts'])
-        log_out = RunLog.return_value.post.call_args_list[0][0][0]['content']
+        log_out = outbox.post.call_args_list[0][0][1]['content']
         self.assertTrue(
             log_out.startswith('[job runner worker] Could not execute job:')
         )
         self.assertEqual([
-            call({
+            call(run, {
                 'return_dts': dts,
                 'return_success': False,
             })
-        ], run.patch.call_args_list[1:])
+        ], outbox.patch.call_args_list)
         self.assertEqual([
-            call('{"kind": "run", "event": "started", "run_id": 1234}'),
-            call('{"kind": "run", "event": "returned", "run_id": 1234}'),
-        ], event_queue.put.call_args_list)
+            {
+                'kind': 'run',
+                'event': 'started',
+                'run_id': 1234,
+                'queue_wait_time': 0.5,
+            },
+            {'kind': 'run', 'event': 'returned', 'run_id': 1234},
+        ], [json.loads(c[0][0]) for c in event_queue.put.call_args_list])
         datetime.now.assert_called_with(utc)
 
+    @patch('job_runner_worker.worker.outbox')
+    @patch('job_runner_worker.worker.script_cache')
     @patch('job_runner_worker.worker.subprocess', subprocess)
     @patch('job_runner_worker.worker.RunLog')
     @patch('job_runner_worker.worker.datetime')
-    @patch('job_runner_worker.worker.config')
-    def test_execute_no_shebang(self, config, datetime, RunLog):
+    @patch('job_runner_worker.worker.settings')
+    def test_execute_no_shebang(
+            self, settings, datetime, RunLog, script_cache, outbox):
         """
         Test :func:`.execute_run` when the shebang is invalid.
         """
-        config.get.return_value = '/tmp'
+        settings.script_temp_path = '/tmp'
+        settings.max_log_bytes = 800 * 1024
+        settings.log_ship_interval = 0
+        settings.cgroup_path = ''
+        settings.resource_usage_field = ''
+        settings.run_timed_out_field = ''
+        settings.run_nice = 0
 
         run = Mock()
         run.run_log = None
         run.id = 1234
-        run.job.script_content = (
+        run.queue_wait_time = 0.5
+        script_cache.get.return_value.content_hash = 'abc123'
+        script_cache.get.return_value.content = (
             u'I love cheese\n\necho "H\xe9llo World!";\n')
 
         event_queue = Mock()
-        exit_queue = Mock()
+        exit_event = Event()
         run_queue = Queue()
         run_queue.put(run)
 
-        exit_queue_return = [Empty, None]
-
-        def exit_queue_side_effect(*args, **kwargs):
-            value = exit_queue_return.pop(0)
-            if callable(value):
-                raise value()
+        # terminate after handling the first item
+        event_queue.put.side_effect = lambda event: exit_event.set()
 
-        exit_queue.get.side_effect = exit_queue_side_effect
-
-        execute_run(run_queue, event_queue, exit_queue)
+        execute_run(run_queue, event_queue, exit_event)
 
         dts = datetime.now.return_value.isoformat.return_value
 
         self.assertEqual(dts, run.patch.call_args_list[0][0][0]['start_dts'])
-        log_out = RunLog.return_value.post.call_args_list[0][0][0]['content']
+        log_out = outbox.post.call_args_list[0][0][1]['content']
         self.assertTrue(
             log_out.startswith('[job runner worker] Could not execute job:')
         )
         self.assertEqual([
-            call({
+            call(run, {
                 'return_dts': dts,
                 'return_success': False,
             })
-        ], run.patch.call_args_list[1:])
+        ], outbox.patch.call_args_list)
         self.assertEqual([
-            call('{"kind": "run", "event": "started", "run_id": 1234}'),
-            call('{"kind": "run", "event": "returned", "run_id": 1234}'),
-        ], event_queue.put.call_args_list)
+            {
+                'kind': 'run',
+                'event': 'started',
+                'run_id': 1234,
+                'queue_wait_time': 0.5,
+            },
+            {'kind': 'run', 'event': 'returned', 'run_id': 1234},
+        ], [json.loads(c[0][0]) for c in event_queue.put.call_args_list])
         datetime.now.assert_called_with(utc)
 
-    @patch('job_runner_worker.worker._kill_pid_tree')
+    @patch('job_runner_worker.worker._execute_run')
+    @patch('job_runner_worker.worker.concurrency_controller',
+           new_callable=ConcurrencyController)
+    def test_execute_run_limit(self, controller, execute_run_):
+        """
+        Test :func:`.execute_run` after the number of slots was decreased.
+        """
+        controller.set_limit(4)
+
+        exit_event = Event()
+        run_queue = Queue()
+        run_ended = Event()
+        started_runs = []
+
+        def _execute_run(run, event_queue, finalize_queue):
+            started_runs.append(run)
+            run_ended.wait()
+
+        execute_run_.side_effect = _execute_run
+
+        executors = [
+            gevent.spawn(execute_run, run_queue, Mock(), exit_event)
+            for x in range(4)
+        ]
+        gevent.sleep(0)
+
+        # the executors are idle, so they don't hold slots
+        self.assertEqual(0, controller.active)
+
+        controller.set_limit(2)
+        for run_id in range(4):
+            run_queue.put(run_id)
+        gevent.sleep(0.01)
+
+        self.assertEqual([0, 1], started_runs)
+        self.assertEqual(2, run_queue.qsize())
+
+        run_ended.set()
+        gevent.sleep(0.01)
+        self.assertEqual([0, 1, 2, 3], started_runs)
+
+        exit_event.set()
+        gevent.joinall(executors, timeout=1)
+        self.assertEqual(0, controller.active)
+
+    @patch('job_runner_worker.worker.resource_stats')
+    @patch('job_runner_worker.worker._finalize_run')
+    @patch('job_runner_worker.worker.outbox')
+    @patch('job_runner_worker.worker.script_cache')
+    @patch('job_runner_worker.worker.subprocess', subprocess)
+    @patch('job_runner_worker.worker.settings')
+    def test_execute_run_finalize_queue(
+            self, settings, script_cache, outbox, finalize_run,
+            resource_stats):
+        """
+        Test :func:`.execute_run` handing the ended run to a finalizer.
+        """
+        settings.script_temp_path = '/tmp'
+        settings.max_log_bytes = 800 * 1024
+        settings.log_ship_interval = 0
+        settings.cgroup_path = ''
+        settings.run_nice = 0
+
+        run = Mock()
+        run.id = 1234
+        run.queue_wait_time = 0.5
+        script_cache.get.return_value.content_hash = 'abc123'
+        script_cache.get.return_value.content = (
+            u'#!/usr/bin/env bash\n\necho "Hello World!";\n')
+
+        event_queue = Mock()
+        exit_event = Event()
+        run_queue = Queue()
+        run_queue.put(run)
+        finalize_queue = Queue(1)
+
+        # terminate after handling the first item
+        event_queue.put.side_effect = lambda event: exit_event.set()
+
+        execute_run(run_queue, event_queue, exit_event, finalize_queue)
+
+        self.assertFalse(finalize_run.called)
+        finalize_args = finalize_queue.get(block=False)
+        self.assertEqual(run, finalize_args[0])
+        self.assertEqual('Hello World!\n', finalize_args[2])
+        self.assertTrue(finalize_args[3])
+
+    @patch('job_runner_worker.worker._finalize_run')
+    def test_finalize_runs(self, finalize_run):
+        """
+        Test :func:`.finalize_runs`.
+        """
+        first_args = (Mock(), Mock(), 'output', True, Mock())
+        second_args = (Mock(), Mock(), 'output', False, Mock())
+        finalize_queue = Queue()
+        finalize_queue.put(first_args)
+        finalize_queue.put(second_args)
+        exit_event = Event()
+        exit_event.set()
+
+        # a failing run must not stop the finalization of the others
+        finalize_run.side_effect = [Exception('API is down'), None]
+
+        finalize_runs(finalize_queue, exit_event)
+
+        self.assertEqual(
+            [call(*first_args), call(*second_args)],
+            finalize_run.call_args_list)
+        self.assertTrue(finalize_queue.empty())
+
+    @patch('job_runner_worker.worker.outbox')
+    @patch('job_runner_worker.worker._kill_run_process')
     @patch('job_runner_worker.worker.datetime')
-    def test_kill_run(self, datetime, kill_pid_tree_mock):
+    def test_kill_run(self, datetime, kill_run_process, outbox):
         """
         Test :func:`.kill_run`.
         """
@@ -231,21 +562,15 @@ class ModuleTestCase(unittest.TestCase):
 
         kill_queue = Queue()
         kill_queue.put(kill_request)
-        exit_queue = Mock()
-
-        exit_queue_return = [Empty, None]
-
-        def exit_queue_side_effect(*args, **kwargs):
-            value = exit_queue_return.pop(0)
-            if callable(value):
-                raise value()
+        exit_event = Event()
 
-        exit_queue.get.side_effect = exit_queue_side_effect
+        # terminate after handling the first item
+        event_queue.put.side_effect = lambda event: exit_event.set()
 
-        kill_run(kill_queue, event_queue, exit_queue)
+        kill_run(kill_queue, event_queue, exit_event)
 
-        kill_pid_tree_mock.assert_called_with(5678)
-        kill_request.patch.assert_called_with({
+        kill_run_process.assert_called_with(5678)
+        outbox.patch.assert_called_with(kill_request, {
             'execute_dts': dts,
         })
         event_queue.put.assert_called_with((
@@ -253,29 +578,211 @@ class ModuleTestCase(unittest.TestCase):
             '"event": "executed"}'
         ))
 
-    @patch('job_runner_worker.worker.subprocess')
-    def test__get_child_pids(self, subprocess_mock):
+    @patch('job_runner_worker.worker.outbox')
+    @patch('job_runner_worker.worker._kill_run_process')
+    def test_kill_run_local_pid(self, kill_run_process, outbox):
         """
-        Test :func:`._get_child_pids`.
+        Test :func:`.kill_run` for a run whose pid wasn't loaded.
         """
-        sub_proc = subprocess_mock.Popen.return_value
-        sub_proc.wait.return_value = 0
-        sub_proc.communicate.return_value = [' 123\n 456\n 789\n', '']
+        event_queue = Mock()
+        local_request = Mock()
+        local_request.id = 1
+        local_request.run._resource_path = '/api/v1/run/1/'
+        local_request.run.pid = None
+        unknown_request = Mock()
+        unknown_request.id = 2
+        unknown_request.run._resource_path = '/api/v1/run/2/'
+        unknown_request.run.pid = None
 
-        self.assertEqual([123, 456, 789], _get_child_pids(321))
+        kill_queue = Queue()
+        kill_queue.put(local_request)
+        kill_queue.put(unknown_request)
+        exit_event = Event()
 
-    @patch('job_runner_worker.worker.config')
-    def test__truncate_log(self, config):
+        # terminate after handling the second item
+        event_queue.put.side_effect = lambda event: (
+            event_queue.put.call_count == 2 and exit_event.set())
+
+        with patch.dict(
+                'job_runner_worker.worker._run_pids',
+                {'/api/v1/run/1/': 5678}):
+            kill_run(kill_queue, event_queue, exit_event)
+
+        kill_run_process.assert_called_once_with(5678)
+        self.assertEqual(2, outbox.patch.call_count)
+
+    def test__reload_run(self):
         """
-        Test :func:`._truncate_log`.
+        Test :func:`._reload_run`.
         """
-        config.getint.return_value = 100
+        run = Mock()
 
-        input_string = '{0}{1}'.format(
-            ''.join(['a'] * 30), ''.join(['b'] * 100))
-        expected_out = '{0}\n\n[truncated]\n\n{1}'.format(
-            ''.join(['a'] * 20),
-            ''.join(['b'] * 80),
-        )
+        def reload():
+            # the PATCH setting the pid was queued while reloading
+            local_updates['pid'] = 1234
+            run._data = {'pid': None, 'start_dts': None, 'id': 1}
+
+        run.reload.side_effect = reload
+        local_updates = {'start_dts': 'now'}
+
+        _reload_run(run, local_updates)
+
+        self.assertEqual(
+            {'pid': 1234, 'start_dts': 'now', 'id': 1}, run._data)
+
+    @patch('job_runner_worker.worker.outbox')
+    @patch('job_runner_worker.worker.RunLog')
+    @patch('job_runner_worker.worker.datetime')
+    @patch('job_runner_worker.worker.settings')
+    def test__finalize_run(self, settings, datetime, RunLog, outbox):
+        """
+        Test :func:`._finalize_run` with a failed background reload.
+        """
+        settings.run_log_resource_uri = '/api/run_log/'
+        settings.run_resource_uri = '/api/run/'
+
+        calls = []
+        run = Mock()
+        run.id = 1234
+        run.run_log = None
+        run.reload.side_effect = lambda: calls.append('reload')
+        outbox.patch.side_effect = (
+            lambda model, attributes: calls.append('return'))
+        outbox.post.side_effect = (
+            lambda model, attributes, group: calls.append('log'))
+
+        run_reload = Mock()
+        run_reload.successful.return_value = False
+        event_queue = Mock()
+
+        _finalize_run(run, run_reload, 'output', True, event_queue)
+
+        run_reload.join.assert_called_once_with()
+        self.assertEqual(['reload', 'log', 'return'], calls)
+        RunLog.assert_called_once_with('/api/run_log/')
+        outbox.post.assert_called_once_with(RunLog.return_value, {
+            'run': '/api/run/1234/',
+            'content': 'output',
+        }, group=run._resource_path)
+        event_queue.put.assert_called_once_with(
+            '{"kind": "run", "event": "returned", "run_id": 1234}')
 
-        self.assertEqual(expected_out, _truncate_log(input_string))
+    @patch('job_runner_worker.worker.outbox')
+    @patch('job_runner_worker.worker.datetime')
+    @patch('job_runner_worker.worker.settings')
+    def test__finalize_run_reload_run(self, settings, datetime, outbox):
+        """
+        Test :func:`._finalize_run` after a log shipment was interrupted.
+        """
+        run = Mock()
+        run.id = 1234
+        run_reload = Mock()
+        run_reload.successful.return_value = True
+
+        _finalize_run(
+            run, run_reload, 'output', True, Mock(), None, None, False, True)
+
+        run.reload.assert_called_once_with()
+        outbox.patch.assert_any_call(
+            run.run_log, {'content': 'output'}, group=run._resource_path)
+
+    @patch('job_runner_worker.worker.outbox')
+    @patch('job_runner_worker.worker.datetime')
+    @patch('job_runner_worker.worker.settings')
+    def test__finalize_run_usage(self, settings, datetime, outbox):
+        """
+        Test :func:`._finalize_run` reporting the resource usage.
+        """
+        settings.resource_usage_field = 'resource_usage'
+        run = Mock()
+        run.id = 1234
+        event_queue = Mock()
+        usage = {'wall_time': 1.0}
+
+        _finalize_run(
+            run, Mock(), 'output', True, event_queue, Mock(), usage)
+
+        self.assertEqual(usage, outbox.patch.call_args_list[-1][0][1][
+            'resource_usage'])
+        self.assertEqual(usage, json.loads(
+            event_queue.put.call_args[0][0])['resource_usage'])
+
+    @patch('job_runner_worker.worker.outbox')
+    @patch('job_runner_worker.worker.datetime')
+    @patch('job_runner_worker.worker.settings')
+    def test__finalize_run_timed_out(self, settings, datetime, outbox):
+        """
+        Test :func:`._finalize_run` reporting a timeout.
+        """
+        settings.resource_usage_field = ''
+        settings.run_timed_out_field = 'timed_out'
+        run = Mock()
+        run.id = 1234
+        event_queue = Mock()
+
+        _finalize_run(
+            run, Mock(), 'output', False, event_queue, Mock(), None, True)
+
+        self.assertEqual({
+            'return_dts': datetime.now.return_value.isoformat.return_value,
+            'return_success': False,
+            'timed_out': True,
+        }, outbox.patch.call_args_list[-1][0][1])
+        self.assertTrue(
+            json.loads(event_queue.put.call_args[0][0])['timed_out'])
+
+    @patch('job_runner_worker.worker.apply_process_limits')
+    @patch('job_runner_worker.worker.os')
+    def test__get_preexec_fn(self, os, apply_process_limits):
+        """
+        Test :func:`._get_preexec_fn`.
+        """
+        cgroup = Mock()
+        _get_preexec_fn(cgroup, [('cpu', (1, 2))], 5)()
+
+        os.setsid.assert_called_once_with()
+        cgroup.add_current_process.assert_called_once_with()
+        apply_process_limits.assert_called_once_with([('cpu', (1, 2))], 5)
+
+    @patch('job_runner_worker.worker._kill_pid_tree')
+    @patch('job_runner_worker.worker.os')
+    def test__kill_run_process(self, os, kill_pid_tree):
+        """
+        Test :func:`._kill_run_process`.
+        """
+        cgroup = Mock()
+
+        with patch.dict(
+                'job_runner_worker.worker._run_processes',
+                {1234: (1234, cgroup)}):
+            _kill_run_process(1234)
+            _kill_run_process(5678)
+
+        os.killpg.assert_called_once_with(1234, signal.SIGKILL)
+        cgroup.kill.assert_called_once_with()
+        kill_pid_tree.assert_called_once_with(5678)
+
+    @patch('job_runner_worker.worker.os')
+    @patch('job_runner_worker.worker.get_children_index')
+    def test__kill_pid_tree(self, get_children_index, os):
+        """
+        Test :func:`._kill_pid_tree`.
+        """
+        get_children_index.side_effect = [
+            {1: [2], 2: [3]},
+            # 4 was forked while stopping the tree
+            {1: [2], 2: [3, 4]},
+            {1: [2], 2: [3, 4]},
+        ]
+
+        _kill_pid_tree(2)
+
+        self.assertEqual(3, get_children_index.call_count)
+        self.assertEqual([
+            call(2, signal.SIGSTOP),
+            call(3, signal.SIGSTOP),
+            call(4, signal.SIGSTOP),
+            call(2, signal.SIGKILL),
+            call(3, signal.SIGKILL),
+            call(4, signal.SIGKILL),
+        ], os.kill.call_args_list)
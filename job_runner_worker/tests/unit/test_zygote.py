@@ -0,0 +1,141 @@
+import os
+import signal
+import sys
+import tempfile
+import unittest2 as unittest
+
+import gevent
+from mock import Mock, patch
+
+from job_runner_worker.zygote import (
+    Zygote, ZygoteError, get_zygote, stop_zygotes)
+
+
+class ZygoteTestCase(unittest.TestCase):
+    """
+    Tests for :class:`.Zygote`.
+    """
+    def setUp(self):
+        self.zygote = Zygote(sys.executable, ['json', 'no_such_module'])
+        self.addCleanup(self.zygote.stop)
+
+    def _get_script(self, content):
+        file_desc, path = tempfile.mkstemp()
+        os.write(file_desc, content)
+        os.close(file_desc)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_spawn(self):
+        """
+        Test :meth:`.Zygote.spawn`.
+        """
+        path = self._get_script(
+            'import os, sys\n'
+            'print("Hello %d" % os.getpid())\n'
+            'sys.stderr.write("world\\n")\n'
+            'sys.exit(3)\n'
+        )
+
+        proc = self.zygote.spawn(path)
+
+        self.assertEqual('Hello {0}\nworld\n'.format(proc.pid),
+                         proc.stdout.read())
+        returncode, usage = proc.wait_for_usage()
+        self.assertEqual(3, returncode)
+        self.assertTrue('max_rss_kb' in usage)
+
+        # the zygote is re-used
+        zygote_pid = self.zygote._proc.pid
+        proc = self.zygote.spawn(self._get_script('raise ValueError()\n'))
+        self.assertTrue('ValueError' in proc.stdout.read())
+        self.assertEqual(1, proc.wait_for_usage()[0])
+        self.assertEqual(zygote_pid, self.zygote._proc.pid)
+
+    def test_spawn_threads_and_atexit(self):
+        """
+        Test that :meth:`.Zygote.spawn` joins threads and runs exit
+        functions, like a fresh interpreter.
+        """
+        path = self._get_script(
+            'import atexit, sys, threading, time\n'
+            'def work():\n'
+            '    time.sleep(0.1)\n'
+            '    sys.stdout.write("thread\\n")\n'
+            'atexit.register(lambda: sys.stdout.write("atexit\\n"))\n'
+            'threading.Thread(target=work).start()\n'
+            'print("main")\n'
+        )
+
+        proc = self.zygote.spawn(path)
+
+        self.assertEqual('main\nthread\natexit\n', proc.stdout.read())
+        self.assertEqual(0, proc.wait_for_usage()[0])
+
+    def test_spawn_random(self):
+        """
+        Test that every process of :meth:`.Zygote.spawn` is reseeded.
+        """
+        zygote = Zygote(sys.executable, ['random'])
+        self.addCleanup(zygote.stop)
+        path = self._get_script('import random\nprint(random.random())\n')
+
+        values = []
+        for x in range(2):
+            proc = zygote.spawn(path)
+            values.append(proc.stdout.read())
+            proc.wait_for_usage()
+
+        self.assertNotEqual(values[0], values[1])
+
+    def test_spawn_kill(self):
+        """
+        Test killing a process started with :meth:`.Zygote.spawn`.
+        """
+        path = self._get_script('import time\ntime.sleep(30)\n')
+        proc = self.zygote.spawn(path)
+
+        # the process runs in its own session
+        os.killpg(proc.pid, signal.SIGKILL)
+        self.assertEqual(-signal.SIGKILL, proc.wait_for_usage()[0])
+
+    def test_zygote_exit(self):
+        """
+        Test the zygote exiting while a process is running.
+        """
+        path = self._get_script('import time\ntime.sleep(30)\n')
+        proc = self.zygote.spawn(path)
+
+        os.kill(self.zygote._proc.pid, signal.SIGKILL)
+        self.assertRaises(ZygoteError, proc.wait_for_usage)
+
+        # a new zygote is started on the next spawn
+        gevent.sleep(0)
+        self.assertFalse(self.zygote.is_alive())
+        proc = self.zygote.spawn(self._get_script('print("again")\n'))
+        self.assertEqual('again\n', proc.stdout.read())
+        self.assertEqual(0, proc.wait_for_usage()[0])
+
+
+class ModuleTestCase(unittest.TestCase):
+    """
+    Tests for :mod:`job_runner_worker.zygote`.
+    """
+    @patch('job_runner_worker.zygote.Zygote')
+    @patch('job_runner_worker.zygote.settings')
+    def test_get_zygote(self, settings, Zygote):
+        """
+        Test :func:`.get_zygote`.
+        """
+        settings.zygote_shebangs = '/usr/bin/env python, /usr/bin/python'
+        settings.zygote_modules = 'json, os'
+        self.addCleanup(stop_zygotes)
+
+        self.assertIsNone(get_zygote('#!/bin/bash'))
+        zygote = get_zygote('#!/usr/bin/python')
+        self.assertEqual(Zygote.return_value, zygote)
+        self.assertEqual(zygote, get_zygote('#! /usr/bin/python '))
+        Zygote.assert_called_once_with('/usr/bin/python', ['json', 'os'])
+
+        settings.zygote_shebangs = ''
+        self.assertIsNone(get_zygote('#!/usr/bin/python'))
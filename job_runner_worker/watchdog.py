@@ -0,0 +1,73 @@
+import logging
+import os
+import signal
+
+import gevent
+
+from job_runner_worker.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class RunWatchdog(object):
+    """
+    Enforces the wall-clock timeout of a run.
+
+    When the run is still running after ``timeout`` seconds, its process
+    group is sent ``SIGTERM``. When it is still running
+    ``run_timeout_grace`` seconds later, it is killed with ``kill``.
+
+    :param pid:
+        The ``PID`` of the run process (which is the leader of its process
+        group).
+
+    :param timeout:
+        The timeout in seconds (``0`` for no timeout).
+
+    :param kill:
+        A callable to kill the run, which is called with ``pid``.
+
+    """
+    def __init__(self, pid, timeout, kill):
+        self.pid = pid
+        self.timeout = timeout
+        self.kill = kill
+        self.timed_out = False
+        self._greenlet = None
+
+    def start(self):
+        """
+        Start watching (unless ``timeout`` is ``0``).
+        """
+        if self.timeout > 0:
+            self._greenlet = gevent.spawn(self._watch)
+
+    def stop(self):
+        """
+        Stop watching, this must be called once the run ended.
+        """
+        if self._greenlet is not None:
+            self._greenlet.kill()
+            self._greenlet = None
+
+    def _watch(self):
+        gevent.sleep(self.timeout)
+
+        logger.warning('Run process {0} exceeded its timeout of {1} '
+                       'seconds, terminating it'.format(
+                           self.pid, self.timeout))
+        self.timed_out = True
+
+        try:
+            os.killpg(self.pid, signal.SIGTERM)
+        except OSError:
+            logger.exception('Error while terminating process group {0}, '
+                             'already finished?'.format(self.pid))
+
+        gevent.sleep(settings.run_timeout_grace)
+
+        logger.warning('Run process {0} did not terminate within {1} '
+                       'seconds, killing it'.format(
+                           self.pid, settings.run_timeout_grace))
+        self.kill(self.pid)
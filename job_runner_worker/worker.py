@@ -1,26 +1,49 @@
-import codecs
 import json
 import logging
 import os
 import signal
 import shlex
-import tempfile
+import socket
 import traceback
 import time
 from datetime import datetime
 
+import gevent
 import gevent_subprocess as subprocess
-from pytz import utc
 from gevent.queue import Empty
+from pytz import utc
 
-from job_runner_worker.config import config
+from job_runner_worker.accounting import (
+    get_rusage_usage, resource_stats, wait_for_process)
+from job_runner_worker.cgroup import RunCgroup
+from job_runner_worker.concurrency import concurrency_controller
+from job_runner_worker.config import settings
+from job_runner_worker.limits import (
+    apply_process_limits, get_limit_failure, get_rlimits, get_run_timeout)
+from job_runner_worker.log_archive import log_archive
+from job_runner_worker.log_shipper import LogShipper
+from job_runner_worker.materializer import script_materializer
 from job_runner_worker.models import RunLog
+from job_runner_worker.outbox import outbox
+from job_runner_worker.output import OutputCapture
+from job_runner_worker.process import get_children_index, get_descendant_pids
+from job_runner_worker.queues import get_or_exit, peek_or_exit
+from job_runner_worker.script_cache import script_cache
+from job_runner_worker.watchdog import RunWatchdog
+from job_runner_worker.zygote import ZygoteProcess, get_zygote
 
 
 logger = logging.getLogger(__name__)
 
+# the process group id and cgroup of the runs executed by this worker,
+# indexed by pid
+_run_processes = {}
+
+# the pid of the runs executed by this worker, indexed by run resource path
+_run_pids = {}
+
 
-def execute_run(run_queue, event_queue, exit_queue):
+def execute_run(run_queue, event_queue, exit_event, finalize_queue=None):
     """
     Execute runs from the ``run_queue``.
 
@@ -30,109 +53,376 @@ def execute_run(run_queue, event_queue, exit_queue):
     :param event_queue:
         An instance of ``Queue`` to push events to.
 
-    :param exit_queue:
-        An instance of ``Queue`` to consume from. If this queue is not empty,
-        the function needs to terminate.
+    :param exit_event:
+        An instance of ``Event``. When it is set, the function needs to
+        terminate.
+
+    :param finalize_queue:
+        An instance of ``Queue`` to push ended runs to, which are finalized
+        by :func:`.finalize_runs`. When not given, runs are finalized by
+        this greenlet. Optional.
 
     """
     logger.info('Starting run executer')
 
     while True:
-        try:
-            exit_queue.get(block=False)
+        # only take a slot once a run is waiting, so idle executors don't
+        # hold slots (the concurrency controller considers them in use)
+        if peek_or_exit(run_queue, exit_event) is None:
+            logger.info('Termintating run executer')
+            return
+
+        if not concurrency_controller.acquire(exit_event):
             logger.info('Termintating run executer')
             return
-        except Empty:
-            pass
 
         try:
-            run = run_queue.get(block=False)
-        except Empty:
-            time.sleep(0.5)
-            continue
-
-        # If *anything goes wrong* we want to have feedback bubling up to
-        # the master server, including email sent and dashboard updated.
-        # From a user POV, a job not run is a failure.
-        # Hence the catchall try.
-        did_run = False
-        file_path = None
-
-        logger.info('Starting run {0}'.format(run.resource_uri))
-        run.patch({'start_dts': datetime.now(utc).isoformat(' ')})
-        event_queue.put(json.dumps(
-            {'event': 'started', 'run_id': run.id, 'kind': 'run'}))
+            try:
+                run = run_queue.get(block=False)
+            except Empty:
+                # taken by another executor while waiting for the slot
+                continue
+
+            _execute_run(run, event_queue, finalize_queue)
+        finally:
+            concurrency_controller.release()
+
+
+def _execute_run(run, event_queue, finalize_queue=None):
+    """
+    Execute ``run`` and send its result to the API.
 
+    :param run:
+        An instance of :class:`.Run`.
+
+    :param event_queue:
+        An instance of ``Queue`` to push events to.
+
+    :param finalize_queue:
+        An instance of ``Queue`` to hand the ended run to. Optional.
+
+    """
+    # If *anything goes wrong* we want to have feedback bubling up to
+    # the master server, including email sent and dashboard updated.
+    # From a user POV, a job not run is a failure.
+    # Hence the catchall try.
+    did_run = False
+    file_path = None
+    cgroup = None
+    sub_proc = None
+    watchdog = None
+    returncode = None
+    usage = None
+
+    logger.info('Starting run {0} (waited {1} seconds in queue)'.format(
+        run.resource_uri, run.queue_wait_time))
+    # deferred, it will be sent together with the pid (or the result when
+    # the run could not be started)
+    local_updates = {'start_dts': datetime.now(utc).isoformat(' ')}
+    run.patch(dict(local_updates), defer=True)
+    event_queue.put(json.dumps({
+        'event': 'started',
+        'run_id': run.id,
+        'kind': 'run',
+        'queue_wait_time': run.queue_wait_time,
+    }))
+
+    # the run is reloaded while the job is executing (the log resource
+    # it refers to is only created by the worker itself), so finalizing
+    # the run doesn't need to wait for it
+    run_reload = gevent.spawn(_reload_run, run, local_updates)
+
+    # the output is truncated while reading, so a job printing a lot of
+    # output doesn't use more than max_log_bytes of memory
+    archive = None
+    if log_archive.is_enabled():
         try:
-            file_desc, file_path = tempfile.mkstemp(
-                dir=config.get('job_runner_worker', 'script_temp_path')
-            )
-            # seems there isn't support to open file descriptors directly in
-            # utf-8 encoding
-            os.fdopen(file_desc).close()
-
-            file_obj = codecs.open(file_path, 'w', 'utf-8')
-            file_obj.write(run.job.script_content.replace('\r', ''))
-            file_obj.close()
-
-            # get shebang from content of the script
-            shebang = run.job.script_content.split('\n', 1)[0]
-            if not shebang.startswith('#!'):
-                raise Exception(
-                    'The first line of the job to run needs to '
-                    'start with a shebang (#!). The current first line is: "'
-                    '{0}"'.format(shebang))
-            executable = "{0} {1}".format(shebang.replace('#!', ''), file_path)
+            archive = log_archive.open(run.id)
+        except (IOError, OSError):
+            logger.exception('Unable to archive the output of the run')
+
+    output = OutputCapture(settings.max_log_bytes, archive)
+    log_shipper = LogShipper(run, run_reload, output)
 
+    try:
+        cached_script = script_cache.get(run.job)
+        script_content = cached_script.content
+
+        # get shebang from content of the script
+        shebang = script_content.split('\n', 1)[0]
+        if not shebang.startswith('#!'):
+            raise Exception(
+                'The first line of the job to run needs to '
+                'start with a shebang (#!). The current first line is: "'
+                '{0}"'.format(shebang))
+
+        # resolved before the process is started, since this might need to
+        # load the job from the API (the watchdog needs to be armed and the
+        # output read as soon as the process runs)
+        run_timeout = get_run_timeout(run)
+
+        # the script is shared with other runs of the same script
+        file_path = script_materializer.acquire(cached_script)
+        executable = "{0} {1}".format(shebang.replace('#!', ''), file_path)
+
+        if RunCgroup.is_enabled():
+            cgroup = RunCgroup(run.id)
+            cgroup.create()
+            cgroup.set_limits(
+                settings.cgroup_memory_max, settings.cgroup_cpu_max)
+
+        start_time = time.time()
+        # Python scripts can be forked from a warm interpreter instead
+        zygote = get_zygote(shebang)
+
+        if zygote is not None:
+            sub_proc = zygote.spawn(
+                file_path, cgroup, get_rlimits(), settings.run_nice)
+        else:
             sub_proc = subprocess.Popen(
                 shlex.split(executable),
                 stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT
+                stderr=subprocess.STDOUT,
+                preexec_fn=_get_preexec_fn(
+                    cgroup, get_rlimits(), settings.run_nice),
             )
 
-            run.patch({'pid': sub_proc.pid})
-            did_run = True
-            out, err = sub_proc.communicate()
-        except Exception as e:
-            logger.exception('The run failed to complete because of an error')
-            out = ('[job runner worker] Could not execute job: ' +
-                   traceback.format_exc(e))
+        # the process is the leader of its own process group
+        _run_processes[sub_proc.pid] = (sub_proc.pid, cgroup)
+        _run_pids[run._resource_path] = sub_proc.pid
+        local_updates['pid'] = sub_proc.pid
+        outbox.patch(run, {'pid': sub_proc.pid})
+        did_run = True
+        watchdog = RunWatchdog(sub_proc.pid, run_timeout, _kill_run_process)
+        watchdog.start()
+        log_shipper.start()
+        output.read_from(sub_proc.stdout)
+
+        if isinstance(sub_proc, ZygoteProcess):
+            # the process is a child of the zygote, which reports its exit
+            returncode, usage = sub_proc.wait_for_usage()
+        else:
+            returncode, rusage = wait_for_process(sub_proc.pid)
+
+            if rusage is not None:
+                usage = get_rusage_usage(rusage)
+            else:
+                # the process was already reaped by someone else
+                returncode = sub_proc.wait()
+                if cgroup is not None:
+                    usage = cgroup.get_usage()
+
+        # the wall time is known, even when the other usage isn't
+        if usage is None:
+            usage = {}
+        usage['wall_time'] = time.time() - start_time
+        resource_stats.add(run.job._resource_path, usage)
+
+        if watchdog.timed_out:
+            limit_failure = (
+                'Run was killed because it exceeded its timeout of {0} '
+                'seconds'.format(watchdog.timeout))
+        else:
+            limit_failure = get_limit_failure(returncode, usage, cgroup)
+
+        if limit_failure:
+            output.feed('\n[job runner worker] {0}\n'.format(
+                limit_failure))
+    except Exception as e:
+        logger.exception('The run failed to complete because of an error')
+        output.feed('[job runner worker] Could not execute job: ' +
+                    traceback.format_exc(e))
+
+    log_shipper.stop()
+
+    if watchdog is not None:
+        watchdog.stop()
+    timed_out = watchdog is not None and watchdog.timed_out
+
+    if sub_proc is not None:
+        _run_processes.pop(sub_proc.pid, None)
+        _run_pids.pop(run._resource_path, None)
+    if cgroup is not None:
+        cgroup.remove()
+
+    if usage is not None:
+        logger.info('Resource usage of run {0}: {1}'.format(
+            run.resource_uri, usage))
+
+    log_output = output.getvalue()
+
+    if archive is not None and archive.close() and output.dropped_bytes:
+        log_output += (
+            '\n[job runner worker] The complete output ({0} bytes) is '
+            'archived on {1} in {2}\n'.format(
+                output.total_bytes, socket.gethostname(), archive.path))
+
+    logger.info('Run {0} ended ({1} bytes of output, {2} dropped)'.format(
+        run.resource_uri, output.total_bytes, output.dropped_bytes))
+
+    if file_path:
+        script_materializer.release(file_path)
+
+    finalize_args = (
+        run,
+        run_reload,
+        log_output,
+        False if did_run is False or returncode or timed_out else True,
+        event_queue,
+        log_shipper.run_log,
+        usage,
+        timed_out,
+        log_shipper.interrupted and log_shipper.run_log is None,
+    )
+
+    if finalize_queue is None:
+        _finalize_run(*finalize_args)
+        return
+
+    if finalize_queue.full():
+        # backpressure: the slot of this run is kept until the finalizers
+        # caught up, so no new runs are started meanwhile
+        logger.warning(
+            'Finalize backlog is full, waiting to hand off run {0}'.format(
+                run.resource_uri))
+    finalize_queue.put(finalize_args)
+
+
+def finalize_runs(finalize_queue, exit_event):
+    """
+    Finalize ended runs from the ``finalize_queue``.
+
+    :param finalize_queue:
+        An instance of ``Queue`` to consume the arguments of
+        :func:`._finalize_run` from.
+
+    :param exit_event:
+        An instance of ``Event``. When it is set, the function needs to
+        terminate once all enqueued runs have been finalized.
+
+    """
+    logger.info('Starting run finalizer')
+
+    while True:
+        finalize_args = get_or_exit(finalize_queue, exit_event)
+
+        if finalize_args is None:
+            try:
+                finalize_args = finalize_queue.get(block=False)
+            except Empty:
+                logger.info('Terminating run finalizer')
+                return
+
+        try:
+            _finalize_run(*finalize_args)
+        except Exception:
+            # the run is reset by the next worker process (see
+            # reset_incomplete_runs), the other runs still need finalizing
+            logger.exception('Unable to finalize run {0}'.format(
+                finalize_args[0].resource_uri))
+
+
+def _finalize_run(run, run_reload, log_output, return_success, event_queue,
+                  run_log=None, usage=None, timed_out=False,
+                  reload_run=False):
+    """
+    Send the result of a finished run to the API (through the outbox).
+
+    The log needs to be stored before the ``return_dts`` is set, since the
+    master considers the run complete (and notifies about it) as soon as the
+    ``return_dts`` is set. The outbox sends requests in the order they were
+    added. The timing of each stage is logged.
+
+    :param run:
+        An instance of :class:`.Run`.
+
+    :param run_reload:
+        The greenlet reloading ``run``, started when the run was started.
+
+    :param log_output:
+        The (truncated) output of the run.
+
+    :param return_success:
+        A ``bool`` indicating if the run was successful.
+
+    :param event_queue:
+        An instance of ``Queue`` to push events to.
+
+    :param run_log:
+        The log resource of the run, when it is already known (e.g. because
+        it was created while shipping the log). Optional.
+
+    :param usage:
+        A ``dict`` containing the resource usage of the run. It is added to
+        the ``returned`` event, and to the ``resource_usage_field`` of the
+        run when this setting is set. Optional.
+
+    :param timed_out:
+        A ``bool`` indicating if the run was killed because of its timeout.
+        It is added to the ``returned`` event, and to the
+        ``run_timed_out_field`` of the run when this setting is set.
+        Optional.
 
-        log_output = _truncate_log(out)
+    :param reload_run:
+        A ``bool`` indicating if ``run`` needs to be reloaded, because its
+        log might have been created by a log shipment which was interrupted.
+        Optional.
 
-        logger.info('Run {0} ended'.format(run.resource_uri))
+    """
+    timings = {}
+    stage_start = time.time()
+
+    run_reload.join()
+    if reload_run or not run_reload.successful():
         run.reload()
-        run_log = run.run_log
-
-        if run_log:
-            # handles the rare case when a job alread has a log, but was
-            # restarted (because the return_dts was never set)
-            run_log.patch({
-                'content': log_output,
-            })
-        else:
-            run_log = RunLog(
-                config.get('job_runner_worker', 'run_log_resource_uri'))
-            run_log.post({
-                'run': '{0}{1}/'.format(
-                    config.get('job_runner_worker', 'run_resource_uri'),
-                    run.id
-                ),
-                'content': log_output
-            })
-        run.patch({
-            'return_dts': datetime.now(utc).isoformat(' '),
-            'return_success':
-            False if did_run is False or sub_proc.returncode else True,
-        })
-        event_queue.put(json.dumps(
-            {'event': 'returned', 'run_id': run.id, 'kind': 'run'}))
-
-        if file_path:
-            os.remove(file_path)
-
-
-def kill_run(kill_queue, event_queue, exit_queue):
+    timings['reload'] = time.time() - stage_start
+
+    stage_start = time.time()
+    run_log = run_log or run.run_log
+
+    # the log is in the group of the run, so the result is held back when
+    # storing the log fails
+    if run_log:
+        # handles the rare case when a job alread has a log, but was
+        # restarted (because the return_dts was never set)
+        outbox.patch(run_log, {
+            'content': log_output,
+        }, group=run._resource_path)
+    else:
+        run_log = RunLog(settings.run_log_resource_uri)
+        outbox.post(run_log, {
+            'run': '{0}{1}/'.format(settings.run_resource_uri, run.id),
+            'content': log_output
+        }, group=run._resource_path)
+    timings['log'] = time.time() - stage_start
+
+    stage_start = time.time()
+    result = {
+        'return_dts': datetime.now(utc).isoformat(' '),
+        'return_success': return_success,
+    }
+    if usage is not None and settings.resource_usage_field:
+        result[settings.resource_usage_field] = usage
+    if settings.run_timed_out_field:
+        result[settings.run_timed_out_field] = timed_out
+    outbox.patch(run, result)
+    timings['return'] = time.time() - stage_start
+
+    event = {'event': 'returned', 'run_id': run.id, 'kind': 'run'}
+    if usage is not None:
+        event['resource_usage'] = usage
+    if timed_out:
+        event['timed_out'] = True
+    event_queue.put(json.dumps(event))
+
+    logger.debug('Finalized run {0} in {1}'.format(
+        run.resource_uri,
+        ', '.join(['{0}: {1:.3f}s'.format(stage, timings[stage])
+                   for stage in ('reload', 'log', 'return')]),
+    ))
+
+
+def kill_run(kill_queue, event_queue, exit_event):
     """
     Execute kill-requests from the ``kill_queue``.
 
@@ -142,31 +432,32 @@ def kill_run(kill_queue, event_queue, exit_queue):
     :param event_queue:
         An instance of ``Queue`` to push events to.
 
-    :param exit_queue:
-        An instance of ``Queue`` to consume from. If this queue is not empty,
-        the function needs to terminate.
+    :param exit_event:
+        An instance of ``Event``. When it is set, the function needs to
+        terminate.
 
     """
     logger.info('Starting executor for kill-requests')
 
     while True:
-        try:
-            exit_queue.get(block=False)
+        kill_request = get_or_exit(kill_queue, exit_event)
+
+        if kill_request is None:
             logger.info('Termintating executor for kill-requests')
             return
-        except Empty:
-            pass
-
-        try:
-            kill_request = kill_queue.get(block=False)
-        except Empty:
-            time.sleep(0.5)
-            continue
 
         run = kill_request.run
+        # the pid of a run started by this worker is known, even when the
+        # PATCH setting it wasn't sent yet
+        pid = _run_pids.get(run._resource_path, run.pid)
 
-        _kill_pid_tree(run.pid)
-        kill_request.patch({'execute_dts': datetime.now(utc).isoformat(' ')})
+        if pid is None:
+            logger.warning(
+                'Run {0} has no process to kill'.format(run.resource_uri))
+        else:
+            _kill_run_process(pid)
+        outbox.patch(
+            kill_request, {'execute_dts': datetime.now(utc).isoformat(' ')})
         event_queue.put(json.dumps({
             'event': 'executed',
             'kill_request_id': kill_request.id,
@@ -174,69 +465,128 @@ def kill_run(kill_queue, event_queue, exit_queue):
         }))
 
 
-def _kill_pid_tree(pid):
+def _reload_run(run, local_updates):
     """
-    Kill a given ``pid`` including its tree of children.
+    Reload ``run``, keeping the updates made locally.
+
+    The updates are sent through the outbox, so the reloaded data might not
+    contain them yet.
+
+    :param run:
+        An instance of :class:`.Run`.
+
+    :param local_updates:
+        A ``dict`` containing the attributes updated by the worker. Updates
+        made while reloading are added to it.
+
+    """
+    run.reload()
+    run._data.update(local_updates)
+
+
+def _get_preexec_fn(cgroup=None, rlimits=(), nice=0):
+    """
+    Return the function to call in the run process before the job starts.
+
+    The run process is started in a new session (and thus process group), so
+    it can be killed including all its children at once. When ``cgroup`` is
+    given, the process is moved into it.
+
+    :param cgroup:
+        An instance of :class:`.RunCgroup`. Optional.
+
+    :param rlimits:
+        A ``list`` of resource limits, see :func:`.get_rlimits`. Optional.
+
+    :param nice:
+        The increment of the nice level. Optional.
+
+    """
+    def preexec_fn():
+        os.setsid()
+        if cgroup is not None:
+            cgroup.add_current_process()
+        apply_process_limits(rlimits, nice)
+
+    return preexec_fn
+
+
+def _kill_run_process(pid):
+    """
+    Kill the process of a run, including all its children.
+
+    When the run was started by this worker process, its process group (and
+    cgroup, when enabled) is killed. Otherwise, the tree of processes is
+    walked (see :func:`._kill_pid_tree`).
 
     :param pid:
-        An ``int`` representing the parent ``PID``.
+        An ``int`` representing the ``PID`` of the run.
 
     """
-    children = _get_child_pids(pid)
-    for child_pid in children:
-        _kill_pid_tree(child_pid)
+    if pid not in _run_processes:
+        _kill_pid_tree(pid)
+        return
+
+    process_group_id, cgroup = _run_processes[pid]
 
     try:
-        os.kill(pid, signal.SIGKILL)
+        os.killpg(process_group_id, signal.SIGKILL)
     except OSError:
         logger.exception(
-            'Error while killing {0}, process already finished?'.format(
-                pid)
+            'Error while killing process group {0}, already finished?'.format(
+                process_group_id)
         )
 
+    # processes which started a new session are only caught by the cgroup
+    if cgroup is not None:
+        cgroup.kill()
+
 
-def _get_child_pids(pid):
+def _kill_pid_tree(pid, max_scans=10):
     """
-    Return the list of children ``PID``s for the given parent ``pid``.
+    Kill a given ``pid`` including its tree of children.
+
+    The tree is first stopped (``SIGSTOP``) so it can't fork anymore, and the
+    process table is re-scanned until no new descendants show up (to catch
+    processes which were forked while stopping the tree). Then all the
+    stopped processes are killed.
 
     :param pid:
         An ``int`` representing the parent ``PID``.
 
-    :return:
-        A ``list`` of children ``PIDS``s (if any).
+    :param max_scans:
+        The maximum number of scans of the process table.
 
     """
-    sub_proc = subprocess.Popen(
-        ['ps', '-o', 'pid', '--ppid', str(pid), '--noheaders'],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    ret_code = sub_proc.wait()
+    stopped_pids = []
 
-    if ret_code == 0:
-        out, err = sub_proc.communicate()
-        return [int(x) for x in out.split('\n')[:-1]]
+    for scan in range(max_scans):
+        children_index = get_children_index()
+        new_pids = [
+            tree_pid
+            for tree_pid in [pid] + get_descendant_pids(pid, children_index)
+            if tree_pid not in stopped_pids
+        ]
 
-    return []
+        if not new_pids:
+            break
 
+        for tree_pid in new_pids:
+            _signal_pid(tree_pid, signal.SIGSTOP)
+        stopped_pids.extend(new_pids)
 
-def _truncate_log(log_txt):
-    """
-    Truncate the ``log_txt`` in case it exeeds the max. log size.
+    for tree_pid in stopped_pids:
+        _signal_pid(tree_pid, signal.SIGKILL)
 
-    :param log_txt:
-        A ``str``.
 
+def _signal_pid(pid, signal_number):
     """
-    max_log_bytes = config.getint('job_runner_worker', 'max_log_bytes')
-
-    if len(log_txt) > max_log_bytes:
-        top_length = int(max_log_bytes * 0.2)
-        bottom_length = int(max_log_bytes * 0.8)
-
-        log_txt = '{0}\n\n[truncated]\n\n{1}'.format(
-            log_txt[:top_length],
-            log_txt[len(log_txt) - bottom_length:]
+    Send ``signal_number`` to ``pid``.
+    """
+    try:
+        os.kill(pid, signal_number)
+    except OSError:
+        logger.exception(
+            'Error while killing {0}, process already finished?'.format(
+                pid)
         )
-
-    return log_txt
@@ -0,0 +1,304 @@
+import _multiprocessing
+import json
+import logging
+import os
+import shlex
+import signal
+import struct
+
+import gevent
+import gevent_subprocess as subprocess
+from gevent import socket
+from gevent.event import AsyncResult
+from gevent.lock import Semaphore
+from gevent.queue import Queue
+
+from job_runner_worker.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+SERVER_PATH = os.path.join(os.path.dirname(__file__), 'zygote_server.py')
+
+
+class ZygoteError(Exception):
+    """
+    Raised when the zygote could not start a run, or exited while it was
+    running.
+    """
+
+
+class ZygoteProcess(object):
+    """
+    A run process forked by a :class:`.Zygote`.
+
+    :param pid:
+        The ``PID`` of the process.
+
+    :param stdout:
+        A file object for reading the output of the process.
+
+    :param exit_result:
+        An instance of ``AsyncResult``, set to ``(returncode, usage)`` when
+        the process exited.
+
+    """
+    def __init__(self, pid, stdout, exit_result):
+        self.pid = pid
+        self.stdout = stdout
+        self._exit_result = exit_result
+
+    def wait_for_usage(self):
+        """
+        Wait for the process to exit.
+
+        :return:
+            A tuple ``(returncode, usage)``, ``usage`` being a ``dict`` as
+            returned by :func:`.get_rusage_usage`.
+
+        :raises:
+            :exc:`.ZygoteError` when the zygote exited meanwhile.
+
+        """
+        try:
+            return self._exit_result.get()
+        finally:
+            self.stdout.close()
+
+
+class Zygote(object):
+    """
+    A pre-forked interpreter (see :mod:`job_runner_worker.zygote_server`),
+    forking a process for every run.
+
+    The process started by the zygote is equivalent to the one started by
+    ``Popen``: it runs in its own session (and optional cgroup) with the
+    limits of the run applied, and its output is sent to a pipe which is
+    read by the worker. Its ``PID`` and exit status are reported by the
+    zygote.
+
+    :param command:
+        The interpreter command, as found in the shebang (e.g.
+        ``/usr/bin/env python``).
+
+    :param modules:
+        A ``list`` of modules to import in the zygote before forking.
+
+    """
+    def __init__(self, command, modules=()):
+        self.command = command
+        self.modules = list(modules)
+        self._proc = None
+        self._sock = None
+        self._lock = Semaphore()
+        self._replies = None
+        self._exit_results = None
+
+    def is_alive(self):
+        """
+        Return ``True`` when the zygote is running.
+        """
+        return self._sock is not None
+
+    def start(self):
+        """
+        Start the zygote process.
+        """
+        sock, server_sock = socket.socketpair()
+
+        try:
+            self._proc = subprocess.Popen(
+                shlex.split(self.command) + [SERVER_PATH] + self.modules,
+                stdin=server_sock.fileno(),
+                close_fds=True,
+            )
+        finally:
+            server_sock.close()
+
+        logger.info('Started zygote for {0} (pid {1})'.format(
+            self.command, self._proc.pid))
+        self._sock = sock
+        # per connection, so a zygote which exited can't affect the next one
+        self._replies = Queue()
+        self._exit_results = {}
+        gevent.spawn(
+            self._read_loop, sock, self._replies, self._exit_results)
+
+    def stop(self):
+        """
+        Stop the zygote process.
+
+        Processes which are still running are killed, since their exit
+        status can not be collected anymore.
+
+        """
+        if self._sock is None:
+            return
+
+        self._sock.close()
+        self._sock = None
+        self._proc.wait()
+
+    def spawn(self, script_path, cgroup=None, rlimits=(), nice=0):
+        """
+        Fork a process which executes ``script_path``.
+
+        The zygote is (re)started when it is not running.
+
+        :param script_path:
+            The path of the script.
+
+        :param cgroup:
+            An instance of :class:`.RunCgroup`. Optional.
+
+        :param rlimits:
+            A ``list`` of resource limits, see :func:`.get_rlimits`.
+            Optional.
+
+        :param nice:
+            The increment of the nice level. Optional.
+
+        :return:
+            An instance of :class:`.ZygoteProcess`.
+
+        :raises:
+            :exc:`.ZygoteError` when the zygote could not fork.
+
+        """
+        with self._lock:
+            if not self.is_alive():
+                self.start()
+            replies = self._replies
+
+            read_fd, write_fd = os.pipe()
+            try:
+                _multiprocessing.sendfd(self._sock.fileno(), write_fd)
+                self._send_message({
+                    'script': script_path,
+                    'cgroup_procs': os.path.join(
+                        cgroup.path, 'cgroup.procs') if cgroup else None,
+                    'rlimits': list(rlimits),
+                    'nice': nice,
+                })
+            except (OSError, socket.error) as e:
+                os.close(read_fd)
+                raise ZygoteError('Unable to send request to zygote: '
+                                  '{0}'.format(e))
+            finally:
+                os.close(write_fd)
+
+            reply, exit_result = replies.get()
+
+        if reply['event'] != 'started':
+            os.close(read_fd)
+            raise ZygoteError('Zygote could not start the run: {0}'.format(
+                reply.get('error')))
+
+        return ZygoteProcess(
+            reply['pid'],
+            os.fdopen(read_fd, 'rb', 0),
+            exit_result,
+        )
+
+    def _send_message(self, message):
+        data = json.dumps(message)
+        self._sock.sendall(struct.pack('>I', len(data)) + data)
+
+    def _read_loop(self, sock, replies, exit_results):
+        """
+        Dispatch the messages of the zygote until it disconnects.
+        """
+        try:
+            while True:
+                size = struct.unpack('>I', _recv_exact(sock, 4))[0]
+                message = json.loads(_recv_exact(sock, size))
+
+                if message['event'] == 'exited':
+                    exit_result = exit_results.pop(message['pid'], None)
+                    if exit_result is not None:
+                        exit_result.set(
+                            (message['returncode'], message['usage']))
+                    continue
+
+                exit_result = None
+                if message['event'] == 'started':
+                    # registered here, since the exit might be reported
+                    # before the spawning greenlet gets the reply
+                    exit_result = AsyncResult()
+                    exit_results[message['pid']] = exit_result
+                replies.put((message, exit_result))
+        except (EOFError, socket.error) as e:
+            if sock is self._sock:
+                logger.error('Zygote for {0} exited: {1!r}'.format(
+                    self.command, e))
+        finally:
+            self._on_exit(sock, replies, exit_results)
+
+    def _on_exit(self, sock, replies, exit_results):
+        """
+        Clean up after the zygote disconnected.
+        """
+        if sock is self._sock:
+            self._sock.close()
+            self._sock = None
+
+        replies.put(({'event': 'failed', 'error': 'zygote exited'}, None))
+
+        # the exit status of the running processes can not be collected
+        # anymore, kill them so their run doesn't hang
+        for pid, exit_result in exit_results.items():
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except OSError:
+                pass
+            exit_result.set_exception(ZygoteError(
+                'Zygote exited while the run was running'))
+        exit_results.clear()
+
+
+def _recv_exact(sock, size):
+    data = ''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError()
+        data += chunk
+    return data
+
+
+_zygotes = {}
+
+
+def get_zygote(shebang):
+    """
+    Return the zygote for the interpreter of ``shebang``.
+
+    :param shebang:
+        The first line of a script (including ``#!``).
+
+    :return:
+        An instance of :class:`.Zygote`, or ``None`` when the interpreter is
+        not in ``zygote_shebangs``.
+
+    """
+    command = shebang[2:].strip()
+    commands = [c.strip() for c in settings.zygote_shebangs.split(',')]
+
+    if not command or command not in commands:
+        return None
+
+    if command not in _zygotes:
+        modules = [
+            m.strip() for m in settings.zygote_modules.split(',') if m.strip()]
+        _zygotes[command] = Zygote(command, modules)
+
+    return _zygotes[command]
+
+
+def stop_zygotes():
+    """
+    Stop all zygotes.
+    """
+    for zygote in _zygotes.values():
+        zygote.stop()
+    _zygotes.clear()
@@ -0,0 +1,339 @@
+"""
+Fork-server for Python job scripts (the zygote).
+
+This script is started by the worker with the interpreter of the job
+scripts (e.g. ``/usr/bin/env python``), with the modules to pre-import as
+arguments. Its stdin is a UNIX socket connected to the worker. For every
+request it forks, and the child executes the script in the warm
+interpreter.
+
+It only depends on the standard library, since the interpreter of the job
+scripts might not have the dependencies of the worker installed.
+
+Protocol (every message is a 4-byte big-endian length, followed by a JSON
+object):
+
+* worker -> zygote: the write end of the output pipe (passed with
+  ``SCM_RIGHTS``), followed by ``{"script": ..., "cgroup_procs": ...,
+  "rlimits": [[resource, [soft, hard]], ...], "nice": ...}``.
+* zygote -> worker: ``{"event": "started", "pid": ...}`` (or
+  ``{"event": "failed", "error": ...}``) in reply to every request, and
+  ``{"event": "exited", "pid": ..., "returncode": ..., "usage": {...}}``
+  when a child exited.
+
+"""
+import errno
+import fcntl
+import json
+import os
+import resource
+import select
+import signal
+import socket
+import struct
+import sys
+import traceback
+import types
+
+
+def _recv_exact(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError()
+        data += chunk
+    return data
+
+
+def _recv_fd(sock):
+    if hasattr(sock, 'recvmsg'):
+        int_size = struct.calcsize('i')
+        msg, ancdata, flags, addr = sock.recvmsg(
+            1, socket.CMSG_LEN(int_size))
+        if not msg:
+            raise EOFError()
+        for level, cmsg_type, cmsg_data in ancdata:
+            if level == socket.SOL_SOCKET and cmsg_type == socket.SCM_RIGHTS:
+                return struct.unpack('i', cmsg_data[:int_size])[0]
+        raise EOFError()
+
+    import _multiprocessing
+    try:
+        return _multiprocessing.recvfd(sock.fileno())
+    except (OSError, RuntimeError):
+        # RuntimeError: the worker disconnected
+        raise EOFError()
+
+
+def _recv_message(sock):
+    size = struct.unpack('>I', _recv_exact(sock, 4))[0]
+    return json.loads(_recv_exact(sock, size).decode('utf-8'))
+
+
+def _send_message(sock, message):
+    data = json.dumps(message).encode('utf-8')
+    sock.sendall(struct.pack('>I', len(data)) + data)
+
+
+def _reinitialize():
+    """
+    Reset the state which the forked child inherited from the zygote.
+
+    Python 2 doesn't reseed ``random`` after a fork, so without this every
+    run would get the same random numbers.
+
+    """
+    random = sys.modules.get('random')
+    if random is not None:
+        random.seed()
+
+
+def _shutdown():
+    """
+    Run the shutdown of the interpreter, which ``os._exit`` skips.
+
+    Like a normal exit, this waits for the non-daemon threads and calls the
+    exit functions (``atexit`` handlers).
+
+    """
+    threading = sys.modules.get('threading')
+    if threading is not None:
+        try:
+            threading._shutdown()
+        except BaseException:
+            traceback.print_exc()
+
+    if sys.version_info[0] < 3:
+        exit_func = getattr(sys, 'exitfunc', None)
+    else:
+        import atexit
+        exit_func = atexit._run_exitfuncs
+
+    if exit_func is not None:
+        try:
+            exit_func()
+        except BaseException:
+            sys.stderr.write('Error in sys.exitfunc:\n')
+            traceback.print_exc()
+
+
+def _run_script(path):
+    """
+    Execute the script at ``path`` as the ``__main__`` module.
+
+    Unlike ``runpy.run_path``, the module is kept alive after the script
+    returned (Python 2 clears the globals of a discarded module), so threads
+    and exit functions of the script can still use them.
+
+    """
+    # keep the zygote module referenced, so its globals stay intact
+    sys.modules['_job_runner_zygote'] = sys.modules.get('__main__')
+
+    main_module = types.ModuleType('__main__')
+    main_module.__file__ = path
+    main_module.__builtins__ = __builtins__
+    sys.modules['__main__'] = main_module
+
+    with open(path, 'rb') as script_file:
+        code = compile(script_file.read(), path, 'exec')
+    exec(code, main_module.__dict__)
+
+
+def _run_child(request, output_fd, ready_fd):
+    """
+    Execute the script of ``request`` in the forked child. Never returns.
+
+    ``ready_fd`` is closed once the child runs in its own session, cgroup
+    and limits, like ``Popen`` returns after its ``preexec_fn`` ran.
+
+    """
+    returncode = 1
+    try:
+        os.setsid()
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+        if request.get('cgroup_procs'):
+            with open(request['cgroup_procs'], 'w') as procs:
+                procs.write(str(os.getpid()))
+
+        for resource_type, limits in request.get('rlimits', []):
+            resource.setrlimit(resource_type, tuple(limits))
+
+        if request.get('nice'):
+            os.nice(request['nice'])
+
+        os.close(ready_fd)
+
+        null_fd = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(null_fd, 0)
+        os.dup2(output_fd, 1)
+        os.dup2(output_fd, 2)
+        os.close(null_fd)
+        os.close(output_fd)
+
+        sys.argv = [request['script']]
+        sys.path[0] = os.path.dirname(request['script'])
+        _reinitialize()
+
+        try:
+            _run_script(request['script'])
+            returncode = 0
+        except SystemExit as e:
+            if e.code is None:
+                returncode = 0
+            elif isinstance(e.code, int):
+                returncode = e.code
+            else:
+                sys.stderr.write('{0}\n'.format(e.code))
+                returncode = 1
+        except BaseException:
+            traceback.print_exc()
+            returncode = 1
+
+        _shutdown()
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(returncode & 0xff)
+
+
+def _wait_closed(fd):
+    while True:
+        try:
+            if not os.read(fd, 1):
+                return
+        except OSError as e:
+            if e.errno != errno.EINTR:
+                raise
+
+
+def _get_usage(rusage):
+    return {
+        'user_time': rusage.ru_utime,
+        'system_time': rusage.ru_stime,
+        'max_rss_kb': rusage.ru_maxrss,
+        'block_input': rusage.ru_inblock,
+        'block_output': rusage.ru_oublock,
+        'voluntary_switches': rusage.ru_nvcsw,
+        'involuntary_switches': rusage.ru_nivcsw,
+    }
+
+
+def _reap_children(sock):
+    while True:
+        try:
+            pid, status, rusage = os.wait4(-1, os.WNOHANG)
+        except OSError as e:
+            if e.errno == errno.ECHILD:
+                return
+            raise
+        if not pid:
+            return
+
+        if os.WIFSIGNALED(status):
+            returncode = -os.WTERMSIG(status)
+        else:
+            returncode = os.WEXITSTATUS(status)
+
+        _send_message(sock, {
+            'event': 'exited',
+            'pid': pid,
+            'returncode': returncode,
+            'usage': _get_usage(rusage),
+        })
+
+
+def serve(sock):
+    """
+    Handle the requests received on ``sock`` until the worker disconnects.
+    """
+    # the SIGCHLD handler wakes up the select loop through this pipe
+    wakeup_read, wakeup_write = os.pipe()
+    for fd in (wakeup_read, wakeup_write):
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def on_sigchld(signum, frame):
+        try:
+            os.write(wakeup_write, b'x')
+        except OSError:
+            pass
+
+    signal.signal(signal.SIGCHLD, on_sigchld)
+    # restart interrupted socket calls (Python 2 doesn't retry them itself)
+    signal.siginterrupt(signal.SIGCHLD, False)
+
+    while True:
+        try:
+            readable = select.select([sock, wakeup_read], [], [])[0]
+        except (select.error, OSError) as e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+
+        if wakeup_read in readable:
+            try:
+                os.read(wakeup_read, 1024)
+            except OSError:
+                pass
+            _reap_children(sock)
+
+        if sock not in readable:
+            continue
+
+        try:
+            output_fd = _recv_fd(sock)
+            request = _recv_message(sock)
+        except EOFError:
+            return
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        ready_read, ready_write = os.pipe()
+
+        try:
+            pid = os.fork()
+        except OSError as e:
+            for fd in (output_fd, ready_read, ready_write):
+                os.close(fd)
+            _send_message(sock, {'event': 'failed', 'error': str(e)})
+            continue
+
+        if pid == 0:
+            sock.close()
+            for fd in (wakeup_read, wakeup_write, ready_read):
+                os.close(fd)
+            _run_child(request, output_fd, ready_write)
+
+        os.close(output_fd)
+        os.close(ready_write)
+        _wait_closed(ready_read)
+        os.close(ready_read)
+        _send_message(sock, {'event': 'started', 'pid': pid})
+
+
+def main():
+    for module_name in sys.argv[1:]:
+        try:
+            __import__(module_name)
+        except Exception as e:
+            sys.stderr.write('Zygote unable to pre-import {0}: {1}\n'.format(
+                module_name, e))
+
+    sock = socket.fromfd(0, socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.setblocking(True)
+    os.close(0)
+    os.open(os.devnull, os.O_RDONLY)
+
+    serve(sock)
+
+
+if __name__ == '__main__':
+    main()